@@ -0,0 +1,821 @@
+# mock_exchange.py
+# =============================================================================
+#  SÀN BINANCE FUTURES GIẢ LẬP (OFFLINE) – dùng để test / benchmark trading_bot_lib.py
+#  không cần API key thật và không chạm vào sàn thật.
+#
+#  REST: exchangeInfo, time, ticker/price, ticker/24hr, account (v2), positionRisk (v2),
+#        leverage, order (POST/GET), allOpenOrders (DELETE)
+#  WebSocket: combined stream /stream?streams=<symbol>@trade/... (+ SUBSCRIBE/UNSUBSCRIBE),
+#             !markPrice@arr@1s, !miniTicker@arr
+#  User-data: listenKey (POST/PUT/DELETE) + /ws/<listenKey> với ORDER_TRADE_UPDATE / ACCOUNT_UPDATE
+#
+#  Chạy độc lập:
+#      python mock_exchange.py --port 8765 --latency-ms 20 --error-rate 0.01
+#  Rồi trỏ bot vào sàn giả lập:
+#      BINANCE_REST_BASE=http://127.0.0.1:8765 BINANCE_WS_BASE=ws://127.0.0.1:8765 python main.py
+#
+#  Hoặc dùng trong code:
+#      exchange = MockExchange(port=0).start()
+#      set_binance_base_urls(exchange.rest_url, exchange.ws_url)
+# =============================================================================
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import math
+import random
+import struct
+import threading
+import time
+import urllib.parse
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+# Trọng số endpoint dùng chung bảng của trading_bot_lib (không sao chép) – để trả header X-MBX-USED-WEIGHT-1M
+from trading_bot_lib import _ENDPOINT_WEIGHTS
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+class MockConfig:
+    """Cấu hình hành vi sàn giả lập: độ trễ, khớp lệnh và tiêm lỗi"""
+    def __init__(self, **kwargs):
+        self.latency_ms = 0.0               # Độ trễ cố định mỗi request REST
+        self.latency_jitter_ms = 0.0        # Độ trễ ngẫu nhiên cộng thêm (0..jitter)
+        self.error_rate = 0.0               # Xác suất trả HTTP 503
+        self.rate_limit_rate = 0.0          # Xác suất trả HTTP 429
+        self.retry_after = 5                # Header Retry-After khi trả 429
+        self.margin_error_rate = 0.0        # Xác suất từ chối lệnh với -2019
+        self.clock_offset_ms = 0            # Giờ server lệch so với giờ máy (test đồng bộ giờ)
+        self.api_secret = None              # Nếu có: kiểm tra chữ ký HMAC
+        self.fill_ratio = 1.0               # Tỷ lệ khối lượng được khớp (0..1)
+        self.slippage_bps = 0.0             # Trượt giá khi khớp (basis points)
+        self.position_delay = 0.0           # Số giây trước khi vị thế mới hiện trong positionRisk
+        self.wallet_balance = 10000.0       # Số dư ví USDT ban đầu
+        self.trade_interval = 0.1           # Chu kỳ sinh trade trên WebSocket (giây)
+        self.trades_per_tick = 1            # Số trade mỗi symbol mỗi chu kỳ
+        self.volatility = 0.0005            # Độ lệch chuẩn bước giá mỗi chu kỳ
+        self.user_event_delay = 0.0         # Độ trễ đẩy sự kiện user-data sau khi khớp lệnh (giây)
+        self.ws_message_limit = 10          # Số tin nhắn điều khiển tối đa/giây/kết nối (vượt → ngắt như sàn thật)
+        self.ws_max_streams = 1024          # Số stream tối đa trên một kết nối
+        for key, value in kwargs.items():
+            if not hasattr(self, key):
+                raise ValueError(f"Cấu hình không hợp lệ: {key}")
+            setattr(self, key, value)
+
+class _ApiError(Exception):
+    def __init__(self, status, code, msg, headers=None):
+        super().__init__(msg)
+        self.status = status
+        self.code = code
+        self.msg = msg
+        self.headers = headers or {}
+
+# ========== WEBSOCKET TỐI GIẢN (RFC 6455) ==========
+def _ws_encode(payload: bytes, opcode=0x1) -> bytes:
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 65536:
+        header += bytes([126]) + struct.pack('>H', length)
+    else:
+        header += bytes([127]) + struct.pack('>Q', length)
+    return header + payload
+
+def _recv_exact(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("socket closed")
+        data += chunk
+    return data
+
+def _ws_read_frame(sock):
+    b1, b2 = _recv_exact(sock, 2)
+    opcode = b1 & 0x0F
+    length = b2 & 0x7F
+    if length == 126:
+        length = struct.unpack('>H', _recv_exact(sock, 2))[0]
+    elif length == 127:
+        length = struct.unpack('>Q', _recv_exact(sock, 8))[0]
+    mask = _recv_exact(sock, 4) if b2 & 0x80 else None
+    payload = _recv_exact(sock, length) if length else b''
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+class _WsClient:
+    def __init__(self, sock, streams, combined):
+        self.sock = sock
+        self.streams = set(streams)
+        self.combined = combined
+        self.lock = threading.Lock()
+        self.alive = True
+        self.message_times = deque()
+
+    def send_text(self, text):
+        try:
+            with self.lock:
+                self.sock.sendall(_ws_encode(text.encode()))
+        except OSError:
+            self.alive = False
+
+    def send_event(self, stream, data):
+        payload = {"stream": stream, "data": data} if self.combined else data
+        self.send_text(json.dumps(payload))
+
+    def close(self):
+        self.alive = False
+        try:
+            with self.lock:
+                self.sock.sendall(_ws_encode(b'', opcode=0x8))
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+# ========== SÀN GIẢ LẬP ==========
+class MockExchange:
+    def __init__(self, host='127.0.0.1', port=0, symbols=50, config: Optional[MockConfig] = None, seed=None):
+        self.config = config or MockConfig()
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+        self._host = host
+        self._port = port
+        self._server = None
+        self._threads: List[threading.Thread] = []
+        self._stop_event = threading.Event()
+        self._ws_clients: List[_WsClient] = []
+
+        self.symbols: Dict[str, Dict] = {}
+        self.positions: Dict[str, Dict] = {}     # symbol -> {'amt', 'entry', 'visible_at', 'prev'}
+        self.leverage: Dict[str, int] = {}
+        self.orders: Dict[int, Dict] = {}
+        self.wallet_balance = float(self.config.wallet_balance)
+        self._next_order_id = 1
+        self._trade_id = 1
+        self._weight_minute = 0
+        self._used_weight = 0
+        self._order_times: List[float] = []
+        self.request_counts: Dict[str, int] = {}
+        self.listen_key: Optional[str] = None
+        self.ws_limit_disconnects = 0
+        self._generate_universe(symbols)
+
+    # ----- Dữ liệu thị trường -----
+    def _generate_universe(self, count):
+        base = [('BTCUSDT', 'USDT', 60000.0), ('ETHUSDT', 'USDT', 3000.0), ('BTCUSDC', 'USDC', 60000.0)]
+        for i in range(count):
+            quote = 'USDC' if i % 10 == 9 else 'USDT'
+            # Giá phân bố log-đều từ 0.01 đến 500 để có cả coin rẻ (MUA) và coin đắt (BÁN)
+            price = 10 ** self._rng.uniform(-2, math.log10(500))
+            base.append((f"MOCK{i:03d}{quote}", quote, price))
+        for symbol, quote, price in base:
+            step = 1.0 if price < 1 else (0.1 if price < 10 else 0.001)
+            self.symbols[symbol] = {
+                'symbol': symbol,
+                'quote': quote,
+                'status': 'TRADING',
+                'price': price,
+                'open_price': price,
+                'volume': self._rng.uniform(1e4, 1e8) / max(price, 0.01),
+                'step_size': step,
+                'min_qty': step,
+                'min_notional': 5.0,
+                'max_leverage': self._rng.choice([20, 25, 50, 75, 125]),
+            }
+        # Một symbol không giao dịch để kiểm tra bộ lọc status
+        self.symbols['HALTUSDT'] = dict(self.symbols[base[-1][0]], symbol='HALTUSDT', status='SETTLING')
+
+    def _step_prices(self):
+        with self._lock:
+            for info in self.symbols.values():
+                info['price'] *= math.exp(self._rng.gauss(0, self.config.volatility))
+                info['volume'] += self._rng.uniform(0, 10)
+
+    def set_price(self, symbol, price):
+        """Đặt giá thủ công (vd. để kích hoạt TP/SL trong test)"""
+        with self._lock:
+            self.symbols[symbol.upper()]['price'] = float(price)
+
+    def server_time_ms(self):
+        return int(time.time() * 1000 + self.config.clock_offset_ms)
+
+    # ----- Vòng đời -----
+    @property
+    def rest_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def ws_url(self):
+        host, port = self._server.server_address[:2]
+        return f"ws://{host}:{port}"
+
+    def start(self):
+        handler = type('MockHandler', (_MockHandler,), {'exchange': self})
+        self._server = ThreadingHTTPServer((self._host, self._port), handler)
+        self._server.daemon_threads = True
+        for target, name in ((self._server.serve_forever, 'mock-http'), (self._ticker_loop, 'mock-ticker')):
+            thread = threading.Thread(target=target, daemon=True, name=name)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self.drop_ws_connections()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def drop_ws_connections(self):
+        """Đóng mọi kết nối WebSocket (mô phỏng mất mạng để test kết nối lại)"""
+        with self._lock:
+            clients = list(self._ws_clients)
+            self._ws_clients.clear()
+        for client in clients:
+            client.close()
+
+    def expire_listen_key(self):
+        """Gửi listenKeyExpired rồi vô hiệu hoá listenKey hiện tại (test gia hạn/đồng bộ lại)"""
+        with self._lock:
+            key, self.listen_key = self.listen_key, None
+        if key:
+            self._push_user_event(key, {"e": "listenKeyExpired", "E": self.server_time_ms(), "listenKey": key})
+
+    # ----- Luồng user-data -----
+    def _listen_key_route(self, method):
+        def handler(params):
+            with self._lock:
+                if method == 'POST':
+                    if self.listen_key is None:
+                        self.listen_key = base64.urlsafe_b64encode(self._rng.randbytes(48)).decode().rstrip('=')
+                    return {"listenKey": self.listen_key}
+                if self.listen_key is None:
+                    raise _ApiError(400, -1125, "This listenKey does not exist.")
+                if method == 'DELETE':
+                    self.listen_key = None
+                return {}
+        return handler
+
+    def _push_user_event(self, key, event):
+        with self._lock:
+            clients = [c for c in self._ws_clients if c.alive and key in c.streams]
+        for client in clients:
+            client.send_event(key, event)
+
+    def _publish_fill(self, order, amt, entry):
+        key = self.listen_key
+        if not key:
+            return
+        now = self.server_time_ms()
+        mark = self.symbols[order['symbol']]['price']
+        order_event = {
+            "e": "ORDER_TRADE_UPDATE", "E": now, "T": now,
+            "o": {"s": order['symbol'], "c": order['clientOrderId'], "S": order['side'], "o": "MARKET",
+                  "f": "GTC", "q": order['origQty'], "p": "0", "ap": order['avgPrice'], "sp": "0",
+                  "x": "TRADE", "X": order['status'], "i": order['orderId'], "l": order['executedQty'],
+                  "z": order['executedQty'], "L": order['avgPrice'], "n": "0", "N": "USDT", "T": now,
+                  "t": order['orderId'], "m": False, "R": order['reduceOnly'], "ps": "BOTH", "rp": "0"},
+        }
+        account_event = {
+            "e": "ACCOUNT_UPDATE", "E": now, "T": now,
+            "a": {"m": "ORDER",
+                  "B": [{"a": "USDT", "wb": f"{self.wallet_balance:.8f}", "cw": f"{self.wallet_balance:.8f}", "bc": "0"}],
+                  "P": [{"s": order['symbol'], "pa": f"{amt:.8f}", "ep": f"{entry:.8f}", "bep": f"{entry:.8f}",
+                         "cr": "0", "up": f"{(mark - entry) * amt:.8f}", "mt": "cross", "iw": "0", "ps": "BOTH"}]},
+        }
+
+        def push():
+            self._push_user_event(key, order_event)
+            self._push_user_event(key, account_event)
+        if self.config.user_event_delay > 0:
+            threading.Timer(self.config.user_event_delay, push).start()
+        else:
+            push()
+
+    # ----- WebSocket -----
+    def _ticker_loop(self):
+        ticks_per_second = max(1, round(1 / self.config.trade_interval))
+        tick = 0
+        while not self._stop_event.wait(self.config.trade_interval):
+            tick += 1
+            self._step_prices()
+            with self._lock:
+                clients = [c for c in self._ws_clients if c.alive]
+                self._ws_clients = clients
+            for client in clients:
+                for stream in list(client.streams):
+                    if stream.startswith('!'):
+                        # Luồng toàn thị trường: đẩy mỗi giây
+                        if tick % ticks_per_second == 0:
+                            event = self._market_event(stream)
+                            if event is not None:
+                                client.send_event(stream, event)
+                        continue
+                    if stream.endswith('@1s'):
+                        if tick % ticks_per_second == 0:
+                            event = self._stream_event(stream)
+                            if event is not None:
+                                client.send_event(stream, event)
+                        continue
+                    # aggTrade gộp các trade của một chu kỳ thành một tin
+                    repeats = 1 if stream.endswith('@aggtrade') else self.config.trades_per_tick
+                    for _ in range(repeats):
+                        event = self._stream_event(stream)
+                        if event is not None:
+                            client.send_event(stream, event)
+
+    def _market_event(self, stream):
+        now = self.server_time_ms()
+        with self._lock:
+            infos = [i for i in self.symbols.values() if i['status'] == 'TRADING']
+            if stream == '!markprice@arr@1s':
+                return [{"e": "markPriceUpdate", "E": now, "s": i['symbol'], "p": f"{i['price']:.8f}",
+                         "i": f"{i['price']:.8f}", "P": f"{i['price']:.8f}", "r": "0.00010000",
+                         "T": now + 3600000} for i in infos]
+            if stream == '!miniticker@arr':
+                return [{"e": "24hrMiniTicker", "E": now, "s": i['symbol'], "c": f"{i['price']:.8f}",
+                         "o": f"{i['open_price']:.8f}", "h": f"{max(i['price'], i['open_price']):.8f}",
+                         "l": f"{min(i['price'], i['open_price']):.8f}", "v": f"{i['volume']:.3f}",
+                         "q": f"{i['volume'] * i['price']:.3f}"} for i in infos]
+        return None
+
+    def _stream_event(self, stream):
+        symbol, _, kind = stream.partition('@')
+        info = self.symbols.get(symbol.upper())
+        if info is None:
+            return None
+        now = self.server_time_ms()
+        if kind == 'trade':
+            with self._lock:
+                self._trade_id += 1
+                trade_id = self._trade_id
+            return {"e": "trade", "E": now, "T": now, "s": info['symbol'], "t": trade_id,
+                    "p": f"{info['price']:.8f}", "q": f"{info['step_size']:.8f}",
+                    "X": "MARKET", "m": self._rng.random() < 0.5}
+        if kind == 'aggtrade':
+            with self._lock:
+                first = self._trade_id + 1
+                self._trade_id += self.config.trades_per_tick
+                last = self._trade_id
+            return {"e": "aggTrade", "E": now, "a": last, "s": info['symbol'], "p": f"{info['price']:.8f}",
+                    "q": f"{info['step_size'] * self.config.trades_per_tick:.8f}", "f": first, "l": last,
+                    "T": now, "m": self._rng.random() < 0.5}
+        if kind == 'bookticker':
+            half_spread = info['price'] * 0.0001
+            return {"e": "bookTicker", "u": now, "E": now, "T": now, "s": info['symbol'],
+                    "b": f"{info['price'] - half_spread:.8f}", "B": "100",
+                    "a": f"{info['price'] + half_spread:.8f}", "A": "100"}
+        if kind == 'markprice@1s':
+            return {"e": "markPriceUpdate", "E": now, "s": info['symbol'], "p": f"{info['price']:.8f}",
+                    "i": f"{info['price']:.8f}", "P": f"{info['price']:.8f}", "r": "0.00010000",
+                    "T": now + 3600000}
+        return None
+
+    def _handle_ws_message(self, client, text):
+        try:
+            message = json.loads(text)
+        except ValueError:
+            return
+        now = time.time()
+        client.message_times.append(now)
+        while client.message_times and now - client.message_times[0] > 1:
+            client.message_times.popleft()
+        if len(client.message_times) > self.config.ws_message_limit:
+            self.ws_limit_disconnects += 1
+            client.close()
+            return
+        method = message.get('method')
+        params = [p.lower() for p in message.get('params', [])]
+        result = None
+        if method == 'SUBSCRIBE':
+            if len(client.streams | set(params)) > self.config.ws_max_streams:
+                client.send_text(json.dumps({"error": {"code": 2, "msg": "Too many streams"},
+                                             "id": message.get('id')}))
+                return
+            client.streams.update(params)
+        elif method == 'UNSUBSCRIBE':
+            client.streams.difference_update(params)
+        elif method == 'LIST_SUBSCRIPTIONS':
+            result = sorted(client.streams)
+        client.send_text(json.dumps({"result": result, "id": message.get('id')}))
+
+    def serve_websocket(self, handler, streams, combined):
+        client = _WsClient(handler.connection, streams, combined)
+        with self._lock:
+            self._ws_clients.append(client)
+        try:
+            while client.alive and not self._stop_event.is_set():
+                opcode, payload = _ws_read_frame(handler.connection)
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    with client.lock:
+                        handler.connection.sendall(_ws_encode(payload, opcode=0xA))
+                elif opcode == 0x1:
+                    self._handle_ws_message(client, payload.decode(errors='replace'))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            client.alive = False
+
+    # ----- REST -----
+    def _charge_weight(self, method, path, params):
+        weight = _ENDPOINT_WEIGHTS.get(path, 1)
+        if isinstance(weight, tuple):
+            weight = weight[0] if 'symbol' in params else weight[1]
+        now = time.time()
+        with self._lock:
+            minute = int(now // 60)
+            if minute != self._weight_minute:
+                self._weight_minute = minute
+                self._used_weight = 0
+            self._used_weight += weight
+            headers = {'X-MBX-USED-WEIGHT-1M': str(self._used_weight)}
+            if method == 'POST' and path == '/fapi/v1/order':
+                self._order_times = [t for t in self._order_times if now - t < 60]
+                self._order_times.append(now)
+                headers['X-MBX-ORDER-COUNT-10S'] = str(sum(1 for t in self._order_times if now - t < 10))
+                headers['X-MBX-ORDER-COUNT-1M'] = str(len(self._order_times))
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+        return headers
+
+    def _check_signed(self, raw_query, params, headers):
+        if 'timestamp' not in params:
+            return
+        self._check_api_key(headers)
+        if self.config.api_secret:
+            payload, _, signature = raw_query.rpartition('&signature=')
+            expected = hmac.new(self.config.api_secret.encode(), payload.encode(), hashlib.sha256).hexdigest()
+            if signature != expected:
+                raise _ApiError(400, -1022, "Signature for this request is not valid.")
+        timestamp = int(params['timestamp'])
+        recv_window = int(params.get('recvWindow', 5000))
+        server_now = self.server_time_ms()
+        if timestamp > server_now + 1000 or server_now - timestamp > recv_window:
+            raise _ApiError(400, -1021, "Timestamp for this request is outside of the recvWindow.")
+
+    @staticmethod
+    def _check_api_key(headers):
+        if not headers.get('X-MBX-APIKEY'):
+            raise _ApiError(401, -2015, "Invalid API-key, IP, or permissions for action.")
+
+    def handle_rest(self, method, path, raw_query, params, headers):
+        """Trả về (status, body, headers)"""
+        delay = self.config.latency_ms + self._rng.uniform(0, self.config.latency_jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        extra = self._charge_weight(method, path, params)
+        try:
+            if self._rng.random() < self.config.error_rate:
+                raise _ApiError(503, -1001, "Service Unavailable (mock)")
+            if self._rng.random() < self.config.rate_limit_rate:
+                raise _ApiError(429, -1003, "Too many requests (mock)",
+                                {'Retry-After': str(self.config.retry_after)})
+            self._check_signed(raw_query, params, headers)
+            if path == '/fapi/v1/listenKey':
+                self._check_api_key(headers)
+            route = self._routes().get((method, path))
+            if route is None:
+                raise _ApiError(404, -5000, f"Path {path} not found (mock)")
+            return 200, route(params), extra
+        except _ApiError as e:
+            extra.update(e.headers)
+            return e.status, {"code": e.code, "msg": e.msg}, extra
+
+    def _routes(self):
+        return {
+            ('GET', '/fapi/v1/time'): lambda p: {"serverTime": self.server_time_ms()},
+            ('GET', '/fapi/v1/exchangeInfo'): self._exchange_info,
+            ('GET', '/fapi/v1/ticker/price'): self._ticker_price,
+            ('GET', '/fapi/v1/ticker/24hr'): self._ticker_24hr,
+            ('GET', '/fapi/v2/account'): self._account,
+            ('GET', '/fapi/v2/positionRisk'): self._position_risk,
+            ('POST', '/fapi/v1/leverage'): self._set_leverage,
+            ('POST', '/fapi/v1/order'): self._new_order,
+            ('GET', '/fapi/v1/order'): self._query_order,
+            ('POST', '/fapi/v1/listenKey'): self._listen_key_route('POST'),
+            ('PUT', '/fapi/v1/listenKey'): self._listen_key_route('PUT'),
+            ('DELETE', '/fapi/v1/listenKey'): self._listen_key_route('DELETE'),
+            ('DELETE', '/fapi/v1/allOpenOrders'): lambda p: {
+                "code": 200, "msg": "The operation of cancel all open order is done."},
+        }
+
+    def _symbol(self, params):
+        symbol = params.get('symbol', '').upper()
+        if symbol not in self.symbols:
+            raise _ApiError(400, -1121, "Invalid symbol.")
+        return self.symbols[symbol]
+
+    def _exchange_info(self, params):
+        with self._lock:
+            symbols = []
+            for info in self.symbols.values():
+                symbols.append({
+                    "symbol": info['symbol'], "pair": info['symbol'], "contractType": "PERPETUAL",
+                    "status": info['status'], "baseAsset": info['symbol'][:-len(info['quote'])],
+                    "quoteAsset": info['quote'], "marginAsset": info['quote'],
+                    "pricePrecision": 8, "quantityPrecision": 3,
+                    "filters": [
+                        {"filterType": "PRICE_FILTER", "minPrice": "0.00001", "maxPrice": "1000000", "tickSize": "0.00001"},
+                        {"filterType": "LOT_SIZE", "stepSize": str(info['step_size']),
+                         "minQty": str(info['min_qty']), "maxQty": "10000000"},
+                        {"filterType": "MARKET_LOT_SIZE", "stepSize": str(info['step_size']),
+                         "minQty": str(info['min_qty']), "maxQty": "1000000"},
+                        {"filterType": "MAX_NUM_ORDERS", "limit": 200},
+                        {"filterType": "MIN_NOTIONAL", "notional": str(info['min_notional'])},
+                        {"filterType": "PERCENT_PRICE", "multiplierUp": "1.05", "multiplierDown": "0.95"},
+                    ],
+                    "orderTypes": ["LIMIT", "MARKET", "STOP", "TAKE_PROFIT"],
+                    "timeInForce": ["GTC", "IOC", "FOK", "GTX"],
+                })
+        return {
+            "timezone": "UTC", "serverTime": self.server_time_ms(), "futuresType": "U_MARGINED",
+            "rateLimits": [
+                {"rateLimitType": "REQUEST_WEIGHT", "interval": "MINUTE", "intervalNum": 1, "limit": 2400},
+                {"rateLimitType": "ORDERS", "interval": "MINUTE", "intervalNum": 1, "limit": 1200},
+                {"rateLimitType": "ORDERS", "interval": "SECOND", "intervalNum": 10, "limit": 300},
+            ],
+            "exchangeFilters": [],
+            "assets": [{"asset": "USDT", "marginAvailable": True}, {"asset": "USDC", "marginAvailable": True}],
+            "symbols": symbols,
+        }
+
+    def _ticker_price(self, params):
+        now = self.server_time_ms()
+        if 'symbol' in params:
+            info = self._symbol(params)
+            return {"symbol": info['symbol'], "price": f"{info['price']:.8f}", "time": now}
+        with self._lock:
+            return [{"symbol": s, "price": f"{i['price']:.8f}", "time": now} for s, i in self.symbols.items()]
+
+    def _ticker_row(self, info):
+        change = info['price'] - info['open_price']
+        return {
+            "symbol": info['symbol'], "priceChange": f"{change:.8f}",
+            "priceChangePercent": f"{change / info['open_price'] * 100:.3f}",
+            "lastPrice": f"{info['price']:.8f}", "openPrice": f"{info['open_price']:.8f}",
+            "volume": f"{info['volume']:.3f}", "quoteVolume": f"{info['volume'] * info['price']:.3f}",
+            "closeTime": self.server_time_ms(),
+        }
+
+    def _ticker_24hr(self, params):
+        if 'symbol' in params:
+            return self._ticker_row(self._symbol(params))
+        with self._lock:
+            return [self._ticker_row(info) for info in self.symbols.values()]
+
+    # ----- Tài khoản / vị thế -----
+    def _position_view(self, symbol, now):
+        pos = self.positions.get(symbol)
+        if pos is None:
+            return 0.0, 0.0
+        if now < pos['visible_at']:
+            return pos['prev']
+        return pos['amt'], pos['entry']
+
+    def _position_row(self, symbol, now):
+        amt, entry = self._position_view(symbol, now)
+        mark = self.symbols[symbol]['price']
+        pnl = (mark - entry) * amt if amt else 0.0
+        return {
+            "symbol": symbol, "positionAmt": f"{amt:.8f}", "entryPrice": f"{entry:.8f}",
+            "markPrice": f"{mark:.8f}", "unRealizedProfit": f"{pnl:.8f}",
+            "liquidationPrice": "0", "leverage": str(self.leverage.get(symbol, 20)),
+            "marginType": "cross", "isolatedMargin": "0.00000000", "positionSide": "BOTH",
+            "notional": f"{amt * mark:.8f}", "updateTime": int(now * 1000),
+        }
+
+    def _account(self, params):
+        now = time.time()
+        with self._lock:
+            unrealized = 0.0
+            used_margin = 0.0
+            maint_margin = 0.0
+            positions = []
+            for symbol in self.positions:
+                row = self._position_row(symbol, now)
+                amt = float(row['positionAmt'])
+                if not amt:
+                    continue
+                notional = abs(amt) * self.symbols[symbol]['price']
+                unrealized += float(row['unRealizedProfit'])
+                used_margin += notional / self.leverage.get(symbol, 20)
+                maint_margin += notional * 0.004
+                positions.append(row)
+            margin_balance = self.wallet_balance + unrealized
+            available = max(0.0, margin_balance - used_margin)
+            return {
+                "totalWalletBalance": f"{self.wallet_balance:.8f}",
+                "totalUnrealizedProfit": f"{unrealized:.8f}",
+                "totalMarginBalance": f"{margin_balance:.8f}",
+                "totalMaintMargin": f"{maint_margin:.8f}",
+                "totalInitialMargin": f"{used_margin:.8f}",
+                "availableBalance": f"{available:.8f}",
+                "maxWithdrawAmount": f"{available:.8f}",
+                "assets": [
+                    {"asset": "USDT", "walletBalance": f"{self.wallet_balance:.8f}",
+                     "unrealizedProfit": f"{unrealized:.8f}", "marginBalance": f"{margin_balance:.8f}",
+                     "maintMargin": f"{maint_margin:.8f}", "availableBalance": f"{available:.8f}"},
+                    {"asset": "USDC", "walletBalance": "0.00000000", "unrealizedProfit": "0.00000000",
+                     "marginBalance": "0.00000000", "maintMargin": "0.00000000", "availableBalance": "0.00000000"},
+                ],
+                "positions": positions,
+            }
+
+    def _position_risk(self, params):
+        now = time.time()
+        with self._lock:
+            if 'symbol' in params:
+                return [self._position_row(self._symbol(params)['symbol'], now)]
+            return [self._position_row(symbol, now) for symbol in self.symbols]
+
+    def _set_leverage(self, params):
+        info = self._symbol(params)
+        lev = int(params.get('leverage', 0))
+        if lev < 1 or lev > info['max_leverage']:
+            raise _ApiError(400, -4028, f"Leverage {lev} is not valid")
+        with self._lock:
+            self.leverage[info['symbol']] = lev
+        return {"symbol": info['symbol'], "leverage": lev, "maxNotionalValue": "1000000"}
+
+    def _new_order(self, params):
+        info = self._symbol(params)
+        symbol = info['symbol']
+        side = params.get('side')
+        if side not in ('BUY', 'SELL') or params.get('type') != 'MARKET':
+            raise _ApiError(400, -1116, "Invalid orderType (mock chỉ hỗ trợ MARKET).")
+        qty = float(params.get('quantity', 0))
+        if qty < info['min_qty']:
+            raise _ApiError(400, -4003, "Quantity less than or equal to zero.")
+        if self._rng.random() < self.config.margin_error_rate:
+            raise _ApiError(400, -2019, "Margin is insufficient.")
+
+        with self._lock:
+            slip = self.config.slippage_bps / 10000
+            price = info['price'] * (1 + slip if side == 'BUY' else 1 - slip)
+            executed = math.floor(qty * self.config.fill_ratio / info['step_size']) * info['step_size']
+            executed = round(executed, 8)
+            signed_qty = executed if side == 'BUY' else -executed
+
+            now = time.time()
+            pos = self.positions.get(symbol, {'amt': 0.0, 'entry': 0.0, 'visible_at': 0, 'prev': (0.0, 0.0)})
+            old_amt, old_entry = pos['amt'], pos['entry']
+            increasing = old_amt == 0 or (old_amt > 0) == (signed_qty > 0)
+            if increasing:
+                lev = self.leverage.get(symbol, 20)
+                available = float(self._account({})['availableBalance'])
+                if executed * price / lev > available:
+                    raise _ApiError(400, -2019, "Margin is insufficient.")
+                new_amt = old_amt + signed_qty
+                new_entry = ((old_entry * abs(old_amt) + price * executed) / abs(new_amt)) if new_amt else 0.0
+            else:
+                closed = min(abs(signed_qty), abs(old_amt))
+                direction = 1 if old_amt > 0 else -1
+                self.wallet_balance += (price - old_entry) * closed * direction
+                new_amt = old_amt + signed_qty
+                new_entry = old_entry if abs(new_amt) > 1e-12 and (new_amt > 0) == (old_amt > 0) else (
+                    price if abs(new_amt) > 1e-12 else 0.0)
+            if abs(new_amt) < 1e-12:
+                new_amt, new_entry = 0.0, 0.0
+            self.positions[symbol] = {
+                'amt': new_amt, 'entry': new_entry,
+                'visible_at': now + self.config.position_delay,
+                'prev': self._position_view(symbol, now),
+            }
+
+            order_id = self._next_order_id
+            self._next_order_id += 1
+            # Lệnh MARKET không treo: phần chưa khớp hết hạn ngay như trên sàn thật
+            status = 'FILLED' if executed >= qty else 'EXPIRED'
+            order = {
+                "orderId": order_id, "symbol": symbol, "status": status,
+                "clientOrderId": params.get('newClientOrderId') or f"mock_{order_id}",
+                "price": "0", "avgPrice": f"{price:.8f}", "origQty": f"{qty:.8f}",
+                "executedQty": f"{executed:.8f}", "cumQuote": f"{executed * price:.8f}",
+                "timeInForce": "GTC", "type": "MARKET", "reduceOnly": params.get('reduceOnly') == 'true',
+                "side": side, "positionSide": "BOTH", "updateTime": int(now * 1000),
+            }
+            self.orders[order_id] = order
+        if executed > 0:
+            self._publish_fill(order, new_amt, new_entry)
+
+        if params.get('newOrderRespType', 'ACK') == 'RESULT':
+            return dict(order)
+        # Phản hồi ACK: giống sàn thật, chưa có thông tin khớp
+        return dict(order, status='NEW', executedQty="0", avgPrice="0.00000", cumQuote="0")
+
+    def _query_order(self, params):
+        self._symbol(params)
+        if params.get('origClientOrderId'):
+            order = next((o for o in self.orders.values()
+                          if o['clientOrderId'] == params['origClientOrderId']), None)
+        else:
+            order = self.orders.get(int(params.get('orderId', 0)))
+        if order is None:
+            raise _ApiError(400, -2013, "Order does not exist.")
+        return dict(order)
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Header và body được ghi thành hai lần: không tắt Nagle thì mỗi request keep-alive
+    # dính ~40ms chờ delayed-ACK, làm sai lệch benchmark kết nối giữ sống / đo RTT đồng bộ giờ
+    disable_nagle_algorithm = True
+    exchange: MockExchange = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        parts = urllib.parse.urlsplit(self.path)
+        if self.headers.get('Upgrade', '').lower() == 'websocket':
+            self._upgrade_websocket(parts)
+            return
+
+        params = dict(urllib.parse.parse_qsl(parts.query))
+        raw_query = parts.query
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length).decode()
+            params.update(urllib.parse.parse_qsl(body))
+            raw_query = f"{raw_query}&{body}" if raw_query else body
+
+        status, body, headers = self.exchange.handle_rest(self.command, parts.path, raw_query, params, self.headers)
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def _upgrade_websocket(self, parts):
+        key = self.headers.get('Sec-WebSocket-Key', '')
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+
+        if parts.path == '/stream':
+            query = dict(urllib.parse.parse_qsl(parts.query))
+            streams = [s for s in query.get('streams', '').lower().split('/') if s]
+            self.exchange.serve_websocket(self, streams, combined=True)
+        elif parts.path.startswith('/ws/'):
+            # listenKey phân biệt hoa thường, tên stream thị trường thì không
+            streams = [s if s == self.exchange.listen_key else s.lower()
+                       for s in parts.path[len('/ws/'):].split('/') if s]
+            self.exchange.serve_websocket(self, streams, combined=False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Sàn Binance Futures giả lập cho test/benchmark")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--symbols', type=int, default=50, help="Số symbol giả lập")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--latency-jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Xác suất HTTP 503")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Xác suất HTTP 429")
+    parser.add_argument('--margin-error-rate', type=float, default=0.0, help="Xác suất lỗi -2019")
+    parser.add_argument('--clock-offset-ms', type=int, default=0)
+    parser.add_argument('--fill-ratio', type=float, default=1.0)
+    parser.add_argument('--slippage-bps', type=float, default=0.0)
+    parser.add_argument('--position-delay', type=float, default=0.0)
+    parser.add_argument('--trade-interval', type=float, default=0.1)
+    parser.add_argument('--trades-per-tick', type=int, default=1)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency_ms=args.latency_ms, latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+        margin_error_rate=args.margin_error_rate, clock_offset_ms=args.clock_offset_ms,
+        fill_ratio=args.fill_ratio, slippage_bps=args.slippage_bps,
+        position_delay=args.position_delay, trade_interval=args.trade_interval,
+        trades_per_tick=args.trades_per_tick,
+    )
+    exchange = MockExchange(args.host, args.port, symbols=args.symbols, config=config, seed=args.seed).start()
+    print(f"🟢 Sàn giả lập đang chạy: {exchange.rest_url}")
+    print(f"   BINANCE_REST_BASE={exchange.rest_url} BINANCE_WS_BASE={exchange.ws_url} python main.py")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        exchange.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trading_bot_lib as t
+
+URL = 'https://fapi.example/fapi/v1/ticker/price'
+ENDPOINT = '/fapi/v1/ticker/price'
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = t.CircuitBreakerRegistry()
+    monkeypatch.setattr(t, '_CIRCUIT_BREAKERS', registry)
+    monkeypatch.setattr(t.time, 'sleep', lambda _: None)
+    return registry
+
+
+def _half_open(breaker):
+    """Đưa breaker về trạng thái sắp thăm dò: đã mở và hết thời gian chờ"""
+    breaker.trip(30, 'test', t.time.time())
+    breaker.opened_until = 0
+
+
+def _respond(monkeypatch, status=None, error=None, body=b'{}'):
+    def request(method, url, body=None, headers=None, consumer=None):
+        if error is not None:
+            raise error
+        return status, {}, payload
+    payload = body
+    monkeypatch.setattr(t._HTTP_TRANSPORT, 'request', request)
+
+
+def _global(registry):
+    return registry._breakers[registry.GLOBAL]
+
+
+@pytest.mark.parametrize('outcome', [
+    {'status': 503},
+    {'status': 451},
+    {'error': TimeoutError('read timed out')},
+    {'error': ConnectionResetError('reset by peer')},
+])
+def test_failed_global_probe_reopens_global_breaker(registry, monkeypatch, outcome):
+    _half_open(_global(registry))
+    _respond(monkeypatch, **outcome)
+
+    assert t._send_binance_request(URL, 'GET', None, None, t.PRIORITY_MARKET) is None
+
+    breaker = _global(registry)
+    assert breaker.state == t.CircuitBreaker.OPEN
+    assert not breaker.probe_in_flight
+    # Hết thời gian mở lại → lượt thăm dò mới được cấp, không bị treo
+    breaker.opened_until = 0
+    assert registry.allow(ENDPOINT)
+
+
+def test_successful_global_probe_closes_global_breaker(registry, monkeypatch):
+    _half_open(_global(registry))
+    _respond(monkeypatch, status=200)
+
+    assert t._send_binance_request(URL, 'GET', None, None, t.PRIORITY_MARKET) == {}
+    assert _global(registry).state == t.CircuitBreaker.CLOSED
+
+
+def test_endpoint_refusal_releases_global_probe(registry):
+    _half_open(_global(registry))
+    registry._get(ENDPOINT).trip(60, 'test', t.time.time())
+
+    assert not registry.allow(ENDPOINT)
+    breaker = _global(registry)
+    assert breaker.state == t.CircuitBreaker.HALF_OPEN
+    assert not breaker.probe_in_flight
+    # Endpoint khác vẫn nhận được lượt thăm dò toàn cục
+    assert registry.allow('/fapi/v1/order')
+
+
+def test_rate_limited_endpoint_probe_reopens_endpoint_breaker(registry, monkeypatch):
+    _half_open(registry._get(ENDPOINT))
+    _respond(monkeypatch, status=429, body=b'{"code": -1003}')
+
+    assert t._send_binance_request(URL, 'GET', None, None, t.PRIORITY_MARKET) is None
+
+    endpoint_breaker = registry._get(ENDPOINT)
+    assert endpoint_breaker.state == t.CircuitBreaker.OPEN
+    assert not endpoint_breaker.probe_in_flight
+    assert _global(registry).state == t.CircuitBreaker.OPEN
+    # Hết cả hai thời gian chờ → request đi qua được
+    _global(registry).opened_until = 0
+    endpoint_breaker.opened_until = 0
+    assert registry.allow(ENDPOINT)
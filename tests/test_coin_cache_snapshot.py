@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trading_bot_lib as t
+
+
+def _coins(n):
+    return [{'symbol': f'C{i:03d}USDT', 'quote': 'USDT', 'step_size': 0.001, 'min_qty': 0.001,
+             'min_notional': 5.0, 'max_leverage': 50} for i in range(n)]
+
+
+@pytest.fixture
+def saved_snapshot(tmp_path):
+    cache = t.CoinCache()
+    cache.update_data(_coins(10))
+    cache.update_prices({f'C{i:03d}USDT': 0.5 for i in range(10)})
+    path = str(tmp_path / 'coins.npz')
+    assert cache.save(path)
+    return path
+
+
+@pytest.mark.parametrize('corrupt', [
+    lambda data: data[:len(data) // 2],      # file bị cắt cụt
+    lambda data: b'',                         # file rỗng
+    lambda data: b'not a zip archive at all',
+])
+def test_corrupt_snapshot_is_ignored_and_removed(saved_snapshot, corrupt):
+    with open(saved_snapshot, 'rb') as f:
+        data = f.read()
+    with open(saved_snapshot, 'wb') as f:
+        f.write(corrupt(data))
+
+    cache = t.CoinCache()
+    assert cache.load(saved_snapshot) is False
+    assert not os.path.exists(saved_snapshot)
+    assert cache.count() == 0
+
+
+def test_stale_snapshot_blocks_selection_until_prices_refresh(saved_snapshot, monkeypatch):
+    cache = t.CoinCache()
+    assert cache.load(saved_snapshot)
+    monkeypatch.setattr(t, '_COINS_CACHE', cache)
+
+    assert cache.is_stale()
+    assert len(t.select_coins_for_side('BUY').symbols) == 0
+    assert t.filter_coins_for_side('BUY') == []
+
+    # Vài giá lẻ chưa đủ thay snapshot
+    cache.update_prices({'C000USDT': 0.5})
+    assert cache.is_stale()
+
+    cache.update_prices({f'C{i:03d}USDT': 0.5 for i in range(10)})
+    assert not cache.is_stale()
+    assert len(t.select_coins_for_side('BUY').symbols) == 10
@@ -0,0 +1,43 @@
+import io
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trading_bot_lib as t
+
+
+def _exchange_info(count):
+    symbols = [{'symbol': f'C{i:05d}USDT', 'status': 'TRADING', 'quoteAsset': 'USDT',
+                'filters': [{'filterType': 'LOT_SIZE', 'stepSize': '0.001', 'minQty': '0.001'}] * 4,
+                'orderTypes': ['LIMIT', 'MARKET', 'STOP', 'TAKE_PROFIT'] * 3}
+               for i in range(count)]
+    return json.dumps({'timezone': 'UTC', 'rateLimits': [], 'symbols': symbols}).encode()
+
+
+def test_peak_memory_is_measured_only_when_enabled():
+    document = _exchange_info(50)
+
+    parser = t.ExchangeInfoStreamParser(lambda info: {'symbol': info['symbol']}, trace_memory=False)
+    parser(io.BytesIO(document))
+    assert parser.stats['peak_memory_bytes'] is None
+    assert parser.stats['symbols_kept'] == 50
+
+
+def test_streaming_parse_peaks_below_full_document_decode():
+    document = _exchange_info(3000)
+    parser = t.ExchangeInfoStreamParser(lambda info: None, chunk_size=16 * 1024, trace_memory=True)
+
+    parser(io.BytesIO(document))
+
+    tracemalloc.start()
+    try:
+        json.loads(document)
+        full_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert parser.stats['symbols_seen'] == 3000
+    assert 0 < parser.stats['peak_memory_bytes'] < full_peak / 4
+    assert not tracemalloc.is_tracing()
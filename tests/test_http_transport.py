@@ -0,0 +1,64 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trading_bot_lib as t
+
+
+class _DropAfterFirstHandler(BaseHTTPRequestHandler):
+    """Trả lời request đầu tiên của mỗi kết nối, các request sau thì đọc xong rồi đóng kết nối không trả lời"""
+    protocol_version = 'HTTP/1.1'
+    received = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        self.received.append(self.command)
+        if getattr(self, '_answered', False):
+            self.close_connection = True
+            return
+        self._answered = True
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    do_GET = do_POST = _handle
+
+
+@pytest.fixture
+def server():
+    _DropAfterFirstHandler.received = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _DropAfterFirstHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_on_dropped_keepalive_connection_is_retried(server):
+    pool = t.HttpConnectionPool(pool_size=1)
+    assert pool.request('GET', f"{server}/a")[0] == 200
+
+    assert pool.request('GET', f"{server}/b")[0] == 200
+    assert _DropAfterFirstHandler.received == ['GET', 'GET', 'GET']
+    assert pool.get_stats()['stale_retries'] == 1
+
+
+def test_post_lost_after_send_is_not_resent(server):
+    pool = t.HttpConnectionPool(pool_size=1)
+    assert pool.request('GET', f"{server}/a")[0] == 200
+
+    with pytest.raises(Exception) as excinfo:
+        pool.request('POST', f"{server}/fapi/v1/order", body=b'symbol=X')
+    assert getattr(excinfo.value, 'request_sent', False)
+    assert _DropAfterFirstHandler.received == ['GET', 'POST']
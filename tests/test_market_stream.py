@@ -0,0 +1,25 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trading_bot_lib as t
+
+
+def test_rest_fallback_polls_for_whole_outage(monkeypatch):
+    pulls = []
+    monkeypatch.setattr(t, 'update_coins_price', lambda: pulls.append(time.time()) or True)
+    stream = t.MarketDataStream(t.CoinCache(), stale_after=0.05)
+    thread = threading.Thread(target=stream._fallback_loop, daemon=True)
+    thread.start()
+    try:
+        time.sleep(0.4)
+    finally:
+        stream.stop()
+        thread.join(1)
+
+    # Luồng im lặng suốt thời gian chờ → lấy giá REST ở mỗi chu kỳ, không chỉ một lần
+    assert len(pulls) >= 3
+    assert stream.get_stats()['fallbacks'] == len(pulls)
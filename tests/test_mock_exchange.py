@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trading_bot_lib as t
+from mock_exchange import MockConfig, MockExchange
+
+API_KEY = 'mock-key'
+API_SECRET = 'mock-secret'
+
+
+@pytest.fixture
+def exchange(monkeypatch):
+    # Giữ lại trạng thái toàn cục để monkeypatch khôi phục sau test
+    monkeypatch.setattr(t, '_BINANCE_REST_BASE', t._BINANCE_REST_BASE)
+    monkeypatch.setattr(t, '_BINANCE_WS_BASE', t._BINANCE_WS_BASE)
+    monkeypatch.setattr(t, '_COINS_CACHE', t.CoinCache())
+    monkeypatch.setattr(t, '_CIRCUIT_BREAKERS', t.CircuitBreakerRegistry())
+    exchange = MockExchange(port=0, symbols=20, seed=7, config=MockConfig(api_secret=API_SECRET)).start()
+    t.set_binance_base_urls(exchange.rest_url, exchange.ws_url)
+    yield exchange
+    exchange.stop()
+
+
+def test_order_round_trip_against_mock_exchange(exchange):
+    assert t.refresh_coins_cache(force=True)
+    assert t._COINS_CACHE.count() == 20
+    symbol = t._COINS_CACHE.snapshot().symbols[0]
+    filters = t.get_symbol_filters(symbol)
+    price = t.get_current_price(symbol)
+    assert price > 0
+    qty = round(max(filters.min_qty, filters.min_notional * 2 / price) // filters.step_size * filters.step_size
+                + filters.step_size, 8)
+
+    result, fill = t.execute_market_order(symbol, 'BUY', qty, API_KEY, API_SECRET)
+
+    assert result and 'orderId' in result
+    assert fill is not None and fill['status'] == 'FILLED'
+    assert fill['executedQty'] == pytest.approx(qty)
+    positions = t.get_positions(symbol, API_KEY, API_SECRET)
+    assert positions and float(positions[0]['positionAmt']) == pytest.approx(qty)
+
+
+def test_bad_signature_is_rejected(exchange):
+    assert t.get_positions(api_key=API_KEY, api_secret='wrong-secret') is None
+
+
+def test_lost_order_response_is_resolved_without_resending(exchange, monkeypatch):
+    assert t.refresh_coins_cache(force=True)
+    symbol = t._COINS_CACHE.snapshot().symbols[1]
+    filters = t.get_symbol_filters(symbol)
+    qty = round(filters.min_notional * 2 / t.get_current_price(symbol) // filters.step_size * filters.step_size
+                + filters.step_size, 8)
+    send = t._HTTP_TRANSPORT.request
+
+    def drop_order_response(method, url, body=None, headers=None, consumer=None):
+        result = send(method, url, body=body, headers=headers, consumer=consumer)
+        if method == 'POST' and '/fapi/v1/order' in url:
+            # Sàn đã khớp lệnh nhưng phản hồi bị mất trên đường về
+            error = t.http.client.RemoteDisconnected('Remote end closed connection without response')
+            error.request_sent = True
+            raise error
+        return result
+    monkeypatch.setattr(t._HTTP_TRANSPORT, 'request', drop_order_response)
+
+    result, fill = t.execute_market_order(symbol, 'BUY', qty, API_KEY, API_SECRET)
+
+    assert len(exchange.orders) == 1
+    assert result and result['orderId'] in exchange.orders
+    assert fill is not None and fill['executedQty'] == pytest.approx(qty)
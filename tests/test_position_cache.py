@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trading_bot_lib as t
+
+
+class _HealthyStream:
+    def is_healthy(self):
+        return True
+
+
+@pytest.fixture
+def cache():
+    cache = t.PositionCache()
+    cache.initialize('key', 'secret')
+    cache.attach_stream(_HealthyStream())
+    cache.apply_account_update([{'s': 'XUSDT', 'ps': 'BOTH', 'pa': '2', 'ep': '10', 'up': '1'}], 1)
+    return cache
+
+
+def test_failed_refresh_keeps_stream_positions(cache, monkeypatch):
+    monkeypatch.setattr(t, 'get_positions', lambda **kwargs: None)
+
+    cache.refresh(force=True)
+    cache.refresh()
+
+    stats = cache.get_stats()
+    assert cache.has_position('XUSDT')
+    assert cache.get_counts_and_pnl() == (1, 0, 1.0, 0.0)
+    assert stats['age'] is None                  # _last_update không bị ghi đè
+    assert stats['reconcile_diffs'] == 0
+    assert stats['refresh_failures'] == 1        # lần không ép chờ vài giây sau lỗi
+
+
+def test_empty_account_from_rest_clears_positions(cache, monkeypatch):
+    monkeypatch.setattr(t, 'get_positions', lambda **kwargs: [])
+
+    cache.refresh()
+
+    assert not cache.has_position('XUSDT')
+    assert cache.get_stats()['reconcile_diffs'] == 1
@@ -0,0 +1,34 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trading_bot_lib as t
+
+
+def _limiter_in_soft_zone(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(t.time, 'sleep', sleeps.append)
+    limiter = t.BinanceRateLimiter(weight_limit=100)
+    # Dùng 85% ngân sách: vượt ngưỡng mềm 80% nhưng vẫn còn token dự trữ
+    limiter._buckets['weight'].tokens = 15
+    return limiter, sleeps
+
+
+def test_lower_lanes_are_paced_in_soft_zone(monkeypatch):
+    limiter, sleeps = _limiter_in_soft_zone(monkeypatch)
+
+    waited = limiter.acquire(5, reserve=t._PRIORITY_RESERVE[t.PRIORITY_OPEN])
+
+    assert waited > 0
+    assert sleeps
+
+
+def test_close_lane_skips_pacing_when_tokens_remain(monkeypatch):
+    limiter, sleeps = _limiter_in_soft_zone(monkeypatch)
+
+    waited = limiter.acquire(5, reserve=t._PRIORITY_RESERVE[t.PRIORITY_CLOSE], pace=False)
+
+    assert waited == 0
+    assert not sleeps
+    assert limiter.get_stats()['pacing_skipped'] == 1
@@ -0,0 +1,61 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trading_bot_lib as t
+
+
+def _slow_leader(flight, priority, release):
+    calls = []
+
+    def leader():
+        calls.append('leader')
+        release.wait(2)
+        return 'leader'
+    thread = threading.Thread(target=flight.do, args=('key', leader, 1, priority))
+    thread.start()
+    while not calls:
+        pass
+    return thread
+
+
+def test_follower_in_same_or_lower_lane_shares_leader_result():
+    flight = t.SingleFlight()
+    release = threading.Event()
+    thread = _slow_leader(flight, t.PRIORITY_ACCOUNT, release)
+    results = []
+    follower = threading.Thread(target=lambda: results.append(
+        flight.do('key', lambda: 'own', 1, t.PRIORITY_MARKET)))
+    follower.start()
+
+    release.set()
+    thread.join()
+    follower.join()
+    assert results == ['leader']
+    assert flight.get_stats()['deduplicated'] == 1
+
+
+def test_more_urgent_follower_does_not_wait_behind_market_leader():
+    flight = t.SingleFlight()
+    release = threading.Event()
+    thread = _slow_leader(flight, t.PRIORITY_MARKET, release)
+
+    assert flight.do('key', lambda: 'own', 1, t.PRIORITY_OPEN) == 'own'
+    assert flight.get_stats()['bypassed'] == 1
+
+    release.set()
+    thread.join()
+
+
+def test_follower_wait_is_bounded():
+    flight = t.SingleFlight(wait_timeout=0.05)
+    release = threading.Event()
+    thread = _slow_leader(flight, t.PRIORITY_MARKET, release)
+
+    assert flight.do('key', lambda: 'own', 1, t.PRIORITY_MARKET) == 'own'
+    assert flight.get_stats()['wait_timeouts'] == 1
+
+    release.set()
+    thread.join()
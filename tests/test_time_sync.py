@@ -0,0 +1,47 @@
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trading_bot_lib as t
+
+
+def _server(monkeypatch, skew_ms=0.0, calls=None):
+    def request(method, url, body=None, headers=None, consumer=None):
+        if calls is not None:
+            calls.append(url)
+        return 200, {}, json.dumps({'serverTime': int(time.time() * 1000 + skew_ms)}).encode()
+    monkeypatch.setattr(t._HTTP_TRANSPORT, 'request', request)
+
+
+def test_sync_ignores_rate_limiter_queueing(monkeypatch):
+    _server(monkeypatch, skew_ms=500)
+    # Chờ 50ms trong rate limiter không được tính vào RTT / offset
+    monkeypatch.setattr(t._RATE_LIMITER, 'acquire', lambda *args, **kwargs: time.sleep(0.05))
+    sync = t.ServerTimeSync()
+
+    assert sync.sync()
+
+    stats = sync.get_stats()
+    assert stats['rtt_ms'] < 10
+    assert abs(stats['offset_ms'] - 500) < 10
+
+
+def test_concurrent_rejections_share_one_fast_resync(monkeypatch):
+    calls = []
+    _server(monkeypatch, skew_ms=2000, calls=calls)
+    monkeypatch.setattr(t._RATE_LIMITER, 'acquire', lambda *args, **kwargs: time.sleep(0.02))
+    sync = t.ServerTimeSync(samples=3)
+    rejected_at = time.time()
+
+    threads = [threading.Thread(target=sync.resync, args=(rejected_at,)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert abs(sync.get_stats()['offset_ms'] - 2000) < 10
@@ -38,53 +38,379 @@
 import json
 import hmac
 import hashlib
+import codecs
 import time
 import threading
 import urllib.request
 import urllib.parse
+import http.client
 import numpy as np
 import websocket
 import logging
 import requests
 import os
 import math
+import bisect
+import tracemalloc
 import traceback
 import random
+import uuid
+import re
 import queue
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
-from collections import defaultdict
+from collections import defaultdict, deque, namedtuple
 import ssl
 import html
 import sys
+import types
 from typing import Optional, List, Dict, Any, Tuple, Callable
 
 # ========== CẤU HÌNH & HẰNG SỐ ==========
-_BINANCE_LAST_REQUEST_TIME = 0
-_BINANCE_RATE_LOCK = threading.RLock()
-_BINANCE_MIN_INTERVAL = 0.1
+_BINANCE_WEIGHT_LIMIT_1M = 2400      # REQUEST_WEIGHT / phút (USDⓈ-M Futures)
+_BINANCE_ORDER_LIMIT_10S = 300       # ORDERS / 10 giây
+_BINANCE_ORDER_LIMIT_1M = 1200       # ORDERS / phút
+_RATE_LIMIT_SOFT_RATIO = 0.8         # Bắt đầu giãn request khi đã dùng 80% ngân sách
+
+# Làn ưu tiên cho request REST (số nhỏ = ưu tiên cao)
+PRIORITY_CLOSE = 0      # Lệnh đóng vị thế / cắt lỗ
+PRIORITY_OPEN = 1       # Lệnh mở, nhồi lệnh, đặt đòn bẩy
+PRIORITY_ACCOUNT = 2    # Đọc tài khoản, vị thế, giá đơn lẻ
+PRIORITY_MARKET = 3     # Làm mới dữ liệu thị trường nền
+_PRIORITY_NAMES = ('close', 'open', 'account', 'market')
+# Phần ngân sách trọng số mỗi làn phải chừa lại cho các làn cao hơn
+_PRIORITY_RESERVE = (0.0, 0.05, 0.10, 0.25)
+# Địa chỉ gốc REST / WebSocket – đổi sang sàn giả lập (mock_exchange.py) bằng biến môi trường
+# hoặc set_binance_base_urls()
+_BINANCE_REST_BASE = os.getenv('BINANCE_REST_BASE', 'https://fapi.binance.com').rstrip('/')
+_BINANCE_WS_BASE = os.getenv('BINANCE_WS_BASE', 'wss://fstream.binance.com').rstrip('/')
+_HTTP_POOL_SIZE = 8
+# Method gửi lại an toàn khi mất kết nối sau khi request đã đi (POST lệnh có thể đã được khớp)
+_IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'PUT', 'DELETE'})
+# File snapshot cache coin để khởi động lại nhanh (rỗng = tắt)
+_COIN_CACHE_SNAPSHOT_PATH = os.getenv('COIN_CACHE_SNAPSHOT', 'coin_cache_snapshot.npz')
+# Đo bộ nhớ đỉnh (tracemalloc) khi phân tích exchangeInfo – tốn CPU, chỉ bật khi cần đo
+_EXCHANGE_INFO_TRACE_MEMORY = os.getenv('EXCHANGE_INFO_TRACE_MEMORY', '0') == '1'
 
 # Blacklist mở rộng cho cả USDT và USDC
 _SYMBOL_BLACKLIST = {'BTCUSDT', 'ETHUSDT', 'BTCUSDC', 'ETHUSDC'}
 
-# ========== CACHE COIN TẬP TRUNG – THREAD-SAFE ==========
+# ========== CACHE COIN TẬP TRUNG – SNAPSHOT BẤT BIẾN, DẠNG CỘT (NUMPY) ==========
+# Kết quả lọc coin: các mảng song song đã lọc/sắp xếp, không tạo dict cho từng coin
+CoinSelection = namedtuple('CoinSelection', ['symbols', 'prices', 'volumes'])
+# Bộ lọc sàn của một symbol – bất biến, dùng chung giữa các thread không cần copy
+SymbolFilters = namedtuple('SymbolFilters', ['symbol', 'quote', 'step_size', 'min_qty', 'min_notional', 'max_leverage'])
+
+def _frozen(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+class CoinSnapshot:
+    """Ảnh chụp bất biến của universe coin: mảng chỉ-đọc + index symbol, đánh số thế hệ"""
+    __slots__ = ('generation', 'symbols', 'quotes', 'cols', 'index', 'rows', 'created_at')
+
+    def __init__(self, generation: int, symbols: np.ndarray, quotes: np.ndarray,
+                 cols: Dict[str, np.ndarray], index, rows=None):
+        self.generation = generation
+        self.symbols = _frozen(symbols)
+        self.quotes = _frozen(quotes)
+        self.cols = types.MappingProxyType({name: _frozen(col) for name, col in cols.items()})
+        self.index = index if isinstance(index, types.MappingProxyType) else types.MappingProxyType(index)
+        if rows is None:
+            rows = types.MappingProxyType({symbol: row for row, symbol in enumerate(symbols.tolist())})
+        self.rows = rows
+        self.created_at = time.time()
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def with_columns(self, generation: int, **columns) -> 'CoinSnapshot':
+        """Snapshot mới thay một số cột, dùng lại mảng và index không đổi"""
+        return CoinSnapshot(generation, self.symbols, self.quotes, dict(self.cols, **columns), self.index, self.rows)
+
 class CoinCache:
+    """Đọc không lock, không copy: ghi = dựng snapshot mới rồi hoán đổi tham chiếu"""
+    _COLUMNS = {
+        'price': np.float64,
+        'volume': np.float64,
+        'step_size': np.float64,
+        'min_qty': np.float64,
+        'min_notional': np.float64,
+        'max_leverage': np.int64,
+        'last_price_update': np.float64,
+        'last_volume_update': np.float64,
+    }
+    _TIMESTAMP_COLUMNS = {'price': 'last_price_update', 'volume': 'last_volume_update'}
+    _SELECT_MEMO_SIZE = 32
+    _FRESH_RATIO = 0.9    # Tỷ lệ coin phải có giá mới để hết stale sau khi nạp snapshot
+
     def __init__(self):
-        self._data: List[Dict] = []
+        self._snapshot = CoinSnapshot(
+            0, np.empty(0, dtype=str), np.empty(0, dtype=str),
+            {name: np.empty(0, dtype=dtype) for name, dtype in self._COLUMNS.items()}, {})
+        self._select_memo = (0, {})   # (generation, {tham số lọc: kết quả})
         self._last_volume_update: float = 0
         self._last_price_update: float = 0
-        self._lock = threading.RLock()
+        self._lock = threading.RLock()   # Chỉ tuần tự hoá các writer
         self._volume_cache_ttl = 6 * 3600
         self._price_cache_ttl = 300
+        self._exchange_info_ttl = 3600
         self._refresh_interval = 300
+        self._exchange_info_digest = None
+        self._exchange_info_unchanged = 0
+        self._exchange_info_parse: Dict = {}
+        self._stale = False          # Dữ liệu nạp từ đĩa, chưa có giá mới
+        self._loaded_at = 0
+        self._saved_generation = 0
+
+    def snapshot(self) -> CoinSnapshot:
+        """Snapshot hiện tại – đọc một tham chiếu, không lock"""
+        return self._snapshot
+
+    @property
+    def generation(self) -> int:
+        return self._snapshot.generation
+
+    @staticmethod
+    def _rows_as_dicts(snap: CoinSnapshot, rows) -> List[Dict]:
+        columns = {name: col[rows].tolist() for name, col in snap.cols.items()}
+        result = []
+        for i, (symbol, quote) in enumerate(zip(snap.symbols[rows].tolist(), snap.quotes[rows].tolist())):
+            coin = {'symbol': symbol, 'quote': quote}
+            for name, values in columns.items():
+                coin[name] = values[i]
+            result.append(coin)
+        return result
 
     def get_data(self) -> List[Dict]:
+        """View tương thích: danh sách dict (mỗi lần gọi tạo bản sao mới)"""
+        snap = self._snapshot
+        return self._rows_as_dicts(snap, np.arange(len(snap)))
+
+    def count(self) -> int:
+        return len(self._snapshot)
+
+    def update_data(self, new_data: List[Dict], keep_market_data=False, exchange_info_digest=None):
+        """Thay universe; keep_market_data giữ giá/volume đã có của các symbol còn tồn tại"""
+        symbols = np.array([coin['symbol'] for coin in new_data], dtype=str)
+        quotes = np.array([coin.get('quote', '') for coin in new_data], dtype=str)
+        cols = {
+            name: np.array([coin.get(name, 0) for coin in new_data], dtype=dtype)
+            for name, dtype in self._COLUMNS.items()
+        }
+        index = {
+            coin['symbol']: SymbolFilters(
+                coin['symbol'], coin.get('quote', ''), float(coin['step_size']), float(coin['min_qty']),
+                float(coin['min_notional']), int(coin['max_leverage']))
+            for coin in new_data
+        }
+        with self._lock:
+            old = self._snapshot
+            if keep_market_data and old.rows:
+                carried = [(row, old.rows[s]) for row, s in enumerate(symbols.tolist()) if s in old.rows]
+                if carried:
+                    new_rows = np.fromiter((r for r, _ in carried), dtype=np.intp, count=len(carried))
+                    old_rows = np.fromiter((r for _, r in carried), dtype=np.intp, count=len(carried))
+                    for name, ts_name in self._TIMESTAMP_COLUMNS.items():
+                        cols[name][new_rows] = old.cols[name][old_rows]
+                        cols[ts_name][new_rows] = old.cols[ts_name][old_rows]
+            self._snapshot = CoinSnapshot(old.generation + 1, symbols, quotes, cols, index)
+            if exchange_info_digest is not None:
+                self._exchange_info_digest = exchange_info_digest
+
+    def record_exchange_info_parse(self, stats: Dict):
         with self._lock:
-            return [coin.copy() for coin in self._data]  # copy để tránh thay đổi từ bên ngoài
+            self._exchange_info_parse = dict(stats)
+
+    def exchange_info_changed(self, digest: str) -> bool:
+        """So sánh hash nội dung exchangeInfo với lần phân tích trước"""
+        with self._lock:
+            if digest == self._exchange_info_digest:
+                self._exchange_info_unchanged += 1
+                return False
+            return True
+
+    def lookup(self, symbol: str) -> Optional[SymbolFilters]:
+        """Tra cứu O(1) bộ lọc sàn của symbol (None nếu không có trong cache)"""
+        return self._snapshot.index.get(symbol.upper())
+
+    def _update_columns(self, updates: Dict[str, Dict[str, float]]) -> Dict[str, int]:
+        """Ghi giá trị mới cho các cột price/volume (kèm timestamp từng symbol) trong một snapshot"""
+        with self._lock:
+            snap = self._snapshot
+            now = time.time()
+            new_cols = {}
+            counts = {}
+            for name, values in updates.items():
+                pairs = [(snap.rows[s], v) for s, v in values.items() if s in snap.rows]
+                counts[name] = len(pairs)
+                if not pairs:
+                    continue
+                rows = np.fromiter((row for row, _ in pairs), dtype=np.intp, count=len(pairs))
+                ts_name = self._TIMESTAMP_COLUMNS[name]
+                column = snap.cols[name].copy()
+                column[rows] = [v for _, v in pairs]
+                stamps = snap.cols[ts_name].copy()
+                stamps[rows] = now
+                new_cols[name] = column
+                new_cols[ts_name] = stamps
+            if new_cols:
+                self._snapshot = snap.with_columns(snap.generation + 1, **new_cols)
+            if self._stale and counts.get('price'):
+                # Chỉ hết stale khi giá mới đã thay phần lớn giá nạp từ đĩa
+                fresh = self._snapshot.cols['last_price_update'] > self._loaded_at
+                if fresh.mean() >= self._FRESH_RATIO:
+                    self._stale = False
+                    logger.info("✅ Giá thị trường mới đã thay snapshot trên đĩa, mở lại lọc coin")
+            return counts
+
+    def update_prices(self, prices: Dict[str, float]) -> int:
+        """Cập nhật cột giá, trả về số coin được cập nhật"""
+        return self._update_columns({'price': prices})['price']
+
+    def update_volumes(self, volumes: Dict[str, float]) -> int:
+        """Cập nhật cột volume, trả về số coin được cập nhật"""
+        return self._update_columns({'volume': volumes})['volume']
+
+    def update_market_data(self, prices: Dict[str, float], volumes: Dict[str, float]) -> Dict[str, int]:
+        """Cập nhật giá và volume cùng lúc (một lần hoán đổi snapshot)"""
+        return self._update_columns({'price': prices, 'volume': volumes})
+
+    def get_price(self, symbol: str, max_age: float) -> float:
+        """Giá trong cache nếu được cập nhật trong vòng max_age giây, ngược lại 0"""
+        snap = self._snapshot
+        row = snap.rows.get(symbol.upper())
+        if row is None or time.time() - snap.cols['last_price_update'][row] > max_age:
+            return 0
+        return float(snap.cols['price'][row])
+
+    def select(self, side, buy_threshold, sell_threshold, excluded=None, blacklist=None,
+               sort_by_volume=False, as_dicts=False):
+        """Lọc coin theo hướng bằng mặt nạ vector – trả về (CoinSelection hoặc list dict, thống kê loại bỏ)"""
+        snap = self._snapshot
+        excluded = frozenset(excluded or ())
+        blacklist = frozenset(blacklist or ())
+        key = (side, buy_threshold, sell_threshold, excluded, blacklist, bool(sort_by_volume))
+
+        # Cùng thế hệ snapshot + cùng tham số → dùng lại kết quả (mảng chỉ-đọc, an toàn khi chia sẻ)
+        memo_generation, memo = self._select_memo
+        if memo_generation != snap.generation:
+            memo = {}
+            self._select_memo = (snap.generation, memo)
+        cached = memo.get(key)
+        if cached is None:
+            cached = self._select(snap, *key)
+            if len(memo) >= self._SELECT_MEMO_SIZE:
+                memo.clear()
+            memo[key] = cached
+        rows, selection, stats = cached
+        if as_dicts:
+            return self._rows_as_dicts(snap, rows), dict(stats)
+        return selection, dict(stats)
+
+    @staticmethod
+    def _select(snap: CoinSnapshot, side, buy_threshold, sell_threshold, excluded, blacklist, sort_by_volume):
+        symbols = snap.symbols
+        price = snap.cols['price']
+        volume = snap.cols['volume']
+        no_match = np.zeros(len(symbols), dtype=bool)
+
+        black = np.isin(symbols, list(blacklist)) if blacklist else no_match
+        keep = ~black
+        excl = keep & np.isin(symbols, list(excluded)) if excluded else no_match
+        keep &= ~excl
+        price_zero = keep & (price <= 0)
+        keep &= ~price_zero
+        volume_zero = keep & (volume <= 0)   # vẫn giữ coin volume 0
+        if side == "BUY":
+            side_ok = price < buy_threshold
+        elif side == "SELL":
+            side_ok = price > sell_threshold
+        else:
+            side_ok = ~no_match
+        price_fail = keep & ~side_ok
+        keep &= side_ok
+
+        rows = np.flatnonzero(keep)
+        if sort_by_volume:
+            rows = rows[np.argsort(-volume[rows], kind='stable')]
+
+        stats = {
+            'total': len(symbols),
+            'matched': len(rows),
+            'blacklisted': int(black.sum()),
+            'excluded': int(excl.sum()),
+            'price_fail': int(price_fail.sum()),
+            'volume_zero': int(volume_zero.sum()),
+            'price_zero': int(price_zero.sum()),
+            'generation': snap.generation,
+        }
+        selection = CoinSelection(_frozen(symbols[rows]), _frozen(price[rows]), _frozen(volume[rows]))
+        return _frozen(rows), selection, stats
+
+    def top_by_volume(self, limit: int) -> List[str]:
+        """Các symbol có volume > 0 lớn nhất"""
+        snap = self._snapshot
+        volume = snap.cols['volume']
+        rows = np.flatnonzero(volume > 0)
+        rows = rows[np.argsort(-volume[rows], kind='stable')][:limit]
+        return snap.symbols[rows].tolist()
+
+    def is_stale(self) -> bool:
+        return self._stale
+
+    def save(self, path: str) -> bool:
+        """Ghi snapshot hiện tại ra file .npz (ghi file tạm rồi đổi tên); bỏ qua nếu không có gì mới"""
+        snap = self._snapshot
+        if not len(snap) or snap.generation == self._saved_generation:
+            return False
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, symbols=snap.symbols, quotes=snap.quotes,
+                     exchange_info_digest=np.array(self._exchange_info_digest or ''),
+                     saved_at=np.array(time.time()), **dict(snap.cols))
+        os.replace(tmp_path, path)
+        self._saved_generation = snap.generation
+        return True
+
+    def load(self, path: str) -> bool:
+        """Nạp snapshot từ file (đánh dấu stale đến khi có giá mới); False nếu thiếu hoặc hỏng.
+        File hỏng (cắt cụt, sai định dạng) bị xoá để lần khởi động sau khởi tạo lại từ sàn."""
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                symbols = data['symbols']
+                quotes = data['quotes']
+                cols = {name: data[name].astype(dtype) for name, dtype in self._COLUMNS.items()}
+                digest = str(data['exchange_info_digest']) or None
+                saved_at = float(data['saved_at'])
+            if any(len(col) != len(symbols) for col in cols.values()) or len(quotes) != len(symbols):
+                raise ValueError("số dòng các cột không khớp")
+            index = {
+                symbol: SymbolFilters(symbol, quote, float(step), float(min_qty), float(min_notional), int(max_lev))
+                for symbol, quote, step, min_qty, min_notional, max_lev in zip(
+                    symbols.tolist(), quotes.tolist(), cols['step_size'].tolist(), cols['min_qty'].tolist(),
+                    cols['min_notional'].tolist(), cols['max_leverage'].tolist())
+            }
+        except Exception as e:
+            logger.warning(f"⚠️ Snapshot cache coin {path} hỏng, bỏ qua và khởi tạo lại: {type(e).__name__}: {str(e)}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return False
 
-    def update_data(self, new_data: List[Dict]):
         with self._lock:
-            self._data = new_data
+            self._snapshot = CoinSnapshot(self._snapshot.generation + 1, symbols, quotes, cols, index)
+            self._saved_generation = self._snapshot.generation
+            self._exchange_info_digest = digest
+            self._stale = True
+            self._loaded_at = time.time()
+            self._last_price_update = 0
+            self._last_volume_update = 0
+        logger.info(f"💾 Đã nạp {len(symbols)} coin từ snapshot ({time.time() - saved_at:.0f}s trước)")
+        return True
 
     def update_volume_time(self):
         with self._lock:
@@ -95,19 +421,24 @@ class CoinCache:
             self._last_price_update = time.time()
 
     def get_stats(self) -> Dict:
-        with self._lock:
-            return {
-                'count': len(self._data),
-                'last_volume_update': self._last_volume_update,
-                'last_price_update': self._last_price_update,
-                'volume_cache_ttl': self._volume_cache_ttl,
-                'price_cache_ttl': self._price_cache_ttl,
-                'refresh_interval': self._refresh_interval,
-            }
+        snap = self._snapshot
+        return {
+            'count': len(snap),
+            'generation': snap.generation,
+            'stale': self._stale,
+            'snapshot_age': time.time() - snap.created_at,
+            'last_volume_update': self._last_volume_update,
+            'last_price_update': self._last_price_update,
+            'volume_cache_ttl': self._volume_cache_ttl,
+            'price_cache_ttl': self._price_cache_ttl,
+            'exchange_info_ttl': self._exchange_info_ttl,
+            'exchange_info_unchanged': self._exchange_info_unchanged,
+            'exchange_info_parse': dict(self._exchange_info_parse),
+            'refresh_interval': self._refresh_interval,
+        }
 
     def need_refresh(self) -> bool:
-        with self._lock:
-            return time.time() - self._last_price_update > self._refresh_interval
+        return time.time() - self._last_price_update > self._refresh_interval
 
 _COINS_CACHE = CoinCache()
 
@@ -156,6 +487,10 @@ class GlobalSideCoordinator:
 
         try:
             positions = get_positions(api_key=api_key, api_secret=api_secret)
+            if positions is None:
+                logger.warning("⚠️ Không lấy được vị thế toàn cục, giữ hướng ưu tiên hiện tại")
+                with self._lock:
+                    return self.next_global_side or random.choice(["BUY", "SELL"])
             buy_count = 0
             sell_count = 0
             for pos in positions:
@@ -227,7 +562,8 @@ def create_main_menu():
             [{"text": "➕ Thêm Bot"}, {"text": "⛔ Dừng Bot"}],
             [{"text": "⛔ Quản lý Coin"}, {"text": "📈 Vị thế"}],
             [{"text": "💰 Số dư"}, {"text": "⚙️ Cấu hình"}],
-            [{"text": "🎯 Chiến lược"}, {"text": "⚖️ Cân bằng lệnh"}]
+            [{"text": "🎯 Chiến lược"}, {"text": "⚖️ Cân bằng lệnh"}],
+            [{"text": "📶 Luồng giá"}]
         ],
         "resize_keyboard": True,
         "one_time_keyboard": False
@@ -257,9 +593,7 @@ def create_bot_mode_keyboard():
 
 def create_symbols_keyboard():
     try:
-        coins = get_coins_with_info()
-        coins_sorted = sorted(coins, key=lambda x: x['volume'], reverse=True)[:12]
-        symbols = [coin['symbol'] for coin in coins_sorted if coin['volume'] > 0]
+        symbols = _COINS_CACHE.top_by_volume(12)
         if not symbols:
             symbols = ["BNBUSDT", "ADAUSDT", "DOGEUSDT", "XRPUSDT", "DOTUSDT", "LINKUSDT", "SOLUSDT", "MATICUSDT"]
     except:
@@ -373,15 +707,710 @@ def create_price_threshold_keyboard():
         "resize_keyboard": True, "one_time_keyboard": True
     }
 
-# ========== HÀM API BINANCE CẢI TIẾN ==========
-def _wait_for_rate_limit():
-    global _BINANCE_LAST_REQUEST_TIME
-    with _BINANCE_RATE_LOCK:
+# ========== TRANSPORT HTTP KEEP-ALIVE (POOL KẾT NỐI) ==========
+class HttpConnectionPool:
+    """Pool kết nối keep-alive theo host – tái sử dụng TCP/TLS thay vì bắt tay lại mỗi request"""
+    def __init__(self, pool_size=_HTTP_POOL_SIZE, timeout=15):
+        self._pool_size = max(1, int(pool_size))
+        self._timeout = timeout
+        self._idle: Dict[Tuple[str, str, int], List] = defaultdict(list)
+        self._lock = threading.RLock()
+        self._hits = 0
+        self._misses = 0
+        self._discarded = 0
+        self._stale_retries = 0
+
+    def set_pool_size(self, pool_size):
+        with self._lock:
+            self._pool_size = max(1, int(pool_size))
+            for conns in self._idle.values():
+                while len(conns) > self._pool_size:
+                    conns.pop(0).close()
+                    self._discarded += 1
+
+    @staticmethod
+    def _pool_key(url):
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme or 'https'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        path = parts.path or '/'
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        return (scheme, parts.hostname, port), path
+
+    def _new_connection(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self._timeout)
+        return http.client.HTTPConnection(host, port, timeout=self._timeout)
+
+    def _acquire(self, key):
+        with self._lock:
+            conns = self._idle.get(key)
+            if conns:
+                self._hits += 1
+                return conns.pop(), True
+            self._misses += 1
+        return self._new_connection(key), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            conns = self._idle[key]
+            if len(conns) < self._pool_size:
+                conns.append(conn)
+                return
+            self._discarded += 1
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None, consumer=None):
+        """Gửi request qua pool, trả về (status, headers viết thường, body bytes).
+        Nếu có `consumer`, phản hồi 200 được đọc dần bởi consumer(response) và body là kết quả của nó.
+        Kết nối cũ bị server đóng (keep-alive hết hạn) được thử lại 1 lần với kết nối mới – với method
+        không idempotent chỉ khi lỗi xảy ra lúc gửi. Lỗi sau khi đã gửi được gắn `request_sent = True`."""
+        key, path = self._pool_key(url)
+        for attempt in range(2):
+            conn, reused = self._acquire(key)
+            sent = False
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                sent = True
+                response = conn.getresponse()
+                if consumer is not None and response.status == 200:
+                    content = consumer(response)
+                    response.read()   # Xả phần còn lại để tái sử dụng kết nối
+                else:
+                    content = response.read()
+            except Exception as e:
+                conn.close()
+                stale = isinstance(e, (ConnectionResetError, BrokenPipeError, http.client.BadStatusLine,
+                                       http.client.CannotSendRequest))
+                # POST đã gửi mà mất phản hồi: sàn có thể đã xử lý lệnh → không gửi lại (tránh trùng lệnh)
+                if stale and reused and attempt == 0 and (not sent or method.upper() in _IDEMPOTENT_METHODS):
+                    with self._lock:
+                        self._stale_retries += 1
+                    continue
+                if sent:
+                    e.request_sent = True
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            return response.status, {k.lower(): v for k, v in response.getheaders()}, content
+
+    def warm_up(self, hosts, count=None):
+        """Mở sẵn `count` kết nối tới mỗi host (mặc định = pool_size)"""
+        count = self._pool_size if count is None else min(int(count), self._pool_size)
+        opened = 0
+        for host in hosts:
+            key, _ = self._pool_key(host if '://' in host else f"https://{host}")
+            for _ in range(count):
+                with self._lock:
+                    if len(self._idle[key]) >= self._pool_size:
+                        break
+                conn = self._new_connection(key)
+                try:
+                    conn.connect()
+                except Exception as e:
+                    logger.warning(f"⚠️ Không thể làm nóng kết nối tới {key[1]}: {str(e)}")
+                    conn.close()
+                    break
+                self._release(key, conn)
+                opened += 1
+        logger.info(f"🔌 Đã làm nóng {opened} kết nối keep-alive")
+        return opened
+
+    def close_all(self):
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle.clear()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'pool_size': self._pool_size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / total if total else 0.0,
+                'discarded': self._discarded,
+                'stale_retries': self._stale_retries,
+                'idle': {f"{scheme}://{host}:{port}": len(conns)
+                         for (scheme, host, port), conns in self._idle.items()},
+            }
+
+_HTTP_TRANSPORT = HttpConnectionPool()
+
+# ========== GIỚI HẠN TỐC ĐỘ THEO TRỌNG SỐ (TOKEN BUCKET) ==========
+# Trọng số request theo endpoint: số nguyên hoặc (có symbol, không có symbol)
+_ENDPOINT_WEIGHTS = {
+    '/fapi/v1/exchangeInfo': 1,
+    '/fapi/v1/ticker/price': (1, 2),
+    '/fapi/v1/ticker/24hr': (1, 40),
+    '/fapi/v2/account': 5,
+    '/fapi/v2/positionRisk': 5,
+    '/fapi/v1/leverage': 1,
+    '/fapi/v1/order': 1,
+    '/fapi/v1/allOpenOrders': 1,
+    '/fapi/v1/time': 1,
+    '/fapi/v1/listenKey': 1,
+}
+# Endpoint tính vào giới hạn số lệnh (ORDERS)
+_ORDER_ENDPOINTS = {('POST', '/fapi/v1/order')}
+
+def _request_weight(method, url, params=None):
+    """Trả về (trọng số, số lệnh) của một request dựa trên endpoint và tham số"""
+    parts = urllib.parse.urlsplit(url)
+    weight = _ENDPOINT_WEIGHTS.get(parts.path, 1)
+    if isinstance(weight, tuple):
+        has_symbol = bool(params and 'symbol' in params) or 'symbol=' in parts.query
+        weight = weight[0] if has_symbol else weight[1]
+    orders = 1 if (method.upper(), parts.path) in _ORDER_ENDPOINTS else 0
+    return weight, orders
+
+class _TokenBucket:
+    def __init__(self, capacity, window):
+        self.capacity = float(capacity)
+        self.rate = capacity / window
+        self.tokens = float(capacity)
+        self.updated = time.time()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+class BinanceRateLimiter:
+    """Giới hạn tốc độ theo trọng số endpoint và số lệnh – cho phép request chạy song song
+    tới ngân sách thực, chỉ giãn nhịp khi vượt ngưỡng mềm và đồng bộ với header X-MBX-*"""
+    _HEADER_BUCKETS = {
+        'x-mbx-used-weight-1m': 'weight',
+        'x-mbx-order-count-10s': 'orders_10s',
+        'x-mbx-order-count-1m': 'orders_1m',
+    }
+
+    def __init__(self, weight_limit=_BINANCE_WEIGHT_LIMIT_1M, order_limit_10s=_BINANCE_ORDER_LIMIT_10S,
+                 order_limit_1m=_BINANCE_ORDER_LIMIT_1M, soft_ratio=_RATE_LIMIT_SOFT_RATIO):
+        self._lock = threading.Lock()
+        self._buckets = {
+            'weight': _TokenBucket(weight_limit, 60),
+            'orders_10s': _TokenBucket(order_limit_10s, 10),
+            'orders_1m': _TokenBucket(order_limit_1m, 60),
+        }
+        self._soft_ratio = soft_ratio
+        self._server_used = {}
+        self._requests = 0
+        self._throttled = 0
+        self._total_wait = 0.0
+        self._pacing_skipped = 0
+
+    def _try_take(self, weight, orders, reserve=0.0):
+        """Trả về (thời gian phải chờ, thời gian giãn nhịp). Chỉ trừ token khi không phải chờ.
+        `reserve` là phần dung lượng phải còn lại sau khi trừ (dành cho làn ưu tiên cao hơn)."""
+        now = time.time()
+        needs = [('weight', weight)]
+        if orders:
+            needs += [('orders_10s', orders), ('orders_1m', orders)]
+
+        wait = 0.0
+        for name, amount in needs:
+            bucket = self._buckets[name]
+            bucket.refill(now)
+            needed = amount + bucket.capacity * reserve
+            if bucket.tokens < needed:
+                wait = max(wait, (needed - bucket.tokens) / bucket.rate)
+        if wait > 0:
+            return wait, 0.0
+
+        pacing = 0.0
+        for name, amount in needs:
+            bucket = self._buckets[name]
+            bucket.tokens -= amount
+            soft_zone = bucket.capacity * (1 - self._soft_ratio)
+            if bucket.tokens < soft_zone:
+                # Càng gần giới hạn càng giãn, tối đa bằng tốc độ nạp lại của bucket
+                pressure = 1 - bucket.tokens / soft_zone
+                pacing = max(pacing, amount / bucket.rate * pressure)
+        return 0.0, pacing
+
+    def acquire(self, weight=1, orders=0, reserve=0.0, pace=True):
+        """Chờ tới khi đủ token. pace=False (làn đóng lệnh) bỏ qua phần giãn nhịp ở vùng mềm –
+        các làn khác luôn chừa lại phần dự trữ nên token cho lệnh đóng vẫn còn"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                wait, pacing = self._try_take(weight, orders, reserve)
+            if wait <= 0:
+                break
+            time.sleep(wait)
+            waited += wait
+        if pacing > 0 and pace:
+            time.sleep(pacing)
+            waited += pacing
+        with self._lock:
+            if pacing > 0 and not pace:
+                self._pacing_skipped += 1
+            self._requests += 1
+            if waited > 0:
+                self._throttled += 1
+                self._total_wait += waited
+        return waited
+
+    def update_from_headers(self, headers):
+        """Đồng bộ ngân sách với số liệu Binance trả về (X-MBX-USED-WEIGHT-1M, X-MBX-ORDER-COUNT-*)"""
+        if not headers:
+            return
+        with self._lock:
+            now = time.time()
+            for header, name in self._HEADER_BUCKETS.items():
+                value = headers.get(header)
+                if value is None:
+                    continue
+                try:
+                    used = int(value)
+                except ValueError:
+                    continue
+                self._server_used[name] = used
+                bucket = self._buckets[name]
+                bucket.refill(now)
+                bucket.tokens = min(bucket.tokens, bucket.capacity - used)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            now = time.time()
+            remaining = {}
+            for name, bucket in self._buckets.items():
+                bucket.refill(now)
+                remaining[name] = round(bucket.tokens, 2)
+            return {
+                'remaining': remaining,
+                'server_used': dict(self._server_used),
+                'requests': self._requests,
+                'throttled': self._throttled,
+                'total_wait': self._total_wait,
+                'pacing_skipped': self._pacing_skipped,
+            }
+
+_RATE_LIMITER = BinanceRateLimiter()
+
+def _default_priority(method, url):
+    """Làn mặc định theo endpoint khi caller không chỉ định"""
+    parts = urllib.parse.urlsplit(url)
+    if parts.path in ('/fapi/v1/order', '/fapi/v1/leverage', '/fapi/v1/allOpenOrders'):
+        return PRIORITY_OPEN
+    if parts.path in ('/fapi/v2/account', '/fapi/v2/positionRisk'):
+        return PRIORITY_ACCOUNT
+    if isinstance(_ENDPOINT_WEIGHTS.get(parts.path), tuple) and 'symbol=' in parts.query:
+        return PRIORITY_ACCOUNT
+    return PRIORITY_MARKET
+
+class RequestScheduler:
+    """Cấp lượt gửi request theo làn ưu tiên: khi hết chỗ, làn cao hơn luôn được phục vụ trước.
+    Làn đóng lệnh không bị giới hạn số request đồng thời."""
+    def __init__(self, max_in_flight=_HTTP_POOL_SIZE):
+        self._cond = threading.Condition()
+        self._max_in_flight = max(1, int(max_in_flight))
+        self._in_flight = 0
+        self._waiting = [0] * len(_PRIORITY_NAMES)
+        self._stats = [{'requests': 0, 'total_wait': 0.0, 'max_wait': 0.0} for _ in _PRIORITY_NAMES]
+
+    def set_max_in_flight(self, max_in_flight):
+        with self._cond:
+            self._max_in_flight = max(1, int(max_in_flight))
+            self._cond.notify_all()
+
+    def _blocked(self, lane):
+        if lane == PRIORITY_CLOSE:
+            return False
+        return self._in_flight >= self._max_in_flight or any(self._waiting[:lane])
+
+    def acquire(self, lane, queued_at=None):
+        queued_at = queued_at or time.time()
+        with self._cond:
+            self._waiting[lane] += 1
+            try:
+                while self._blocked(lane):
+                    self._cond.wait()
+            finally:
+                self._waiting[lane] -= 1
+                # Đánh thức các làn thấp hơn đang chờ chính request này rời hàng
+                self._cond.notify_all()
+            self._in_flight += 1
+            wait = time.time() - queued_at
+            stats = self._stats[lane]
+            stats['requests'] += 1
+            stats['total_wait'] += wait
+            stats['max_wait'] = max(stats['max_wait'], wait)
+        return wait
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def get_stats(self) -> Dict:
+        with self._cond:
+            lanes = {}
+            for lane, name in enumerate(_PRIORITY_NAMES):
+                stats = self._stats[lane]
+                lanes[name] = {
+                    'requests': stats['requests'],
+                    'waiting': self._waiting[lane],
+                    'avg_wait_ms': stats['total_wait'] / stats['requests'] * 1000 if stats['requests'] else 0.0,
+                    'max_wait_ms': stats['max_wait'] * 1000,
+                }
+            return {'in_flight': self._in_flight, 'max_in_flight': self._max_in_flight, 'lanes': lanes}
+
+_REQUEST_SCHEDULER = RequestScheduler()
+
+# ========== GỘP REQUEST GET TRÙNG LẶP (SINGLE-FLIGHT) ==========
+# Tham số thay đổi theo từng lần ký, không ảnh hưởng nội dung trả về
+_SINGLE_FLIGHT_IGNORED_PARAMS = {'timestamp', 'signature', 'recvWindow'}
+
+def _single_flight_key(url, params=None, headers=None):
+    parts = urllib.parse.urlsplit(url)
+    items = urllib.parse.parse_qsl(parts.query) + [(k, str(v)) for k, v in (params or {}).items()]
+    items = sorted((k, v) for k, v in items if k not in _SINGLE_FLIGHT_IGNORED_PARAMS)
+    api_key = (headers or {}).get('X-MBX-APIKEY', '')
+    return (parts.netloc, parts.path, tuple(items), api_key)
+
+class SingleFlight:
+    """Khi một GET đang chạy, các lời gọi giống hệt chờ và dùng chung kết quả thay vì gửi thêm request.
+    Chỉ gộp vào request dẫn đầu ở làn ưu tiên bằng hoặc cao hơn; chờ quá `wait_timeout` thì tự gửi."""
+    def __init__(self, wait_timeout=10.0):
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._executed = 0
+        self._deduplicated = 0
+        self._saved_weight = 0
+        self._bypassed = 0
+        self._wait_timeouts = 0
+
+    def do(self, key, fn, weight=0, priority=PRIORITY_MARKET):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'event': threading.Event(), 'result': None, 'priority': priority}
+                self._calls[key] = call
+                self._executed += 1
+            elif call['priority'] > priority:
+                # Request dẫn đầu ở làn thấp hơn → không chờ sau nó, gửi riêng ở làn của mình
+                self._bypassed += 1
+                self._executed += 1
+                call = None
+            else:
+                self._deduplicated += 1
+                self._saved_weight += weight
+
+        if call is None:
+            return fn()
+        if not leader:
+            if call['event'].wait(self.wait_timeout):
+                return call['result']
+            with self._lock:
+                self._wait_timeouts += 1
+            return fn()
+
+        try:
+            call['result'] = fn()
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['event'].set()
+        return call['result']
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'executed': self._executed,
+                'deduplicated': self._deduplicated,
+                'saved_weight': self._saved_weight,
+                'bypassed': self._bypassed,
+                'wait_timeouts': self._wait_timeouts,
+                'in_flight': len(self._calls),
+            }
+
+_SINGLE_FLIGHT = SingleFlight()
+
+# ========== ĐỒNG BỘ GIỜ SERVER & RECVWINDOW ==========
+class ServerTimeSync:
+    """Đo độ lệch đồng hồ và RTT với /fapi/v1/time, áp dụng cho timestamp của mọi request ký
+    và chọn recvWindow theo độ trễ mạng quan sát được"""
+    def __init__(self, interval=300, samples=3, min_recv_window=5000, max_recv_window=60000):
+        self.interval = interval
+        self._samples = samples
+        self._min_recv_window = min_recv_window
+        self._max_recv_window = max_recv_window
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()   # Chỉ một lần đồng bộ chạy tại một thời điểm
+        self._offset_ms = 0.0
+        self._drift_ms = 0.0
+        self._rtt_ms = None
+        self._rtt_history = deque(maxlen=20)
+        self._last_sync = 0
+        self._syncs = 0
+        self._rejections = 0
+
+    def _sample(self):
+        """Một mẫu (RTT, offset). Chỉ bấm giờ quanh lời gọi HTTP – không tính thời gian chờ của
+        rate limiter / làn ưu tiên / single-flight, vốn làm lệch offset và phình recvWindow"""
+        _RATE_LIMITER.acquire(_request_weight('GET', '/fapi/v1/time')[0])
+        try:
+            t0 = time.time()
+            status, headers, content = _HTTP_TRANSPORT.request('GET', f"{_BINANCE_REST_BASE}/fapi/v1/time")
+            t1 = time.time()
+        except Exception as e:
+            logger.debug(f"Lỗi lấy giờ server: {str(e)}")
+            return None
+        _RATE_LIMITER.update_from_headers(headers)
+        if status != 200:
+            return None
+        try:
+            server_time = json.loads(content.decode())['serverTime']
+        except (ValueError, KeyError, TypeError):
+            return None
+        return (t1 - t0) * 1000, server_time - (t0 + t1) / 2 * 1000
+
+    def sync(self, samples=None):
+        """Lấy mẫu giờ server, giữ mẫu có RTT nhỏ nhất (chính xác nhất)"""
+        with self._sync_lock:
+            return self._sync(samples or self._samples)
+
+    def resync(self, since):
+        """Đồng bộ nhanh (một mẫu) sau khi bị từ chối -1021. Nếu luồng khác đã đồng bộ xong sau thời điểm
+        `since` (lúc request bị từ chối được ký) thì dùng lại offset mới, không gửi thêm request"""
+        with self._sync_lock:
+            with self._lock:
+                if self._last_sync >= since:
+                    return True
+            return self._sync(1)
+
+    def _sync(self, samples):
+        best = None
+        for _ in range(samples):
+            sample = self._sample()
+            if sample is not None and (best is None or sample[0] < best[0]):
+                best = sample
+        if best is None:
+            logger.warning("⚠️ Không đồng bộ được giờ server Binance")
+            return False
+
+        rtt, offset = best
+        with self._lock:
+            if self._syncs:
+                self._drift_ms = offset - self._offset_ms
+            self._offset_ms = offset
+            self._rtt_ms = rtt
+            self._rtt_history.append(rtt)
+            self._last_sync = time.time()
+            self._syncs += 1
+        if abs(offset) > 1000:
+            logger.warning(f"⚠️ Đồng hồ lệch {offset:.0f}ms so với server Binance (RTT {rtt:.0f}ms)")
+        else:
+            logger.info(f"🕒 Đồng bộ giờ server: lệch {offset:.0f}ms, RTT {rtt:.0f}ms")
+        return True
+
+    def needs_sync(self) -> bool:
+        with self._lock:
+            return time.time() - self._last_sync > self.interval
+
+    def now_ms(self) -> int:
+        with self._lock:
+            return int(time.time() * 1000 + self._offset_ms)
+
+    def recv_window(self) -> int:
+        """recvWindow = mặc định 5s, nới rộng khi RTT hoặc độ trôi đồng hồ lớn"""
+        with self._lock:
+            if not self._rtt_history:
+                return self._min_recv_window
+            window = 1000 + 4 * max(self._rtt_history) + 2 * abs(self._drift_ms)
+            return int(min(self._max_recv_window, max(self._min_recv_window, window)))
+
+    def record_rejection(self):
+        with self._lock:
+            self._rejections += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'offset_ms': self._offset_ms,
+                'drift_ms': self._drift_ms,
+                'rtt_ms': self._rtt_ms,
+                'max_rtt_ms': max(self._rtt_history) if self._rtt_history else None,
+                'recv_window': self.recv_window(),
+                'last_sync': self._last_sync,
+                'syncs': self._syncs,
+                'rejections': self._rejections,
+            }
+
+_TIME_SYNC = ServerTimeSync()
+
+# ========== NGẮT MẠCH THEO ENDPOINT (CIRCUIT BREAKER) ==========
+class CircuitBreaker:
+    """Mở mạch sau nhiều lỗi liên tiếp – trong thời gian mở, request thất bại ngay thay vì ngủ chờ.
+    Thời gian mở tăng gấp đôi sau mỗi lần mở lại liên tiếp."""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, base_cooldown=5, max_cooldown=300):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_until = 0
+        self.probe_in_flight = False
+        self.total_failures = 0
+        self.rejected = 0
+        self.last_error = None
+
+    def allow(self, now):
+        if self.state == self.OPEN:
+            if now < self.opened_until:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self.probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            # Chỉ cho 1 request thăm dò đi qua
+            if self.probe_in_flight:
+                self.rejected += 1
+                return False
+            self.probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.probe_in_flight = False
+
+    def release_probe(self):
+        """Trả lại lượt thăm dò chưa được dùng (request bị breaker khác chặn trước khi gửi)"""
+        if self.state == self.HALF_OPEN:
+            self.probe_in_flight = False
+
+    def probing(self):
+        return self.state == self.HALF_OPEN and self.probe_in_flight
+
+    def record_failure(self, error, now):
+        self.failures += 1
+        self.total_failures += 1
+        self.last_error = error
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            cooldown = min(self.max_cooldown, self.base_cooldown * (2 ** self.trips))
+            self.trip(cooldown, error, now)
+
+    def trip(self, duration, reason, now):
+        self.state = self.OPEN
+        self.opened_until = max(self.opened_until, now + duration)
+        self.trips += 1
+        self.failures = 0
+        self.probe_in_flight = False
+        self.last_error = reason
+        logger.warning(f"🚫 Ngắt mạch {self.name} trong {self.opened_until - now:.0f}s: {reason}")
+
+    def get_stats(self, now) -> Dict:
+        return {
+            'state': self.state,
+            'retry_in': max(0.0, self.opened_until - now) if self.state == self.OPEN else 0.0,
+            'failures': self.failures,
+            'trips': self.trips,
+            'total_failures': self.total_failures,
+            'rejected': self.rejected,
+            'last_error': self.last_error,
+        }
+
+class CircuitBreakerRegistry:
+    """Một breaker cho mỗi endpoint, cộng thêm breaker toàn cục cho lệnh cấm theo IP (429/418)"""
+    GLOBAL = '*'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers = {self.GLOBAL: CircuitBreaker('IP (429/418)')}
+
+    def _get(self, endpoint):
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+    def allow(self, endpoint):
+        with self._lock:
+            now = time.time()
+            global_breaker = self._breakers[self.GLOBAL]
+            had_probe = global_breaker.probing()
+            if not global_breaker.allow(now):
+                return False
+            if self._get(endpoint).allow(now):
+                return True
+            # Endpoint từ chối → lượt thăm dò toàn cục vừa cấp không được dùng, trả lại
+            if not had_probe and global_breaker.probing():
+                global_breaker.release_probe()
+            return False
+
+    def record_success(self, endpoint):
+        with self._lock:
+            self._get(endpoint).record_success()
+            global_breaker = self._breakers[self.GLOBAL]
+            if global_breaker.state == CircuitBreaker.HALF_OPEN:
+                global_breaker.record_success()
+
+    def record_failure(self, endpoint, error):
+        with self._lock:
+            now = time.time()
+            self._get(endpoint).record_failure(error, now)
+            # Request thăm dò của breaker toàn cục thất bại → mở lại, không để lượt thăm dò treo mãi
+            global_breaker = self._breakers[self.GLOBAL]
+            if global_breaker.probing():
+                global_breaker.record_failure(error, now)
+
+    def record_rate_limited(self, status, retry_after, error_content='', endpoint=None):
+        """429/418: Binance áp dụng cho cả IP → mở breaker toàn cục theo Retry-After / thời hạn cấm"""
         now = time.time()
-        delta = now - _BINANCE_LAST_REQUEST_TIME
-        if delta < _BINANCE_MIN_INTERVAL:
-            time.sleep(_BINANCE_MIN_INTERVAL - delta)
-        _BINANCE_LAST_REQUEST_TIME = time.time()
+        duration = None
+        if status == 418:
+            # Thông điệp dạng "... banned until 1700000000000 ..."
+            match = re.search(r'until (\d{13})', error_content)
+            if match:
+                duration = int(match.group(1)) / 1000 - now
+        if duration is None and retry_after:
+            try:
+                duration = float(retry_after)
+            except ValueError:
+                duration = None
+        if duration is None or duration <= 0:
+            duration = 120 if status == 418 else 30
+        with self._lock:
+            self._breakers[self.GLOBAL].trip(duration, f"HTTP {status}", now)
+            # Request thăm dò của breaker endpoint bị 429/418 → mở lại breaker đó
+            breaker = self._breakers.get(endpoint) if endpoint else None
+            if breaker is not None and breaker.probing():
+                breaker.record_failure(f"HTTP {status}", now)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            now = time.time()
+            return {name: breaker.get_stats(now) for name, breaker in self._breakers.items()}
+
+_CIRCUIT_BREAKERS = CircuitBreakerRegistry()
+
+# ========== HÀM API BINANCE CẢI TIẾN ==========
+def set_binance_base_urls(rest_url=None, ws_url=None):
+    """Chuyển địa chỉ REST/WebSocket (vd. sang sàn giả lập để test, benchmark)"""
+    global _BINANCE_REST_BASE, _BINANCE_WS_BASE
+    if rest_url:
+        _BINANCE_REST_BASE = rest_url.rstrip('/')
+    if ws_url:
+        _BINANCE_WS_BASE = ws_url.rstrip('/')
+    logger.info(f"🔧 Binance REST: {_BINANCE_REST_BASE} | WebSocket: {_BINANCE_WS_BASE}")
 
 def sign(query, api_secret):
     try:
@@ -390,67 +1419,125 @@ def sign(query, api_secret):
         logger.error(f"Lỗi ký: {str(e)}")
         return ""
 
-def binance_api_request(url, method='GET', params=None, headers=None):
+def binance_api_request(url, method='GET', params=None, headers=None, priority=None, api_secret=None,
+                        consumer=None):
+    """Gửi request REST tới Binance. Nếu có `api_secret`, request được ký lại (timestamp theo giờ
+    server + recvWindow) ở mỗi lần thử. `consumer` (nếu có) đọc phản hồi 200 theo luồng thay cho json.loads."""
+    if priority is None:
+        priority = _default_priority(method, url)
+    # Lệnh đóng luôn gửi trực tiếp, không chờ request cùng loại ở làn thấp hơn
+    if method.upper() == 'GET' and priority != PRIORITY_CLOSE and consumer is None:
+        weight, _ = _request_weight(method, url, params)
+        return _SINGLE_FLIGHT.do(
+            _single_flight_key(url, params, headers),
+            lambda: _send_binance_request(url, method, params, headers, priority, api_secret),
+            weight, priority
+        )
+    return _send_binance_request(url, method, params, headers, priority, api_secret, consumer)
+
+def _error_code(error_content):
+    """Lấy mã lỗi Binance (vd. -1021) từ nội dung phản hồi lỗi, None nếu không đọc được"""
+    try:
+        return json.loads(error_content).get('code')
+    except (ValueError, AttributeError):
+        return None
+
+def _signed_url(url, params, api_secret):
+    signed_params = dict(params or {})
+    signed_params['timestamp'] = _TIME_SYNC.now_ms()
+    signed_params['recvWindow'] = _TIME_SYNC.recv_window()
+    query = urllib.parse.urlencode(signed_params)
+    return f"{url}?{query}&signature={sign(query, api_secret)}"
+
+def _send_binance_request(url, method, params, headers, priority, api_secret=None, consumer=None):
     max_retries = 3
     base_url = url
-    retryable_codes = {429, 418, 500, 502, 503, 504}
-    retryable_errors = ('Timeout', 'ConnectionError', 'BadStatusLine', 'URLError')
+    endpoint = urllib.parse.urlsplit(url).path
+    retryable_codes = {500, 502, 503, 504}
+    retryable_errors = ('Timeout', 'ConnectionError', 'ConnectionReset', 'RemoteDisconnected',
+                        'BrokenPipe', 'BadStatusLine', 'IncompleteRead', 'URLError')
+    weight, orders = _request_weight(method, url, params)
 
     for attempt in range(max_retries):
+        # Breaker đang mở → thất bại ngay, không giữ luồng bot
+        if not _CIRCUIT_BREAKERS.allow(endpoint):
+            logger.debug(f"Ngắt mạch đang mở, bỏ qua request {endpoint}")
+            return None
         try:
-            _wait_for_rate_limit()
+            queued_at = time.time()
+            # Làn đóng lệnh không bị giãn nhịp sau các làn thấp hơn (chỉ chờ khi thật sự hết token)
+            _RATE_LIMITER.acquire(weight, orders, _PRIORITY_RESERVE[priority], pace=priority != PRIORITY_CLOSE)
             url = base_url
+            method = method.upper()
 
             if headers is None: headers = {}
             if 'User-Agent' not in headers:
                 headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
 
-            if method.upper() == 'GET':
-                if params:
-                    query = urllib.parse.urlencode(params)
-                    url = f"{url}?{query}"
-                req = urllib.request.Request(url, headers=headers)
-            else:
-                data = urllib.parse.urlencode(params).encode() if params else None
-                req = urllib.request.Request(url, data=data, headers=headers, method=method)
-
-            with urllib.request.urlopen(req, timeout=15) as response:
-                if response.status == 200:
-                    return json.loads(response.read().decode())
-                else:
-                    error_content = response.read().decode()
-                    logger.error(f"Lỗi API ({response.status}): {error_content}")
-                    if response.status in retryable_codes:
-                        sleep_time = (2 ** attempt) + random.random()
-                        logger.warning(f"⚠️ Lỗi {response.status}, đợi {sleep_time:.2f}s, lần thử {attempt+1}/{max_retries}")
-                        time.sleep(sleep_time)
-                        continue
-                    else:
-                        return None
-
-        except urllib.error.HTTPError as e:
-            if e.code == 451:
+            _REQUEST_SCHEDULER.acquire(priority, queued_at)
+            signed_at = time.time()
+            try:
+                # Ký sau khi được cấp lượt để timestamp không bị cũ khi chờ trong hàng đợi
+                body = None
+                if api_secret:
+                    url = _signed_url(url, params, api_secret)
+                elif method == 'GET':
+                    if params:
+                        query = urllib.parse.urlencode(params)
+                        url = f"{url}?{query}"
+                elif params:
+                    body = urllib.parse.urlencode(params).encode()
+                    headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+                status, resp_headers, content = _HTTP_TRANSPORT.request(method, url, body=body, headers=headers,
+                                                                        consumer=consumer)
+            finally:
+                _REQUEST_SCHEDULER.release()
+            _RATE_LIMITER.update_from_headers(resp_headers)
+            if status == 200:
+                _CIRCUIT_BREAKERS.record_success(endpoint)
+                return content if consumer is not None else json.loads(content.decode())
+
+            if status == 451:
+                _CIRCUIT_BREAKERS.record_failure(endpoint, "HTTP 451")
                 logger.error("❌ Lỗi 451: Truy cập bị chặn - Kiểm tra VPN/proxy")
                 return None
-            else:
-                logger.error(f"Lỗi HTTP ({e.code}): {e.reason}")
-
-            if e.code in retryable_codes:
-                sleep_time = (2 ** attempt) + random.random()
-                logger.warning(f"⚠️ HTTP {e.code}, đợi {sleep_time:.2f}s, lần thử {attempt+1}/{max_retries}")
+            error_content = content.decode(errors='replace')
+            logger.error(f"Lỗi API ({status}): {error_content}")
+            if status in (429, 418):
+                _CIRCUIT_BREAKERS.record_rate_limited(status, resp_headers.get('retry-after'), error_content,
+                                                      endpoint)
+                return None
+            if status in retryable_codes:
+                _CIRCUIT_BREAKERS.record_failure(endpoint, f"HTTP {status}")
+                sleep_time = min(1.0, 0.1 * (2 ** attempt)) + random.random() * 0.1
+                logger.warning(f"⚠️ Lỗi {status}, đợi {sleep_time:.2f}s, lần thử {attempt+1}/{max_retries}")
                 time.sleep(sleep_time)
                 continue
-            else:
-                return None
+            # Lỗi nghiệp vụ (4xx) – endpoint vẫn hoạt động bình thường
+            _CIRCUIT_BREAKERS.record_success(endpoint)
+            if api_secret and _error_code(error_content) == -1021 and attempt < max_retries - 1:
+                # Timestamp lệch khỏi recvWindow – đồng bộ lại giờ server rồi ký lại ngay
+                _TIME_SYNC.record_rejection()
+                _TIME_SYNC.resync(since=signed_at)
+                continue
+            return None
 
         except Exception as e:
             error_name = type(e).__name__
+            if getattr(e, 'request_sent', False) and method.upper() not in _IDEMPOTENT_METHODS:
+                # Không biết sàn đã xử lý hay chưa → không gửi lại; lệnh được tra lại theo clientOrderId
+                _CIRCUIT_BREAKERS.record_failure(endpoint, error_name)
+                logger.error(f"❌ Mất phản hồi sau khi đã gửi {method} {endpoint} ({error_name}), không gửi lại: {str(e)}")
+                return None
             if any(ret in error_name for ret in retryable_errors) or 'timeout' in str(e).lower():
-                sleep_time = (2 ** attempt) + random.random()
+                _CIRCUIT_BREAKERS.record_failure(endpoint, error_name)
+                sleep_time = min(1.0, 0.1 * (2 ** attempt)) + random.random() * 0.1
                 logger.warning(f"⚠️ Lỗi kết nối ({error_name}), đợi {sleep_time:.2f}s, lần thử {attempt+1}/{max_retries}: {str(e)}")
                 time.sleep(sleep_time)
                 continue
             else:
+                _CIRCUIT_BREAKERS.record_failure(endpoint, error_name)
                 logger.error(f"Lỗi không xác định (lần thử {attempt + 1}): {str(e)}")
                 if attempt == max_retries - 1:
                     return None
@@ -459,59 +1546,191 @@ def binance_api_request(url, method='GET', params=None, headers=None):
     logger.error(f"❌ Thất bại yêu cầu API sau {max_retries} lần thử: {base_url}")
     return None
 
+# ========== PHÂN TÍCH exchangeInfo THEO LUỒNG ==========
+class ExchangeInfoStreamParser:
+    """Consumer cho HttpConnectionPool.request: đọc exchangeInfo theo từng khối, tách từng phần tử
+    của mảng "symbols" bằng raw_decode và chỉ giữ kết quả của `keep_symbol` – không giữ cả tài liệu"""
+    _SYMBOLS_KEY = re.compile(r'"symbols"\s*:\s*\[')
+    _SEPARATORS = ' \t\r\n,'
+
+    def __init__(self, keep_symbol: Callable[[Dict], Optional[Dict]], chunk_size=64 * 1024,
+                 trace_memory=None):
+        self._keep_symbol = keep_symbol
+        self._chunk_size = chunk_size
+        self._trace_memory = _EXCHANGE_INFO_TRACE_MEMORY if trace_memory is None else trace_memory
+        self.results: List[Dict] = []
+        self.digest = None
+        self.stats: Dict = {}
+
+    def __call__(self, response):
+        """stats['peak_buffer_chars']: độ dài lớn nhất của bộ đệm văn bản (luôn có, gần như miễn phí).
+        stats['peak_memory_bytes']: bộ nhớ Python cấp phát đỉnh trong lúc phân tích, đo bằng tracemalloc
+        khi bật trace_memory (toàn tiến trình – gồm cả cấp phát của thread khác), None nếu không đo."""
+        if not self._trace_memory:
+            return self._parse(response)
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            result = self._parse(response)
+            self.stats['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1] - baseline
+            return result
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+    def _parse(self, response):
+        # Có thể được gọi lại khi request thử lại – luôn bắt đầu từ trạng thái sạch
+        started = time.perf_counter()
+        self.results = []
+        reader = _ChunkReader(response, self._chunk_size)
+        json_decoder = json.JSONDecoder()
+        digest = hashlib.sha1()
+        seen = 0
+
+        while True:
+            match = self._SYMBOLS_KEY.search(reader.buffer, reader.pos)
+            if match:
+                reader.pos = match.end()
+                break
+            # Phần đầu (rateLimits, assets...) không cần – chỉ giữ đuôi phòng khoá bị cắt giữa 2 khối
+            reader.pos = max(reader.pos, len(reader.buffer) - 32)
+            if not reader.fill():
+                raise ValueError("exchangeInfo không có trường symbols")
+
+        while True:
+            if not reader.skip(self._SEPARATORS):
+                raise ValueError("exchangeInfo bị cắt cụt")
+            if reader.buffer[reader.pos] == ']':
+                break
+            try:
+                symbol_info, end = json_decoder.raw_decode(reader.buffer, reader.pos)
+            except ValueError:
+                # Phần tử chưa nhận đủ – đọc thêm khối rồi thử lại
+                if not reader.fill():
+                    raise
+                continue
+            digest.update(reader.buffer[reader.pos:end].encode())
+            reader.pos = end
+            seen += 1
+            coin = self._keep_symbol(symbol_info)
+            if coin is not None:
+                self.results.append(coin)
+
+        reader.drain()
+        self.digest = digest.hexdigest()
+        self.stats = {
+            'bytes': reader.total_bytes,
+            'symbols_seen': seen,
+            'symbols_kept': len(self.results),
+            'parse_ms': (time.perf_counter() - started) * 1000,
+            'peak_buffer_chars': reader.peak_buffer,
+            'peak_memory_bytes': None,
+        }
+        return self
+
+class _ChunkReader:
+    """Bộ đệm văn bản trượt trên phản hồi HTTP: chỉ giữ phần chưa xử lý kể từ `pos`"""
+    def __init__(self, response, chunk_size):
+        self._response = response
+        self._chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.total_bytes = 0
+        self.peak_buffer = 0
+
+    def fill(self) -> bool:
+        chunk = self._response.read(self._chunk_size)
+        self.buffer = self.buffer[self.pos:] + self._decoder.decode(chunk, final=not chunk)
+        self.pos = 0
+        self.total_bytes += len(chunk)
+        self.peak_buffer = max(self.peak_buffer, len(self.buffer))
+        return bool(chunk)
+
+    def skip(self, chars) -> bool:
+        """Bỏ qua các ký tự trong `chars`; False nếu hết dữ liệu"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in chars:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return True
+            if not self.fill():
+                return False
+
+    def drain(self):
+        self.pos = len(self.buffer)
+        while self.fill():
+            self.pos = len(self.buffer)
+
 # ========== HÀM CACHE COIN – CHỈ BOTMANAGER GHI, BOT CHỈ ĐỌC ==========
-def refresh_coins_cache():
-    """Lấy và cập nhật danh sách coin USDT & USDC từ Binance Futures"""
+def _coin_from_symbol_info(symbol_info):
+    """Rút gọn một phần tử exchangeInfo thành bản ghi coin; None nếu không phải hợp đồng USDT/USDC đang giao dịch"""
+    symbol = symbol_info.get('symbol', '')
+    quote = symbol_info.get('quoteAsset', '')
+    if quote not in ('USDT', 'USDC'):
+        return None
+    if symbol_info.get('status') != 'TRADING':
+        return None
+    if symbol in _SYMBOL_BLACKLIST:
+        return None
+
+    # Không cần lấy max_leverage nữa, nhưng vẫn giữ để tương thích
+    max_leverage = 50
+    for f in symbol_info.get('filters', []):
+        if f['filterType'] == 'LEVERAGE' and 'maxLeverage' in f:
+            max_leverage = int(f['maxLeverage'])
+            break
+
+    step_size = 0.001
+    min_qty = 0.001
+    min_notional = 5.0
+    for f in symbol_info.get('filters', []):
+        if f['filterType'] == 'LOT_SIZE':
+            step_size = float(f['stepSize'])
+            min_qty = float(f.get('minQty', step_size))
+        if f['filterType'] == 'MIN_NOTIONAL':
+            min_notional = float(f.get('notional', 5.0))
+
+    return {
+        'symbol': symbol,
+        'quote': quote,
+        'max_leverage': max_leverage,  # vẫn giữ nhưng không dùng để lọc
+        'step_size': step_size,
+        'min_qty': min_qty,
+        'min_notional': min_notional,
+        'price': 0.0,
+        'volume': 0.0,
+        'last_price_update': 0,
+        'last_volume_update': 0
+    }
+
+def refresh_coins_cache(force=False):
+    """Lấy và cập nhật danh sách coin USDT & USDC từ Binance Futures (bỏ qua nếu nội dung không đổi)"""
     try:
-        url = "https://fapi.binance.com/fapi/v1/exchangeInfo"
-        data = binance_api_request(url)
-        if not data:
+        url = f"{_BINANCE_REST_BASE}/fapi/v1/exchangeInfo"
+        parser = binance_api_request(url, consumer=ExchangeInfoStreamParser(_coin_from_symbol_info))
+        if not parser:
             logger.error("❌ Không thể lấy exchangeInfo từ Binance")
             return False
 
-        coins = []
-        for symbol_info in data.get('symbols', []):
-            symbol = symbol_info.get('symbol', '')
-            quote = symbol_info.get('quoteAsset', '')
-            if quote not in ('USDT', 'USDC'):
-                continue
-            if symbol_info.get('status') != 'TRADING':
-                continue
-            if symbol in _SYMBOL_BLACKLIST:
-                continue
-
-            # Không cần lấy max_leverage nữa, nhưng vẫn giữ để tương thích
-            max_leverage = 50
-            for f in symbol_info.get('filters', []):
-                if f['filterType'] == 'LEVERAGE' and 'maxLeverage' in f:
-                    max_leverage = int(f['maxLeverage'])
-                    break
-
-            step_size = 0.001
-            min_qty = 0.001
-            min_notional = 5.0
-            for f in symbol_info.get('filters', []):
-                if f['filterType'] == 'LOT_SIZE':
-                    step_size = float(f['stepSize'])
-                    min_qty = float(f.get('minQty', step_size))
-                if f['filterType'] == 'MIN_NOTIONAL':
-                    min_notional = float(f.get('notional', 5.0))
-
-            coins.append({
-                'symbol': symbol,
-                'quote': quote,
-                'max_leverage': max_leverage,  # vẫn giữ nhưng không dùng để lọc
-                'step_size': step_size,
-                'min_qty': min_qty,
-                'min_notional': min_notional,
-                'price': 0.0,
-                'volume': 0.0,
-                'last_price_update': 0,
-                'last_volume_update': 0
-            })
+        stats = parser.stats
+        _COINS_CACHE.record_exchange_info_parse(stats)
+        memory = (f" | bộ nhớ đỉnh {stats['peak_memory_bytes'] / 1024:.0f}KB"
+                  if stats.get('peak_memory_bytes') is not None else "")
+        logger.info(f"📦 exchangeInfo: {stats['bytes'] / 1024:.0f}KB, {stats['symbols_seen']} symbol → "
+                    f"{stats['symbols_kept']} coin | {stats['parse_ms']:.0f}ms | "
+                    f"bộ đệm đỉnh {stats['peak_buffer_chars'] / 1024:.0f}K ký tự{memory}")
+
+        # Hash văn bản gốc của các symbol (không gồm serverTime) để biết nội dung có đổi không
+        if not force and not _COINS_CACHE.exchange_info_changed(parser.digest):
+            logger.info("ℹ️ exchangeInfo không thay đổi, giữ nguyên cache coin")
+            return True
 
-        _COINS_CACHE.update_data(coins)
-        _COINS_CACHE.update_volume_time()
+        coins = parser.results
+        _COINS_CACHE.update_data(coins, keep_market_data=True, exchange_info_digest=parser.digest)
         logger.info(f"✅ Đã cập nhật cache {len(coins)} coin USDT/USDC")
         return True
 
@@ -523,20 +1742,13 @@ def refresh_coins_cache():
 def update_coins_price():
     """Cập nhật giá cho tất cả coin trong cache"""
     try:
-        url = "https://fapi.binance.com/fapi/v1/ticker/price"
+        url = f"{_BINANCE_REST_BASE}/fapi/v1/ticker/price"
         all_prices = binance_api_request(url)
         if not all_prices:
             return False
 
         price_dict = {item['symbol']: float(item['price']) for item in all_prices}
-        coins = _COINS_CACHE.get_data()
-        updated = 0
-        for coin in coins:
-            if coin['symbol'] in price_dict:
-                coin['price'] = price_dict[coin['symbol']]
-                coin['last_price_update'] = time.time()
-                updated += 1
-        _COINS_CACHE.update_data(coins)
+        updated = _COINS_CACHE.update_prices(price_dict)
         _COINS_CACHE.update_price_time()
         logger.info(f"✅ Đã cập nhật giá cho {updated} coin")
         return True
@@ -547,20 +1759,13 @@ def update_coins_price():
 def update_coins_volume():
     """Cập nhật volume cho tất cả coin trong cache"""
     try:
-        url = "https://fapi.binance.com/fapi/v1/ticker/24hr"
+        url = f"{_BINANCE_REST_BASE}/fapi/v1/ticker/24hr"
         all_tickers = binance_api_request(url)
         if not all_tickers:
             return False
 
         volume_dict = {item['symbol']: float(item['volume']) for item in all_tickers}
-        coins = _COINS_CACHE.get_data()
-        updated = 0
-        for coin in coins:
-            if coin['symbol'] in volume_dict:
-                coin['volume'] = volume_dict[coin['symbol']]
-                coin['last_volume_update'] = time.time()
-                updated += 1
-        _COINS_CACHE.update_data(coins)
+        updated = _COINS_CACHE.update_volumes(volume_dict)
         _COINS_CACHE.update_volume_time()
         logger.info(f"✅ Đã cập nhật volume cho {updated} coin")
         return True
@@ -572,106 +1777,86 @@ def get_coins_with_info():
     """Lấy danh sách coin từ cache – KHÔNG refresh, chỉ đọc"""
     return _COINS_CACHE.get_data()
 
+_DEFAULT_SYMBOL_FILTERS = SymbolFilters('', '', 0.001, 0.001, 5.0, 50)
+
+def get_symbol_filters(symbol) -> SymbolFilters:
+    """Bộ lọc sàn của symbol, dùng giá trị mặc định nếu không có trong cache"""
+    if not symbol:
+        return _DEFAULT_SYMBOL_FILTERS
+    return _COINS_CACHE.lookup(symbol) or _DEFAULT_SYMBOL_FILTERS._replace(symbol=symbol.upper())
+
 def get_max_leverage_from_cache(symbol):
-    symbol = symbol.upper()
-    coins = _COINS_CACHE.get_data()
-    for coin in coins:
-        if coin['symbol'] == symbol:
-            return coin['max_leverage']
-    logger.warning(f"⚠️ Không tìm thấy {symbol} trong cache, dùng mặc định 50x")
-    return 50
+    filters = _COINS_CACHE.lookup(symbol)
+    if filters is None:
+        logger.warning(f"⚠️ Không tìm thấy {symbol.upper()} trong cache, dùng mặc định 50x")
+        return 50
+    return filters.max_leverage
 
 def get_min_notional_from_cache(symbol):
-    symbol = symbol.upper()
-    coins = _COINS_CACHE.get_data()
-    for coin in coins:
-        if coin['symbol'] == symbol:
-            return coin.get('min_notional', 5.0)
-    return 5.0
+    return get_symbol_filters(symbol).min_notional
 
 def get_min_qty_from_cache(symbol):
-    symbol = symbol.upper()
-    coins = _COINS_CACHE.get_data()
-    for coin in coins:
-        if coin['symbol'] == symbol:
-            return coin.get('min_qty', 0.001)
-    return 0.001
+    return get_symbol_filters(symbol).min_qty
 
 def get_step_size(symbol):
-    if not symbol: return 0.001
-    coins = _COINS_CACHE.get_data()
-    for coin in coins:
-        if coin['symbol'] == symbol.upper():
-            return coin['step_size']
-    return 0.001
+    return get_symbol_filters(symbol).step_size
 
 def force_refresh_coin_cache():
     """Buộc làm mới toàn bộ cache coin (dùng cho Telegram)"""
     logger.info("🔄 Buộc làm mới cache coin...")
-    if refresh_coins_cache():
+    if refresh_coins_cache(force=True):
         update_coins_volume()
         update_coins_price()
         return True
     return False
 
 # ========== HÀM LỌC COIN – ĐÃ LOẠI BỎ LỌC LEVERAGE ==========
-def filter_coins_for_side(side, excluded_coins=None):
+def select_coins_for_side(side, excluded_coins=None, as_dicts=False):
     """
-    Lọc coin theo chiến lược CÂN BẰNG.
+    Lọc coin theo chiến lược CÂN BẰNG (vector hoá trên cache dạng cột).
     - BUY  : price < buy_price_threshold
     - SELL : price > sell_price_threshold
     - KHÔNG lọc theo đòn bẩy từ exchangeInfo (chỉ dùng khi thực sự set leverage)
     - LOẠI BỎ coin có giá <= 0, nhưng giữ coin volume 0.
+    - Sắp xếp theo volume giảm dần nếu bật sort_by_volume.
     """
-    all_coins = get_coins_with_info()
-    filtered = []
-
-    if not all_coins:
-        logger.warning("❌ Cache coin trống!")
-        return filtered
+    if _COINS_CACHE.is_stale():
+        # Giá trong snapshot nạp từ đĩa có thể đã cũ nhiều ngày → không lọc theo ngưỡng giá
+        logger.warning(f"⏳ Cache coin chưa có giá mới sau khi nạp snapshot, tạm dừng lọc coin {side}")
+        if as_dicts:
+            return []
+        empty = _frozen(np.empty(0))
+        return CoinSelection(_frozen(np.empty(0, dtype=str)), empty, empty)
 
     buy_threshold = _BALANCE_CONFIG.get("buy_price_threshold", 1.0)
     sell_threshold = _BALANCE_CONFIG.get("sell_price_threshold", 10.0)
 
-    logger.info(f"🔍 Lọc coin {side} | {len(all_coins)} coin trong cache")
+    selection, stats = _COINS_CACHE.select(
+        side, buy_threshold, sell_threshold,
+        excluded=set(excluded_coins or []),
+        blacklist=_SYMBOL_BLACKLIST,
+        sort_by_volume=_BALANCE_CONFIG.get("sort_by_volume", True),
+        as_dicts=as_dicts,
+    )
+    if not stats['total']:
+        logger.warning("❌ Cache coin trống!")
+        return selection
+
+    logger.info(f"🔍 Lọc coin {side} | {stats['total']} coin trong cache")
     logger.info(f"⚙️ Ngưỡng: MUA < {buy_threshold} USDT/USDC, BÁN > {sell_threshold} USDT/USDC")
+    logger.info(f"📊 {side}: {stats['matched']} coin phù hợp (loại: blacklist={stats['blacklisted']}, excluded={stats['excluded']}, giá={stats['price_fail']}, volume0={stats['volume_zero']}, price0={stats['price_zero']})")
+    if as_dicts:
+        top = [(c['symbol'], c['price'], c['volume']) for c in selection[:5]]
+    else:
+        top = zip(selection.symbols[:5].tolist(), selection.prices[:5].tolist(), selection.volumes[:5].tolist())
+    for i, (symbol, price, volume) in enumerate(top):
+        logger.info(f"  {i+1}. {symbol} | giá: {price:.4f} | volume: {volume:.2f}")
 
-    excluded_set = set(excluded_coins or [])
-    blacklisted = 0
-    excluded_cnt = 0
-    price_fail = 0
-    volume_zero = 0
-    price_zero = 0
-
-    for coin in all_coins:
-        sym = coin['symbol']
-        if sym in _SYMBOL_BLACKLIST:
-            blacklisted += 1
-            continue
-        if sym in excluded_set:
-            excluded_cnt += 1
-            continue
-        if coin['price'] <= 0:
-            price_zero += 1
-            continue
-        if coin['volume'] <= 0:
-            volume_zero += 1   # vẫn giữ coin volume 0
-
-        if side == "BUY" and coin['price'] >= buy_threshold:
-            price_fail += 1
-            continue
-        if side == "SELL" and coin['price'] <= sell_threshold:
-            price_fail += 1
-            continue
-
-        filtered.append(coin)
-
-    logger.info(f"📊 {side}: {len(filtered)} coin phù hợp (loại: blacklist={blacklisted}, excluded={excluded_cnt}, giá={price_fail}, volume0={volume_zero}, price0={price_zero})")
-    if filtered:
-        for i, c in enumerate(filtered[:5]):
-            logger.info(f"  {i+1}. {c['symbol']} | giá: {c['price']:.4f} | volume: {c['volume']:.2f}")
-
-    return filtered
+    return selection
+
+def filter_coins_for_side(side, excluded_coins=None):
+    """View tương thích: trả về danh sách dict coin phù hợp"""
+    return select_coins_for_side(side, excluded_coins, as_dicts=True)
 
 def update_balance_config(buy_price_threshold=None, sell_price_threshold=None, min_leverage=None, sort_by_volume=None):
     """Cập nhật cấu hình cân bằng lệnh"""
@@ -688,28 +1873,29 @@ def update_balance_config(buy_price_threshold=None, sell_price_threshold=None, m
 def set_leverage(symbol, lev, api_key, api_secret):
     if not symbol: return False
     try:
-        ts = int(time.time() * 1000)
-        params = {"symbol": symbol.upper(), "leverage": lev, "timestamp": ts}
-        query = urllib.parse.urlencode(params)
-        sig = sign(query, api_secret)
-        url = f"https://fapi.binance.com/fapi/v1/leverage?{query}&signature={sig}"
+        params = {"symbol": symbol.upper(), "leverage": lev}
+        url = f"{_BINANCE_REST_BASE}/fapi/v1/leverage"
         headers = {'X-MBX-APIKEY': api_key}
-        response = binance_api_request(url, method='POST', headers=headers)
+        response = binance_api_request(url, method='POST', params=params, headers=headers, api_secret=api_secret)
         return bool(response and 'leverage' in response)
     except Exception as e:
         logger.error(f"Lỗi cài đặt đòn bẩy: {str(e)}")
         return False
 
+def _fetch_account(api_key, api_secret):
+    """Gọi /fapi/v2/account thực tế – chỉ dùng trong AccountCache"""
+    try:
+        url = f"{_BINANCE_REST_BASE}/fapi/v2/account"
+        headers = {'X-MBX-APIKEY': api_key}
+        return binance_api_request(url, headers=headers, api_secret=api_secret)
+    except Exception as e:
+        logger.error(f"Lỗi lấy thông tin tài khoản: {str(e)}")
+        return None
+
 def get_balance(api_key, api_secret):
     """Lấy số dư khả dụng (USDT + USDC)"""
     try:
-        ts = int(time.time() * 1000)
-        params = {"timestamp": ts}
-        query = urllib.parse.urlencode(params)
-        sig = sign(query, api_secret)
-        url = f"https://fapi.binance.com/fapi/v2/account?{query}&signature={sig}"
-        headers = {'X-MBX-APIKEY': api_key}
-        data = binance_api_request(url, headers=headers)
+        data = _ACCOUNT_CACHE.get(api_key, api_secret)
         if not data: return None
         for asset in data['assets']:
             if asset['asset'] in ('USDT', 'USDC'):
@@ -724,13 +1910,7 @@ def get_balance(api_key, api_secret):
 def get_total_and_available_balance(api_key, api_secret):
     """Lấy tổng số dư (walletBalance) và số dư khả dụng (availableBalance) của USDT+USDC"""
     try:
-        ts = int(time.time() * 1000)
-        params = {"timestamp": ts}
-        query = urllib.parse.urlencode(params)
-        sig = sign(query, api_secret)
-        url = f"https://fapi.binance.com/fapi/v2/account?{query}&signature={sig}"
-        headers = {"X-MBX-APIKEY": api_key}
-        data = binance_api_request(url, headers=headers)
+        data = _ACCOUNT_CACHE.get(api_key, api_secret)
         if not data:
             logger.error("❌ Không lấy được số dư từ Binance")
             return None, None
@@ -749,13 +1929,7 @@ def get_total_and_available_balance(api_key, api_secret):
 def get_margin_balance(api_key, api_secret):
     """Lấy số dư ký quỹ (totalMarginBalance)"""
     try:
-        ts = int(time.time() * 1000)
-        params = {"timestamp": ts}
-        query = urllib.parse.urlencode(params)
-        sig = sign(query, api_secret)
-        url = f"https://fapi.binance.com/fapi/v2/account?{query}&signature={sig}"
-        headers = {"X-MBX-APIKEY": api_key}
-        data = binance_api_request(url, headers=headers)
+        data = _ACCOUNT_CACHE.get(api_key, api_secret)
         if not data:
             return None
         margin_balance = float(data.get("totalMarginBalance", 0.0))
@@ -767,13 +1941,7 @@ def get_margin_balance(api_key, api_secret):
 
 def get_margin_safety_info(api_key, api_secret):
     try:
-        ts = int(time.time() * 1000)
-        params = {"timestamp": ts}
-        query = urllib.parse.urlencode(params)
-        sig = sign(query, api_secret)
-        url = f"https://fapi.binance.com/fapi/v2/account?{query}&signature={sig}"
-        headers = {"X-MBX-APIKEY": api_key}
-        data = binance_api_request(url, headers=headers)
+        data = _ACCOUNT_CACHE.get(api_key, api_secret)
         if not data:
             logger.error("❌ Không lấy được thông tin ký quỹ từ Binance")
             return None, None, None
@@ -789,45 +1957,173 @@ def get_margin_safety_info(api_key, api_secret):
         logger.error(f"Lỗi lấy thông tin an toàn ký quỹ: {str(e)}")
         return None, None, None
 
-def place_order(symbol, side, qty, api_key, api_secret):
+def place_order(symbol, side, qty, api_key, api_secret, priority=PRIORITY_OPEN, client_order_id=None):
     if not symbol: return None
     try:
-        ts = int(time.time() * 1000)
         params = {
             "symbol": symbol.upper(),
             "side": side,
             "type": "MARKET",
             "quantity": qty,
-            "timestamp": ts
+            "newOrderRespType": "RESULT",   # Lệnh MARKET trả luôn executedQty/avgPrice cuối cùng
         }
-        query = urllib.parse.urlencode(params)
-        sig = sign(query, api_secret)
-        url = f"https://fapi.binance.com/fapi/v1/order?{query}&signature={sig}"
+        if client_order_id:
+            params["newClientOrderId"] = client_order_id
+        url = f"{_BINANCE_REST_BASE}/fapi/v1/order"
         headers = {'X-MBX-APIKEY': api_key}
-        return binance_api_request(url, method='POST', headers=headers)
+        return binance_api_request(url, method='POST', params=params, headers=headers,
+                                   priority=priority, api_secret=api_secret)
     except Exception as e:
         logger.error(f"Lỗi lệnh: {str(e)}")
         return None
 
-def cancel_all_orders(symbol, api_key, api_secret):
+def cancel_all_orders(symbol, api_key, api_secret, priority=PRIORITY_OPEN):
     if not symbol: return False
     try:
-        ts = int(time.time() * 1000)
-        params = {"symbol": symbol.upper(), "timestamp": ts}
-        query = urllib.parse.urlencode(params)
-        sig = sign(query, api_secret)
-        url = f"https://fapi.binance.com/fapi/v1/allOpenOrders?{query}&signature={sig}"
+        params = {"symbol": symbol.upper()}
+        url = f"{_BINANCE_REST_BASE}/fapi/v1/allOpenOrders"
         headers = {'X-MBX-APIKEY': api_key}
-        response = binance_api_request(url, method='DELETE', headers=headers)
+        response = binance_api_request(url, method='DELETE', params=params, headers=headers,
+                                       priority=priority, api_secret=api_secret)
         return response is not None
     except Exception as e:
         logger.error(f"Lỗi hủy lệnh: {str(e)}")
         return False
 
+def query_order(symbol, api_key, api_secret, order_id=None, client_order_id=None, priority=PRIORITY_OPEN):
+    if not symbol: return None
+    try:
+        params = {"symbol": symbol.upper()}
+        if order_id is not None:
+            params["orderId"] = order_id
+        if client_order_id:
+            params["origClientOrderId"] = client_order_id
+        url = f"{_BINANCE_REST_BASE}/fapi/v1/order"
+        headers = {'X-MBX-APIKEY': api_key}
+        return binance_api_request(url, params=params, headers=headers, priority=priority, api_secret=api_secret)
+    except Exception as e:
+        logger.error(f"Lỗi truy vấn lệnh: {str(e)}")
+        return None
+
+# ========== THEO DÕI KHỚP LỆNH ==========
+class OrderTracker:
+    """Xác nhận kết quả khớp của từng lệnh theo newClientOrderId: từ phản hồi RESULT, sự kiện
+    ORDER_TRADE_UPDATE của luồng user-data, hoặc hỏi lại REST khi hết thời gian chờ"""
+    _TERMINAL_STATUSES = ('FILLED', 'CANCELED', 'EXPIRED', 'REJECTED', 'EXPIRED_IN_MATCH')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._pending: Dict[str, Dict] = {}   # clientOrderId -> {'event', 'fill'}
+        self._resolved_by = defaultdict(int)
+        self._timeouts = 0
+        self._waits = deque(maxlen=500)
+
+    @staticmethod
+    def new_client_order_id():
+        return f"bot_{uuid.uuid4().hex[:28]}"
+
+    def expect(self, client_order_id):
+        """Đăng ký trước khi gửi lệnh – sự kiện luồng có thể đến trước phản hồi REST"""
+        with self._lock:
+            self._pending[client_order_id] = {'event': threading.Event(), 'fill': None}
+
+    def forget(self, client_order_id):
+        with self._lock:
+            self._pending.pop(client_order_id, None)
+
+    def _resolve(self, client_order_id, fill, source):
+        with self._lock:
+            pending = self._pending.get(client_order_id)
+            if pending is None or pending['fill'] is not None:
+                return
+            pending['fill'] = dict(fill, source=source)
+            self._resolved_by[source] += 1
+        pending['event'].set()
+
+    @staticmethod
+    def _fill_from_order(order):
+        """Chuẩn hoá phản hồi /fapi/v1/order (RESULT hoặc truy vấn) thành bản ghi khớp"""
+        return {
+            'orderId': order.get('orderId'),
+            'symbol': order.get('symbol'),
+            'status': order.get('status'),
+            'executedQty': float(order.get('executedQty', 0)),
+            'avgPrice': float(order.get('avgPrice', 0)),
+        }
+
+    def on_order_update(self, event):
+        """Listener ORDER_TRADE_UPDATE của UserDataStream"""
+        order = event.get('o', {})
+        if order.get('X') not in self._TERMINAL_STATUSES:
+            return
+        self._resolve(order.get('c'), {
+            'orderId': order.get('i'),
+            'symbol': order.get('s'),
+            'status': order.get('X'),
+            'executedQty': float(order.get('z', 0)),
+            'avgPrice': float(order.get('ap', 0)),
+        }, 'stream')
+
+    def wait_fill(self, client_order_id, symbol, response, api_key, api_secret, timeout=3.0,
+                  priority=PRIORITY_OPEN):
+        """Chờ kết quả cuối của lệnh; trả về dict khớp lệnh hoặc None nếu không xác nhận được"""
+        started = time.time()
+        if response.get('status') in self._TERMINAL_STATUSES:
+            self._resolve(client_order_id, self._fill_from_order(response), 'response')
+        with self._lock:
+            pending = self._pending.get(client_order_id)
+        if pending is None:
+            return None
+
+        if not pending['event'].wait(timeout):
+            with self._lock:
+                self._timeouts += 1
+            order = query_order(symbol, api_key, api_secret, client_order_id=client_order_id, priority=priority)
+            if order and order.get('status') in self._TERMINAL_STATUSES:
+                self._resolve(client_order_id, self._fill_from_order(order), 'rest')
+        with self._lock:
+            self._waits.append((time.time() - started) * 1000)
+        return pending['fill']
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            waits = list(self._waits)
+            return {
+                'pending': len(self._pending),
+                'resolved_by': dict(self._resolved_by),
+                'timeouts': self._timeouts,
+                'avg_wait_ms': sum(waits) / len(waits) if waits else 0.0,
+                'max_wait_ms': max(waits) if waits else 0.0,
+            }
+
+_ORDER_TRACKER = OrderTracker()
+
+def execute_market_order(symbol, side, qty, api_key, api_secret, priority=PRIORITY_OPEN, timeout=3.0):
+    """Đặt lệnh MARKET và chờ kết quả khớp thực tế (không sleep/polling).
+    Trả về (phản hồi đặt lệnh, dict khớp lệnh hoặc None nếu chưa xác nhận được)."""
+    client_order_id = _ORDER_TRACKER.new_client_order_id()
+    _ORDER_TRACKER.expect(client_order_id)
+    try:
+        result = place_order(symbol, side, qty, api_key, api_secret, priority=priority,
+                             client_order_id=client_order_id)
+        if result is None:
+            # Không có phản hồi (có thể mất kết nối sau khi gửi) → hỏi sàn theo clientOrderId thay vì gửi lại
+            result = query_order(symbol, api_key, api_secret, client_order_id=client_order_id, priority=priority)
+            if result and 'orderId' in result:
+                logger.warning(f"⚠️ Lệnh {symbol} ({client_order_id}) đã tới sàn dù mất phản hồi, dùng trạng thái tra cứu")
+        if not result or 'orderId' not in result:
+            return result, None
+        _ACCOUNT_CACHE.invalidate(api_key)
+        fill = _ORDER_TRACKER.wait_fill(client_order_id, symbol, result, api_key, api_secret,
+                                        timeout=timeout, priority=priority)
+        return result, fill
+    finally:
+        _ORDER_TRACKER.forget(client_order_id)
+
 def get_current_price(symbol):
     if not symbol: return 0
     try:
-        url = f"https://fapi.binance.com/fapi/v1/ticker/price?symbol={symbol.upper()}"
+        url = f"{_BINANCE_REST_BASE}/fapi/v1/ticker/price?symbol={symbol.upper()}"
         data = binance_api_request(url)
         if data and 'price' in data:
             price = float(data['price'])
@@ -837,85 +2133,272 @@ def get_current_price(symbol):
         logger.error(f"Lỗi giá {symbol}: {str(e)}")
         return 0
 
+# ========== CACHE TÀI KHOẢN TẬP TRUNG ==========
+class AccountCache:
+    """Snapshot /fapi/v2/account dùng chung cho mọi hàm số dư – mỗi TTL chỉ gọi API 1 lần,
+    các lần làm mới đồng thời được gộp thành 1 request"""
+    def __init__(self, ttl=3):
+        self._ttl = ttl
+        self._lock = threading.RLock()
+        self._snapshots = {}   # api_key -> {'data', 'time', 'stale'}
+        self._inflight = {}    # api_key -> {'event', 'result'}
+        self._fetches = 0
+        self._hits = 0
+        self._coalesced = 0
+
+    def invalidate(self, api_key=None):
+        """Đánh dấu snapshot đã cũ (gọi sau khi khớp lệnh) – lần đọc tiếp theo sẽ lấy mới"""
+        with self._lock:
+            for key, snapshot in self._snapshots.items():
+                if api_key is None or key == api_key:
+                    snapshot['stale'] = True
+
+    def get(self, api_key, api_secret, force=False):
+        if not api_key or not api_secret:
+            return None
+        with self._lock:
+            snapshot = self._snapshots.get(api_key)
+            if (not force and snapshot and not snapshot['stale']
+                    and time.time() - snapshot['time'] < self._ttl):
+                self._hits += 1
+                return snapshot['data']
+            pending = self._inflight.get(api_key)
+            leader = pending is None
+            if leader:
+                pending = {'event': threading.Event(), 'result': None}
+                self._inflight[api_key] = pending
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            pending['event'].wait(timeout=30)
+            return pending['result']
+
+        data = None
+        try:
+            data = _fetch_account(api_key, api_secret)
+        finally:
+            with self._lock:
+                self._fetches += 1
+                if data:
+                    self._snapshots[api_key] = {'data': data, 'time': time.time(), 'stale': False}
+                self._inflight.pop(api_key, None)
+            pending['result'] = data
+            pending['event'].set()
+        return data
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'ttl': self._ttl,
+                'fetches': self._fetches,
+                'hits': self._hits,
+                'coalesced': self._coalesced,
+            }
+
+_ACCOUNT_CACHE = AccountCache()
+
 # ========== CACHE VỊ THẾ TẬP TRUNG ==========
+# Một vị thế đang mở đã parse sẵn sang số; `raw` giữ nguyên dòng positionRisk/luồng gốc
+PositionRecord = namedtuple('PositionRecord', ['symbol', 'position_side', 'amt', 'entry_price', 'unrealized_pnl', 'raw'])
+
 class PositionCache:
+    """Vị thế đang mở, đánh chỉ mục theo symbol → positionSide với bản ghi số đã parse sẵn.
+    Tổng long/short và PnL được cộng dồn theo từng thay đổi nên các truy vấn là O(1)."""
+
     def __init__(self):
-        self._positions = []
+        self._index: Dict[str, Dict[str, PositionRecord]] = {}   # symbol -> positionSide -> bản ghi (chỉ vị thế ≠ 0)
+        self._totals = (0, 0, 0.0, 0.0)   # (long_count, short_count, long_pnl, short_pnl)
         self._last_update = 0
         self._ttl = 5  # seconds (giảm xuống 5s để cập nhật nhanh hơn)
+        self._reconcile_interval = 60   # Khi luồng user-data hoạt động: chỉ đối soát REST mỗi 60s
         self._lock = threading.RLock()
         self._api_key = None
         self._api_secret = None
+        self._stream = None
+        self._event_times: Dict[Tuple[str, str], int] = {}   # (symbol, positionSide) -> thời điểm sự kiện (ms)
+        self._stream_updates = 0
+        self._reconciles = 0
+        self._reconcile_diffs = 0
+        self._refresh_failures = 0
+        self._failed_at = 0
 
     def initialize(self, api_key, api_secret):
         self._api_key = api_key
         self._api_secret = api_secret
 
+    def attach_stream(self, stream):
+        """Gắn luồng user-data: khi luồng khỏe, polling giãn thành đối soát định kỳ"""
+        self._stream = stream
+
+    def is_streaming(self):
+        """True khi vị thế đang được luồng user-data đẩy về (không cần ép refresh REST)"""
+        return self._stream is not None and self._stream.is_healthy()
+
+    def _effective_ttl(self):
+        if self.is_streaming():
+            return self._reconcile_interval
+        return self._ttl
+
+    @staticmethod
+    def _record(pos) -> Optional[PositionRecord]:
+        """Parse một dòng positionRisk một lần duy nhất; vị thế 0 trả về None"""
+        amt = float(pos.get('positionAmt', 0))
+        if amt == 0:
+            return None
+        return PositionRecord(pos['symbol'], pos.get('positionSide', 'BOTH'), amt,
+                              float(pos.get('entryPrice', 0)), float(pos.get('unRealizedProfit', 0)), pos)
+
+    @staticmethod
+    def _contribution(record):
+        if record is None:
+            return 0, 0, 0.0, 0.0
+        if record.amt > 0:
+            return 1, 0, record.unrealized_pnl, 0.0
+        return 0, 1, 0.0, record.unrealized_pnl
+
+    def _get(self, key) -> Optional[PositionRecord]:
+        return self._index.get(key[0], {}).get(key[1])
+
+    def _put(self, key, record):
+        """Thay bản ghi của (symbol, positionSide) và điều chỉnh tổng theo phần chênh lệch"""
+        symbol, side = key
+        old = self._get(key)
+        sides = dict(self._index.get(symbol, {}))   # copy-on-write: luồng đọc không thấy dict đang sửa
+        if record is None:
+            sides.pop(side, None)
+        else:
+            sides[side] = record
+        if sides:
+            self._index[symbol] = sides
+        else:
+            self._index.pop(symbol, None)
+        removed, added = self._contribution(old), self._contribution(record)
+        self._totals = tuple(t - r + a for t, r, a in zip(self._totals, removed, added))
+
+    def _rebuild(self, records: Dict[Tuple[str, str], PositionRecord]):
+        """Dựng lại chỉ mục và tổng từ đầu (sau mỗi lần refresh REST, xoá sai số cộng dồn)"""
+        index: Dict[str, Dict[str, PositionRecord]] = {}
+        totals = [0, 0, 0.0, 0.0]
+        for (symbol, side), record in records.items():
+            index.setdefault(symbol, {})[side] = record
+            for i, value in enumerate(self._contribution(record)):
+                totals[i] += value
+        self._index = index
+        self._totals = tuple(totals)
+
+    def _open_amounts(self):
+        return {(r.symbol, r.position_side): r.amt for sides in self._index.values() for r in sides.values()}
+
     def refresh(self, force=False):
         if not self._api_key or not self._api_secret:
             return
         with self._lock:
-            if not force and time.time() - self._last_update < self._ttl:
+            now = time.time()
+            if not force and (now - self._last_update < self._effective_ttl() or now - self._failed_at < self._ttl):
                 return
         try:
+            requested_at = _TIME_SYNC.now_ms()
             positions = get_positions(api_key=self._api_key, api_secret=self._api_secret)
+            if positions is None:
+                # Lỗi API ≠ tài khoản trống: giữ nguyên chỉ mục hiện tại, thử lại sau vài giây
+                with self._lock:
+                    self._refresh_failures += 1
+                    self._failed_at = time.time()
+                logger.warning("⚠️ Không lấy được vị thế từ REST, giữ cache vị thế hiện tại")
+                return
+            records = {}
+            for pos in positions:
+                record = self._record(pos)
+                if record is not None:
+                    records[(record.symbol, record.position_side)] = record
             with self._lock:
-                self._positions = positions
+                # Sự kiện luồng mới hơn thời điểm gửi request thì giữ trạng thái từ luồng (kể cả đã đóng)
+                for key, event_time in self._event_times.items():
+                    if event_time > requested_at:
+                        current = self._get(key)
+                        if current is None:
+                            records.pop(key, None)
+                        else:
+                            records[key] = current
+                if not force and self.is_streaming():
+                    # Đối soát: lệch nghĩa là luồng đã bỏ sót sự kiện
+                    self._reconciles += 1
+                    if {k: r.amt for k, r in records.items()} != self._open_amounts():
+                        self._reconcile_diffs += 1
+                        logger.warning("⚠️ Đối soát vị thế: cache từ luồng user-data lệch với REST, đã đồng bộ lại")
+                self._rebuild(records)
                 self._last_update = time.time()
         except Exception as e:
             logger.error(f"Lỗi làm mới cache vị thế: {str(e)}")
 
-    def get_positions(self, symbol=None):
-        self.refresh()
+    def apply_account_update(self, updates: List[Dict], event_time: int) -> int:
+        """Áp dụng phần "P" của sự kiện ACCOUNT_UPDATE, cập nhật tổng tăng dần"""
         with self._lock:
-            positions = self._positions
+            applied = 0
+            for update in updates:
+                key = (update['s'], update.get('ps', 'BOTH'))
+                if event_time < self._event_times.get(key, 0):
+                    continue   # Sự kiện đến trễ, đã có dữ liệu mới hơn
+                current = self._get(key)
+                pos = dict(current.raw) if current is not None else {'symbol': key[0], 'positionSide': key[1]}
+                pos.update({
+                    'positionAmt': update['pa'],
+                    'entryPrice': update['ep'],
+                    'breakEvenPrice': update.get('bep', pos.get('breakEvenPrice', '0')),
+                    'unRealizedProfit': update.get('up', '0'),
+                    'updateTime': event_time,
+                })
+                self._put(key, self._record(pos))
+                self._event_times[key] = event_time
+                applied += 1
+            self._stream_updates += applied
+            return applied
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'mode': 'stream' if self._effective_ttl() == self._reconcile_interval else 'polling',
+                'age': time.time() - self._last_update if self._last_update else None,
+                'open_positions': self._totals[0] + self._totals[1],
+                'stream_updates': self._stream_updates,
+                'reconciles': self._reconciles,
+                'reconcile_diffs': self._reconcile_diffs,
+                'refresh_failures': self._refresh_failures,
+            }
+
+    def get_records(self, symbol=None) -> List[PositionRecord]:
+        """Bản ghi đã parse sẵn của các vị thế đang mở (của một symbol hoặc toàn bộ)"""
+        self.refresh()
         if symbol:
-            symbol = symbol.upper()
-            return [p for p in positions if p['symbol'] == symbol]
-        return positions
+            return list(self._index.get(symbol.upper(), {}).values())
+        with self._lock:
+            return [r for sides in self._index.values() for r in sides.values()]
+
+    def get_positions(self, symbol=None):
+        """Dòng positionRisk gốc (dict) của các vị thế đang mở – giữ tương thích với code cũ"""
+        return [r.raw for r in self.get_records(symbol)]
 
     def has_position(self, symbol):
-        positions = self.get_positions(symbol)
-        if not positions:
-            return False
-        for pos in positions:
-            if abs(float(pos.get('positionAmt', 0))) > 0:
-                return True
-        return False
+        self.refresh()
+        return symbol.upper() in self._index
 
     def get_counts_and_pnl(self):
         self.refresh()
-        long_count = 0
-        short_count = 0
-        long_pnl = 0.0
-        short_pnl = 0.0
-        with self._lock:
-            positions = self._positions
-        for pos in positions:
-            amt = float(pos.get('positionAmt', 0))
-            if amt != 0:
-                pnl = float(pos.get('unRealizedProfit', 0))
-                if amt > 0:
-                    long_count += 1
-                    long_pnl += pnl
-                else:
-                    short_count += 1
-                    short_pnl += pnl
-        return long_count, short_count, long_pnl, short_pnl
+        return self._totals
 
 _POSITION_CACHE = PositionCache()
 
-def get_positions(symbol=None, api_key=None, api_secret=None):
-    """Hàm gọi API thực tế – chỉ dùng trong PositionCache hoặc khi cần force"""
+def get_positions(symbol=None, api_key=None, api_secret=None, priority=PRIORITY_ACCOUNT):
+    """Hàm gọi API thực tế – chỉ dùng trong PositionCache hoặc khi cần force.
+    None = gọi API thất bại (khác với [] = tài khoản không có vị thế)."""
     try:
-        ts = int(time.time() * 1000)
-        params = {"timestamp": ts}
+        params = {}
         if symbol: params["symbol"] = symbol.upper()
-        query = urllib.parse.urlencode(params)
-        sig = sign(query, api_secret)
-        url = f"https://fapi.binance.com/fapi/v2/positionRisk?{query}&signature={sig}"
+        url = f"{_BINANCE_REST_BASE}/fapi/v2/positionRisk"
         headers = {'X-MBX-APIKEY': api_key}
-        positions = binance_api_request(url, headers=headers)
+        positions = binance_api_request(url, params=params, headers=headers, priority=priority, api_secret=api_secret)
+        if positions is None: return None
         if not positions: return []
         if symbol:
             for pos in positions:
@@ -924,7 +2407,7 @@ def get_positions(symbol=None, api_key=None, api_secret=None):
         return positions
     except Exception as e:
         logger.error(f"Lỗi vị thế: {str(e)}")
-        return []
+        return None
 
 # ========== LỚP QUẢN LÝ CỐT LÕI ==========
 class CoinManager:
@@ -1132,10 +2615,14 @@ class SmartCoinFinder:
                 return None
             self.last_scan_time = now
 
-            coins = get_coins_with_info()
-            if not coins:
+            if not _COINS_CACHE.count():
                 logger.warning("⚠️ Cache coin trống, không thể tìm coin.")
                 return None
+            if _COINS_CACHE.is_stale():
+                if now - self.last_failed_search_log > 60:
+                    logger.warning("⏳ Cache coin đang dùng giá cũ từ snapshot, chờ dữ liệu thị trường mới để tìm coin")
+                    self.last_failed_search_log = now
+                return None
 
             if self._bot_manager and hasattr(self._bot_manager, 'global_side_coordinator'):
                 target_side = self._bot_manager.global_side_coordinator.get_next_side(
@@ -1146,30 +2633,26 @@ class SmartCoinFinder:
 
             logger.info(f"🎯 Hệ thống chọn hướng: {target_side} (đòn bẩy bot: {self.bot_leverage}x)")
 
-            filtered_coins = filter_coins_for_side(
-                target_side,
-                excluded_coins
-            )
+            selection = select_coins_for_side(target_side, excluded_coins)
 
-            if not filtered_coins:
+            if not len(selection.symbols):
                 if now - self.last_failed_search_log > 60:
                     logger.warning(f"⚠️ Không tìm thấy coin phù hợp cho hướng {target_side}")
                     self.last_failed_search_log = now
                 return None
 
             # Lọc bỏ coin đang trong blacklist tạm thời
-            for coin in filtered_coins:
-                symbol = coin['symbol']
+            for symbol, volume in zip(selection.symbols.tolist(), selection.volumes.tolist()):
                 if self._bot_manager and self._bot_manager.bot_coordinator.is_temp_blacklisted(symbol):
                     continue
                 if self.has_existing_position(symbol):
                     continue
                 if self._bot_manager and self._bot_manager.coin_manager.is_coin_active(symbol):
                     continue
-                logger.info(f"✅ Tìm thấy coin {symbol} phù hợp ({target_side}) | volume: {coin['volume']:.2f}")
+                logger.info(f"✅ Tìm thấy coin {symbol} phù hợp ({target_side}) | volume: {volume:.2f}")
                 return symbol
 
-            logger.warning(f"⚠️ Đã duyệt {len(filtered_coins)} coin nhưng không có coin nào chưa có vị thế")
+            logger.warning(f"⚠️ Đã duyệt {len(selection.symbols)} coin nhưng không có coin nào chưa có vị thế")
             return None
 
         except Exception as e:
@@ -1178,84 +2661,921 @@ class SmartCoinFinder:
             return None
 
 # ========== WEBSOCKET MANAGER CẢI TIẾN ==========
-class WebSocketManager:
+class _CombinedStreamConnection:
+    """Một kết nối /stream mang nhiều stream; thêm/bớt stream bằng SUBSCRIBE/UNSUBSCRIBE, không cần kết nối lại.
+    Mỗi lần start() chạy đúng một phiên; khi phiên kết thúc chỉ báo on_state – việc kết nối lại do supervisor lo."""
+
+    def __init__(self, index, on_data, on_state, stop_event, max_params=200):
+        self.index = index
+        self.streams = set()          # Stream mà kết nối này đang phụ trách
+        self._pending_sub = set()
+        self._pending_unsub = set()
+        self._on_data = on_data
+        self._on_state = on_state     # on_state(connection, connected) – không được chặn
+        self._stop_event = stop_event
+        self._max_params = max_params
+        self._lock = threading.RLock()
+        self._ws = None
+        self._thread = None
+        self.connected = False
+        self._next_id = 0
+        self.messages = 0
+        self.control_messages = 0
+        self.reconnects = 0
+        # Trạng thái cho supervisor
+        self.attempts = 0             # Số lần kết nối thất bại liên tiếp (cho backoff)
+        self.disconnected_at = 0.0    # Thời điểm rớt kết nối (0 = đang sống)
+        self.reconnect_at = 0.0       # Thời điểm supervisor hẹn kết nối lại (0 = không hẹn)
+        self.downtime = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"ws-pool-{self.index}")
+        self._thread.start()
+
+    def close(self):
+        ws = self._ws
+        if ws:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    def _run(self):
+        self._ws = websocket.WebSocketApp(
+            f"{_BINANCE_WS_BASE}/stream", on_open=self._on_open, on_message=self._on_message,
+            on_error=lambda ws, error: logger.error(f"Lỗi WebSocket #{self.index}: {str(error)}"),
+            on_close=self._on_close)
+        try:
+            self._ws.run_forever(ping_interval=60, ping_timeout=20)
+        except Exception as e:
+            logger.error(f"Lỗi WebSocket #{self.index}: {str(e)}")
+        self.connected = False
+        if not self._stop_event.is_set():
+            self._on_state(self, False)
+
+    def _on_open(self, ws):
+        with self._lock:
+            self.connected = True
+            # Kết nối mới chưa có stream nào: đăng ký lại toàn bộ trong một lượt
+            self._pending_sub = set(self.streams)
+            self._pending_unsub.clear()
+        self.flush()
+        self._on_state(self, True)
+
+    def _on_close(self, ws, close_status_code, close_msg):
+        self.connected = False
+        logger.info(f"WebSocket #{self.index} đã đóng: {close_status_code} - {close_msg}")
+
+    def _on_message(self, ws, message):
+        self.messages += 1
+        started = time.perf_counter()
+        try:
+            payload = json.loads(message)
+            if 'data' in payload:
+                self._on_data(payload['data'], started)
+            elif payload.get('error'):
+                logger.error(f"WebSocket #{self.index} từ chối yêu cầu {payload.get('id')}: {payload['error']}")
+        except Exception as e:
+            logger.error(f"Lỗi tin nhắn WebSocket #{self.index}: {str(e)}")
+
+    def add(self, streams):
+        with self._lock:
+            self.streams.update(streams)
+            self._pending_unsub.difference_update(streams)
+            self._pending_sub.update(streams)
+
+    def discard(self, streams):
+        with self._lock:
+            self.streams.difference_update(streams)
+            self._pending_sub.difference_update(streams)
+            self._pending_unsub.update(streams)
+
+    def resubscribe(self, streams):
+        """UNSUBSCRIBE rồi SUBSCRIBE lại (cùng một lượt flush) cho stream bị im lặng"""
+        with self._lock:
+            streams = set(streams) & self.streams
+            self._pending_unsub.update(streams)
+            self._pending_sub.update(streams)
+
+    def flush(self):
+        """Gửi các thay đổi đang chờ thành một UNSUBSCRIBE và một SUBSCRIBE (mỗi lệnh tối đa max_params stream)"""
+        with self._lock:
+            if not self.connected or not (self._pending_sub or self._pending_unsub):
+                return
+            for method, pending in (('UNSUBSCRIBE', self._pending_unsub), ('SUBSCRIBE', self._pending_sub)):
+                params = sorted(pending)
+                for i in range(0, len(params), self._max_params):
+                    chunk = params[i:i + self._max_params]
+                    self._next_id += 1
+                    try:
+                        self._ws.send(json.dumps({"method": method, "params": chunk, "id": self._next_id}))
+                    except Exception as e:
+                        # Phần chưa gửi vẫn nằm trong hàng chờ: gửi lại ở lượt flush sau hoặc khi on_open
+                        logger.error(f"Lỗi gửi {method} WebSocket #{self.index}: {str(e)}")
+                        return
+                    # Chỉ bỏ khỏi hàng chờ sau khi đã gửi được
+                    pending.difference_update(chunk)
+                    self.control_messages += 1
+
+# Loại stream giá theo symbol: hậu tố stream → cách lấy giá từ sự kiện (khoá theo trường "e")
+_PRICE_STREAM_TYPES = {
+    'trade': '@trade',               # Từng giao dịch – nhiều tin nhất
+    'aggTrade': '@aggTrade',         # Gộp các lần khớp của cùng lệnh taker
+    'bookTicker': '@bookTicker',     # Giá giữa bid/ask tốt nhất
+    'markPrice': '@markPrice@1s',    # Giá đánh dấu, 1 tin/giây
+}
+_PRICE_EVENT_TYPES = {'trade': 'trade', 'aggTrade': 'aggTrade', 'bookTicker': 'bookTicker', 'markPriceUpdate': 'markPrice'}
+
+def _event_price(event):
+    if event['e'] == 'bookTicker':
+        return (float(event['b']) + float(event['a'])) / 2
+    return float(event['p'])
+
+class _LagHistogram:
+    """Histogram độ trễ (ms) theo bucket cố định: thêm mẫu O(1), phân vị xấp xỉ bằng cận trên của bucket"""
+    BOUNDS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        ms = max(ms, 0.0)   # Lệch giờ còn sót sau đồng bộ có thể cho giá trị âm nhỏ
+        self.counts[bisect.bisect_left(self.BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(self.BOUNDS[i], self.max) if i < len(self.BOUNDS) else self.max
+        return self.max
+
+    def summary(self) -> Dict:
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+class _TickSlot:
+    """Ô gộp tick của một symbol: chỉ giữ giá mới nhất, tối đa một lần gọi callback đang chờ/chạy.
+    Kèm số liệu luồng: độ trễ so với giờ sự kiện của sàn (E), thời gian chờ trong executor, lần im lặng."""
+    __slots__ = ('price', 'dirty', 'scheduled', 'received_at', 'last_message', 'messages', 'stalls',
+                 'reconnects', 'downtime', 'lag', 'queue_lag')
+
     def __init__(self):
-        self.connections = {}
+        self.price = 0.0
+        self.dirty = False       # Có giá chưa giao cho callback
+        self.scheduled = False   # Đã có task giao giá trong executor
+        self.received_at = 0.0   # Thời điểm nhận giá đang chờ giao
+        self.last_message = time.time()   # Tin cuối của stream giá chính (tính từ lúc đăng ký)
+        self.messages = 0
+        self.stalls = 0
+        self.reconnects = 0      # Số lần kết nối mang stream của symbol được nối lại
+        self.downtime = 0.0      # Tổng số giây mất kết nối đã kết thúc
+        self.lag = _LagHistogram()         # Giờ nhận (đã đồng bộ với sàn) − E
+        self.queue_lag = _LagHistogram()   # Giờ callback chạy − giờ nhận
+
+class WebSocketManager:
+    """Giá theo symbol cho mọi bot qua một nhóm nhỏ kết nối combined-stream dùng chung.
+    Thêm/bớt symbol = SUBSCRIBE/UNSUBSCRIBE trên kết nối đang mở; stream được cân bằng giữa các kết nối."""
+    _FLUSH_INTERVAL = 0.25      # Sàn giới hạn 10 tin nhắn điều khiển/giây/kết nối → tối đa 2 tin mỗi 0.25s
+    _REBALANCE_INTERVAL = 5
+    _RATE_WINDOW = 5            # Đo tốc độ trên cửa sổ 5s để stream 1 tin/giây không bị lệch pha
+    _RECONNECT_BASE = 1.0       # Backoff kết nối lại: 1s, 2s, 4s... tối đa 60s, nhân hệ số ngẫu nhiên 0.5–1
+    _RECONNECT_MAX = 60.0
+
+    def __init__(self, max_connections=4, streams_per_connection=200, default_stream_type='aggTrade',
+                 stall_after=30):
+        if default_stream_type not in _PRICE_STREAM_TYPES:
+            raise ValueError(f"Loại stream giá không hợp lệ: {default_stream_type}")
+        self.max_connections = max(1, max_connections)
+        self.streams_per_connection = streams_per_connection
+        self.default_stream_type = default_stream_type
+        self.stall_after = stall_after   # Stream giá im lặng quá số giây này → UNSUBSCRIBE + SUBSCRIBE lại
         self.executor = ThreadPoolExecutor(max_workers=20, thread_name_prefix='ws_executor')
         self._lock = threading.RLock()
         self._stop_event = threading.Event()
         self.price_cache = {}
-        self.last_price_update = {}
+        self._callbacks: Dict[str, Callable] = {}
+        self._slots: Dict[str, _TickSlot] = {}
+        self._slot_lock = threading.Lock()
+        self._stream_types: Dict[str, str] = {}                  # symbol -> loại stream giá
+        self._symbol_streams: Dict[str, List[str]] = {}          # symbol -> các stream đã đăng ký
+        self._stream_symbols: Dict[str, str] = {}                # stream -> symbol
+        self._mark_prices: Dict[str, Tuple[float, float]] = {}   # symbol -> (giá đánh dấu, thời điểm nhận)
+        self._type_messages = defaultdict(int)                   # loại stream -> số tin
+        self._type_parse_seconds = defaultdict(float)            # loại stream -> thời gian json.loads + parse
+        self._type_rates: Dict[str, Tuple[float, float]] = {}    # loại stream -> (tin/s, ms CPU parse/s)
+        self._ticks_received = 0
+        self._ticks_conflated = 0
+        self._ticks_delivered = 0
+        self._owners: Dict[str, _CombinedStreamConnection] = {}   # stream -> kết nối đang mang stream đó
+        self._connections: List[_CombinedStreamConnection] = []
+        self._control_thread = None
+        self._rebalanced = 0
+        self._stalls = 0
+        self._message_rate = 0.0
+
+    @staticmethod
+    def _stream_name(symbol, stream_type):
+        return f"{symbol.lower()}{_PRICE_STREAM_TYPES[stream_type]}"
+
+    def add_symbol(self, symbol, callback, stream_type=None, mark_price=False):
+        """Theo dõi giá `symbol` bằng stream `stream_type` (mặc định default_stream_type).
+        callback(price, received_at) – received_at là time.time() lúc nhận tick mang giá đó.
+        mark_price=True: đăng ký thêm markPrice@1s để đọc qua get_mark_price() (TP/SL theo giá đánh dấu)."""
+        if not symbol: return
+        symbol = symbol.upper()
+        stream_type = stream_type or self.default_stream_type
+        if stream_type not in _PRICE_STREAM_TYPES:
+            raise ValueError(f"Loại stream giá không hợp lệ: {stream_type}")
+        with self._lock:
+            if self._stop_event.is_set() or symbol in self._callbacks:
+                return
+            self._callbacks[symbol] = callback
+            self._slots[symbol] = _TickSlot()
+            self._stream_types[symbol] = stream_type
+            streams = [self._stream_name(symbol, stream_type)]
+            if mark_price and stream_type != 'markPrice':
+                streams.append(self._stream_name(symbol, 'markPrice'))
+            self._symbol_streams[symbol] = streams
+            connection = self._pick_connection()
+            connection.add(streams)
+            for stream in streams:
+                self._owners[stream] = connection
+                self._stream_symbols[stream] = symbol
+            if self._control_thread is None:
+                self._control_thread = threading.Thread(target=self._control_loop, daemon=True, name="ws-pool-control")
+                self._control_thread.start()
+        logger.info(f"🔗 WebSocket: {symbol} ({'/'.join(streams)}) → kết nối #{connection.index}")
+
+    def _pick_connection(self) -> _CombinedStreamConnection:
+        """Kết nối ít stream nhất; mở thêm kết nối khi chưa đủ max_connections hoặc mọi kết nối đã đầy"""
+        least = min(self._connections, key=lambda c: len(c.streams), default=None)
+        if least is not None and (not least.streams or len(self._connections) >= self.max_connections) \
+                and len(least.streams) < self.streams_per_connection:
+            return least
+        if least is not None and len(self._connections) >= self.max_connections:
+            logger.warning(f"⚠️ WebSocket: mọi kết nối đã đủ {self.streams_per_connection} stream, mở thêm kết nối")
+        connection = _CombinedStreamConnection(len(self._connections), self._on_data, self._on_connection_state,
+                                               self._stop_event, max_params=self.streams_per_connection)
+        self._connections.append(connection)
+        connection.start()
+        return connection
 
-    def add_symbol(self, symbol, callback):
+    def remove_symbol(self, symbol):
         if not symbol: return
         symbol = symbol.upper()
         with self._lock:
-            if symbol not in self.connections:
-                self._create_connection(symbol, callback)
+            if self._callbacks.pop(symbol, None) is None:
+                return
+            for stream in self._symbol_streams.pop(symbol, []):
+                self._stream_symbols.pop(stream, None)
+                connection = self._owners.pop(stream, None)
+                if connection is not None:
+                    connection.discard({stream})
+            self._slots.pop(symbol, None)
+            self._stream_types.pop(symbol, None)
+            self._mark_prices.pop(symbol, None)
+            self.price_cache.pop(symbol, None)
+        logger.info(f"WebSocket đã xóa cho {symbol}")
+
+    def get_mark_price(self, symbol, max_age=5.0) -> float:
+        """Giá đánh dấu từ stream markPrice của symbol (0 nếu chưa có hoặc cũ hơn max_age giây)"""
+        price, received = self._mark_prices.get(symbol.upper(), (0.0, 0.0))
+        return price if time.time() - received <= max_age else 0.0
+
+    def _on_data(self, data, started):
+        """Ghi đè giá mới nhất vào ô của symbol; chỉ submit khi symbol chưa có task giao giá"""
+        symbol = data['s']
+        stream_type = _PRICE_EVENT_TYPES.get(data.get('e'))
+        if stream_type is None:
+            return
+        price = _event_price(data)
+        parse_seconds = time.perf_counter() - started
+        lag_ms = _TIME_SYNC.now_ms() - data['E'] if 'E' in data else None
+        now = time.time()
+        slot = self._slots.get(symbol)
+        with self._slot_lock:
+            self._type_messages[stream_type] += 1
+            self._type_parse_seconds[stream_type] += parse_seconds
+            if slot is not None and lag_ms is not None:
+                slot.lag.add(lag_ms)
+        if slot is None:
+            return
+        if stream_type == 'markPrice':
+            self._mark_prices[symbol] = (price, now)
+        if stream_type != self._stream_types.get(symbol):
+            return   # markPrice đăng ký thêm cho TP/SL: chỉ lưu, không gọi callback
+        self.price_cache[symbol] = price
+        with self._slot_lock:
+            slot.last_message = now
+            slot.messages += 1
+            slot.received_at = now
+            self._ticks_received += 1
+            if slot.dirty:
+                self._ticks_conflated += 1   # Giá cũ chưa kịp giao bị thay bằng giá mới
+            slot.price = price
+            slot.dirty = True
+            if slot.scheduled:
+                return
+            slot.scheduled = True
+        self.executor.submit(self._deliver, symbol, slot)
+
+    def _deliver(self, symbol, slot):
+        """Giao giá mới nhất cho callback cho tới khi ô hết giá chưa giao (callback của một symbol không chạy song song)"""
+        while True:
+            with self._slot_lock:
+                callback = self._callbacks.get(symbol)
+                if not slot.dirty or callback is None or self._slots.get(symbol) is not slot:
+                    slot.scheduled = False
+                    return
+                price, received_at = slot.price, slot.received_at
+                slot.dirty = False
+                slot.queue_lag.add((time.time() - received_at) * 1000)
+                self._ticks_delivered += 1
+            try:
+                callback(price, received_at)
+            except Exception as e:
+                logger.error(f"Lỗi callback giá {symbol}: {str(e)}")
+
+    def _control_loop(self):
+        """Gom thay đổi đăng ký theo lô, cân bằng lại stream và đo tốc độ tin nhắn"""
+        last_rebalance = last_rate = time.time()
+        last_messages = 0
+        last_by_type: Dict[str, Tuple[int, float]] = {}
+        while not self._stop_event.wait(self._FLUSH_INTERVAL):
+            now = time.time()
+            if now - last_rebalance >= self._REBALANCE_INTERVAL:
+                self._rebalance()
+                last_rebalance = now
+            self._supervise(now)
+            self._check_stalls(now)
+            for connection in list(self._connections):
+                connection.flush()
+            if now - last_rate >= self._RATE_WINDOW:
+                messages = sum(c.messages for c in self._connections)
+                elapsed = now - last_rate
+                self._message_rate = (messages - last_messages) / elapsed
+                with self._slot_lock:
+                    by_type = {t: (self._type_messages[t], self._type_parse_seconds[t]) for t in self._type_messages}
+                self._type_rates = {
+                    t: ((count - last_by_type.get(t, (0, 0.0))[0]) / elapsed,
+                        (seconds - last_by_type.get(t, (0, 0.0))[1]) * 1000 / elapsed)
+                    for t, (count, seconds) in by_type.items()}
+                last_messages, last_rate, last_by_type = messages, now, by_type
+
+    def _on_connection_state(self, connection, connected):
+        """Gọi từ thread của kết nối: chỉ ghi nhận trạng thái, không sleep/không tạo thread"""
+        now = time.time()
+        with self._lock:
+            if not connected:
+                if not connection.disconnected_at:
+                    connection.disconnected_at = now
+                connection.attempts += 1
+                delay = min(self._RECONNECT_MAX, self._RECONNECT_BASE * 2 ** (connection.attempts - 1))
+                connection.reconnect_at = now + delay * random.uniform(0.5, 1.0)
+                logger.info(f"🔗 WebSocket #{connection.index} mất kết nối ({len(connection.streams)} stream), "
+                            f"kết nối lại sau {connection.reconnect_at - now:.1f}s")
+                return
+            connection.attempts = 0
+            if not connection.disconnected_at:
+                return   # Lần kết nối đầu tiên
+            downtime = now - connection.disconnected_at
+            connection.disconnected_at = 0.0
+            connection.downtime += downtime
+            symbols = {self._stream_symbols[s] for s in connection.streams if s in self._stream_symbols}
+            for symbol in symbols:
+                slot = self._slots.get(symbol)
+                if slot is not None:
+                    slot.reconnects += 1
+                    slot.downtime += downtime
+                    slot.last_message = now   # Không tính thời gian mất kết nối vào phát hiện im lặng
+        logger.info(f"🔗 WebSocket #{connection.index} đã kết nối lại sau {downtime:.1f}s, "
+                    f"đăng ký lại {len(connection.streams)} stream")
+
+    def _supervise(self, now):
+        """Supervisor: khởi động lại các kết nối đã đến hẹn (so le nhờ jitter, không dồn cùng lúc)"""
+        with self._lock:
+            due = [c for c in self._connections if c.reconnect_at and now >= c.reconnect_at]
+            for connection in due:
+                connection.reconnect_at = 0.0
+                connection.reconnects += 1
+        for connection in due:
+            connection.start()
+
+    def _check_stalls(self, now):
+        """Stream giá im lặng quá stall_after giây trên kết nối vẫn sống → đăng ký lại stream đó"""
+        if not self.stall_after:
+            return
+        with self._lock:
+            stalled = []
+            for symbol, slot in self._slots.items():
+                if now - slot.last_message < self.stall_after:
+                    continue
+                stream = self._symbol_streams[symbol][0]
+                connection = self._owners.get(stream)
+                if connection is None or not connection.connected:
+                    continue   # Kết nối đang rớt: on_open sẽ đăng ký lại toàn bộ
+                connection.resubscribe({stream})
+                slot.last_message = now   # Cho stream thêm một chu kỳ stall_after sau khi đăng ký lại
+                slot.stalls += 1
+                self._stalls += 1
+                stalled.append(symbol)
+        if stalled:
+            logger.warning(f"⚠️ WebSocket: {', '.join(stalled)} im lặng >{self.stall_after}s, đã đăng ký lại stream")
+
+    def _rebalance(self):
+        """Chuyển stream từ kết nối nặng nhất sang nhẹ nhất khi chênh lệch từ 2 stream trở lên.
+        Đăng ký bên mới và huỷ bên cũ trong cùng lượt gửi; dữ liệu trùng trong lúc chuyển vô hại."""
+        with self._lock:
+            live = [c for c in self._connections if c.connected]
+            if len(live) < 2:
+                return
+            heavy = max(live, key=lambda c: len(c.streams))
+            light = min(live, key=lambda c: len(c.streams))
+            count = (len(heavy.streams) - len(light.streams)) // 2
+            if count <= 0:
+                return
+            moved = set(sorted(heavy.streams)[:count])
+            light.add(moved)
+            heavy.discard(moved)
+            for stream in moved:
+                self._owners[stream] = light
+            self._rebalanced += len(moved)
+        logger.info(f"⚖️ WebSocket: chuyển {len(moved)} stream từ kết nối #{heavy.index} sang #{light.index}")
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            connections = list(self._connections)
+            return {
+                'connections': len(connections),
+                'connected': sum(1 for c in connections if c.connected),
+                'streams': len(self._owners),
+                'streams_per_connection': [len(c.streams) for c in connections],
+                'messages': sum(c.messages for c in connections),
+                'messages_per_sec': self._message_rate,
+                'control_messages': sum(c.control_messages for c in connections),
+                'reconnects': sum(c.reconnects for c in connections),
+                'reconnect_pending': sum(1 for c in connections if c.reconnect_at),
+                'downtime_s': sum(c.downtime + (time.time() - c.disconnected_at if c.disconnected_at else 0.0)
+                                  for c in connections),
+                'rebalanced': self._rebalanced,
+                'ticks_received': self._ticks_received,
+                'ticks_conflated': self._ticks_conflated,
+                'ticks_delivered': self._ticks_delivered,
+                'stalls': self._stalls,
+                'lag_ms': self._merged_lag('lag').summary(),
+                'queue_lag_ms': self._merged_lag('queue_lag').summary(),
+                'by_stream_type': {
+                    t: {'symbols': sum(1 for s in self._stream_types.values() if s == t),
+                        'messages': self._type_messages[t],
+                        'messages_per_sec': self._type_rates.get(t, (0.0, 0.0))[0],
+                        'parse_ms_per_sec': self._type_rates.get(t, (0.0, 0.0))[1],
+                        'parse_us_per_message': self._type_parse_seconds[t] * 1e6 / self._type_messages[t]
+                        if self._type_messages[t] else 0.0}
+                    for t in sorted(set(self._type_messages) | set(self._stream_types.values()))},
+            }
+
+    def _merged_lag(self, field) -> _LagHistogram:
+        merged = _LagHistogram()
+        with self._slot_lock:
+            for slot in self._slots.values():
+                merged.merge(getattr(slot, field))
+        return merged
+
+    def get_symbol_stats(self, symbol=None) -> Dict[str, Dict]:
+        """Số liệu luồng theo symbol: loại stream, số tin, tuổi tin cuối, độ trễ (ms), số lần im lặng"""
+        now = time.time()
+        with self._lock:
+            slots = {s: slot for s, slot in self._slots.items() if symbol is None or s == symbol.upper()}
+            stream_types = dict(self._stream_types)
+            # Mất kết nối đang diễn ra cũng tính vào downtime của symbol
+            ongoing = {}
+            for s in slots:
+                connection = self._owners.get(self._symbol_streams[s][0])
+                ongoing[s] = now - connection.disconnected_at if connection and connection.disconnected_at else 0.0
+        with self._slot_lock:
+            return {
+                s: {
+                    'stream_type': stream_types.get(s),
+                    'messages': slot.messages,
+                    'last_message_age': now - slot.last_message,
+                    'lag_ms': slot.lag.summary(),
+                    'queue_lag_ms': slot.queue_lag.summary(),
+                    'stalls': slot.stalls,
+                    'reconnects': slot.reconnects,
+                    'downtime_s': slot.downtime + ongoing[s],
+                }
+                for s, slot in slots.items()
+            }
+
+    def stop(self):
+        self._stop_event.set()
+        with self._lock:
+            self._callbacks.clear()
+            self._slots.clear()
+            self._owners.clear()
+            connections = list(self._connections)
+        for connection in connections:
+            connection.close()
+        self.executor.shutdown(wait=False)
 
-    def _create_connection(self, symbol, callback):
-        if self._stop_event.is_set(): return
-        streams = [f"{symbol.lower()}@trade"]
-        url = f"wss://fstream.binance.com/stream?streams={'/'.join(streams)}"
+# ========== LUỒNG DỮ LIỆU TOÀN THỊ TRƯỜNG ==========
+_MARKET_STREAMS = {
+    'markPrice': '!markPrice@arr@1s',   # Giá đánh dấu mọi symbol, mỗi giây
+    'miniTicker': '!miniTicker@arr',    # Giá đóng + volume 24h của symbol có thay đổi
+}
+
+class MarketDataStream:
+    """Nuôi cột giá/volume của CoinCache bằng WebSocket toàn thị trường, fallback REST khi luồng im lặng"""
+    def __init__(self, coin_cache: CoinCache, streams=('markPrice', 'miniTicker'), stale_after=10):
+        self._cache = coin_cache
+        self.streams = [name for name in streams if name in _MARKET_STREAMS]
+        self.stale_after = stale_after
+        self._stop_event = threading.Event()
+        self._lock = threading.RLock()
+        self._ws = None
+        self._threads: List[threading.Thread] = []
+        self._connected = False
+        self._last_message = 0.0
+        self._messages = 0
+        self._symbol_updates = 0
+        self._reconnects = 0
+        self._fallbacks = 0
+        self._parse_errors = 0
+
+    def start(self):
+        if not self.streams:
+            return False
+        for target, name in ((self._run, 'market_stream'), (self._fallback_loop, 'market_fallback')):
+            thread = threading.Thread(target=target, daemon=True, name=name)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"📡 Luồng thị trường đã khởi động: {', '.join(self.streams)}")
+        return True
 
-        def on_message(ws, message):
+    def stop(self):
+        self._stop_event.set()
+        ws = self._ws
+        if ws:
             try:
-                data = json.loads(message)
-                if 'data' in data:
-                    symbol = data['data']['s']
-                    price = float(data['data']['p'])
-                    current_time = time.time()
-                    if (symbol in self.last_price_update and
-                        current_time - self.last_price_update[symbol] < 0.1):
-                        return
-                    self.last_price_update[symbol] = current_time
-                    self.price_cache[symbol] = price
-                    self.executor.submit(callback, price)
-            except Exception as e:
-                logger.error(f"Lỗi tin nhắn WebSocket {symbol}: {str(e)}")
+                ws.close()
+            except Exception:
+                pass
 
-        def on_error(ws, error):
-            logger.error(f"Lỗi WebSocket {symbol}: {str(error)}")
-            if not self._stop_event.is_set():
-                time.sleep(5)
-                self._reconnect(symbol, callback)
+    def is_fresh(self) -> bool:
+        return self._connected and time.time() - self._last_message < self.stale_after
 
-        def on_close(ws, close_status_code, close_msg):
-            logger.info(f"WebSocket đã đóng {symbol}: {close_status_code} - {close_msg}")
-            if not self._stop_event.is_set() and symbol in self.connections:
-                time.sleep(5)
-                self._reconnect(symbol, callback)
+    def _run(self):
+        url = f"{_BINANCE_WS_BASE}/stream?streams={'/'.join(_MARKET_STREAMS[name] for name in self.streams)}"
+        while not self._stop_event.is_set():
+            self._ws = websocket.WebSocketApp(
+                url, on_open=self._on_open, on_message=self._on_message,
+                on_error=lambda ws, error: logger.error(f"Lỗi luồng thị trường: {str(error)}"),
+                on_close=self._on_close)
+            self._ws.run_forever(ping_interval=60, ping_timeout=20)
+            self._connected = False
+            if self._stop_event.wait(5):
+                break
+            with self._lock:
+                self._reconnects += 1
+            logger.info("📡 Đang kết nối lại luồng thị trường...")
 
-        ws = websocket.WebSocketApp(url, on_message=on_message, on_error=on_error, on_close=on_close)
-        thread = threading.Thread(target=ws.run_forever, daemon=True, name=f"ws-{symbol}")
-        thread.start()
-        self.connections[symbol] = {'ws': ws, 'thread': thread, 'callback': callback}
-        logger.info(f"🔗 WebSocket đã khởi động cho {symbol}")
+    def _on_open(self, ws):
+        self._connected = True
 
-    def _reconnect(self, symbol, callback):
-        logger.info(f"Đang kết nối lại WebSocket cho {symbol}")
-        self.remove_symbol(symbol)
-        self._create_connection(symbol, callback)
+    def _on_close(self, ws, close_status_code, close_msg):
+        self._connected = False
+        logger.info(f"📡 Luồng thị trường đã đóng: {close_status_code} - {close_msg}")
 
-    def remove_symbol(self, symbol):
-        if not symbol: return
-        symbol = symbol.upper()
+    def _on_message(self, ws, message):
+        try:
+            payload = json.loads(message)
+            events = payload.get('data', payload) if isinstance(payload, dict) else payload
+            if not isinstance(events, list):
+                return
+            prices = {}
+            volumes = {}
+            for event in events:
+                kind = event.get('e')
+                if kind == 'markPriceUpdate':
+                    prices[event['s']] = float(event['p'])
+                elif kind == '24hrMiniTicker':
+                    volumes[event['s']] = float(event['v'])
+                    if 'markPrice' not in self.streams:
+                        prices[event['s']] = float(event['c'])
+            counts = self._cache.update_market_data(prices, volumes)
+            with self._lock:
+                self._messages += 1
+                self._symbol_updates += counts['price'] + counts['volume']
+                self._last_message = time.time()
+        except Exception as e:
+            with self._lock:
+                self._parse_errors += 1
+            logger.error(f"Lỗi xử lý luồng thị trường: {str(e)}")
+
+    def _fallback_loop(self):
+        """Luồng im lặng quá stale_after giây → lấy giá qua REST (trọng số 2) mỗi stale_after giây
+        cho tới khi luồng có dữ liệu trở lại, để cache không bị cũ trong lúc mất luồng"""
+        while not self._stop_event.wait(self.stale_after):
+            if self.is_fresh():
+                continue
+            with self._lock:
+                self._fallbacks += 1
+            logger.warning("⚠️ Luồng thị trường không có dữ liệu mới, cập nhật giá qua REST")
+            update_coins_price()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'streams': list(self.streams),
+                'connected': self._connected,
+                'fresh': self.is_fresh(),
+                'last_message_age': time.time() - self._last_message if self._last_message else None,
+                'messages': self._messages,
+                'symbol_updates': self._symbol_updates,
+                'reconnects': self._reconnects,
+                'fallbacks': self._fallbacks,
+                'parse_errors': self._parse_errors,
+            }
+
+# ========== LUỒNG USER-DATA (listenKey) ==========
+class UserDataStream:
+    """Nhận ACCOUNT_UPDATE / ORDER_TRADE_UPDATE qua listenKey và áp dụng thẳng vào PositionCache.
+    Mất kết nối hoặc listenKey hết hạn = có thể đã lỡ sự kiện → đồng bộ lại qua REST."""
+    _KEEPALIVE_INTERVAL = 30 * 60   # listenKey hết hạn sau 60 phút nếu không gia hạn
+
+    def __init__(self, api_key, position_cache: PositionCache, account_cache: AccountCache):
+        self.api_key = api_key
+        self._positions = position_cache
+        self._accounts = account_cache
+        self._stop_event = threading.Event()
+        self._lock = threading.RLock()
+        self._listen_key = None
+        self._ws = None
+        self._connected = False
+        self._listeners: Dict[str, List[Callable]] = defaultdict(list)
+        self._latencies = deque(maxlen=500)
+        self._events = defaultdict(int)
+        self._resyncs = 0
+        self._resync_running = False
+        self._reconnects = 0
+        self._keepalive_failures = 0
+        self._last_event = 0.0
+
+    def add_listener(self, event_type, callback):
+        """callback(event) được gọi trên thread WebSocket cho mỗi sự kiện `event_type`"""
+        with self._lock:
+            self._listeners[event_type].append(callback)
+
+    def is_healthy(self) -> bool:
+        return self._connected and self._listen_key is not None
+
+    def start(self):
+        for target, name in ((self._run, 'user_stream'), (self._keepalive_loop, 'user_stream_keepalive')):
+            threading.Thread(target=target, daemon=True, name=name).start()
+
+    def stop(self):
+        self._stop_event.set()
+        ws = self._ws
+        if ws:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        if self._listen_key:
+            self._listen_key_request('DELETE')
+
+    def _listen_key_request(self, method):
+        url = f"{_BINANCE_REST_BASE}/fapi/v1/listenKey"
+        return binance_api_request(url, method=method, headers={'X-MBX-APIKEY': self.api_key},
+                                   priority=PRIORITY_ACCOUNT)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            if not self._listen_key:
+                data = self._listen_key_request('POST')
+                self._listen_key = data.get('listenKey') if data else None
+                if not self._listen_key:
+                    logger.error("❌ Không tạo được listenKey cho luồng user-data")
+                    self._stop_event.wait(10)
+                    continue
+            self._ws = websocket.WebSocketApp(
+                f"{_BINANCE_WS_BASE}/ws/{self._listen_key}",
+                on_open=self._on_open, on_message=self._on_message,
+                on_error=lambda ws, error: logger.error(f"Lỗi luồng user-data: {str(error)}"),
+                on_close=self._on_close)
+            self._ws.run_forever(ping_interval=60, ping_timeout=20)
+            self._connected = False
+            if self._stop_event.wait(2):
+                break
+            with self._lock:
+                self._reconnects += 1
+            logger.info("👤 Đang kết nối lại luồng user-data...")
+
+    def _on_open(self, ws):
+        self._connected = True
+        # Sự kiện trong lúc chưa kết nối đã mất – lấy lại trạng thái đầy đủ qua REST ở thread riêng,
+        # không chặn thread WebSocket (sự kiện mới hơn request REST vẫn được giữ, xem PositionCache.refresh)
+        with self._lock:
+            if self._resync_running:
+                return
+            self._resync_running = True
+        threading.Thread(target=self._resync, args=("kết nối luồng user-data",), daemon=True,
+                         name='user_stream_resync').start()
+
+    def _on_close(self, ws, close_status_code, close_msg):
+        self._connected = False
+        logger.info(f"👤 Luồng user-data đã đóng: {close_status_code} - {close_msg}")
+
+    def _resync(self, reason):
         with self._lock:
-            if symbol in self.connections:
+            self._resyncs += 1
+        logger.info(f"🔄 Đồng bộ lại vị thế qua REST ({reason})")
+        try:
+            self._accounts.invalidate(self.api_key)
+            self._positions.refresh(force=True)
+        finally:
+            with self._lock:
+                self._resync_running = False
+
+    def _keepalive_loop(self):
+        while not self._stop_event.wait(self._KEEPALIVE_INTERVAL):
+            if not self._listen_key:
+                continue
+            if self._listen_key_request('PUT') is None:
+                with self._lock:
+                    self._keepalive_failures += 1
+                logger.warning("⚠️ Gia hạn listenKey thất bại, tạo listenKey mới")
+                self._renew_listen_key()
+
+    def _renew_listen_key(self):
+        self._listen_key = None
+        ws = self._ws
+        if ws:
+            ws.close()   # Vòng _run tạo listenKey mới, on_open sẽ đồng bộ lại
+
+    def _on_message(self, ws, message):
+        try:
+            event = json.loads(message)
+            event_type = event.get('e')
+            if event_type == 'ACCOUNT_UPDATE':
+                self._positions.apply_account_update(event.get('a', {}).get('P', []), event.get('E', 0))
+                self._accounts.invalidate(self.api_key)
+            elif event_type == 'ORDER_TRADE_UPDATE':
+                if event.get('o', {}).get('x') == 'TRADE':
+                    self._accounts.invalidate(self.api_key)
+            elif event_type == 'listenKeyExpired':
+                logger.warning("⚠️ listenKey đã hết hạn, tạo listenKey mới")
+                self._renew_listen_key()
+            with self._lock:
+                self._events[event_type] += 1
+                self._last_event = time.time()
+                if 'E' in event:
+                    self._latencies.append(_TIME_SYNC.now_ms() - event['E'])
+                listeners = list(self._listeners.get(event_type, ()))
+            for callback in listeners:
                 try:
-                    self.connections[symbol]['ws'].close()
+                    callback(event)
                 except Exception as e:
-                    logger.error(f"Lỗi đóng WebSocket {symbol}: {str(e)}")
-                self.connections[symbol]['callback'] = None
-                del self.connections[symbol]
-                logger.info(f"WebSocket đã xóa cho {symbol}")
+                    logger.error(f"Lỗi xử lý sự kiện {event_type}: {str(e)}")
+        except Exception as e:
+            logger.error(f"Lỗi tin nhắn luồng user-data: {str(e)}")
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            latencies = list(self._latencies)
+            return {
+                'connected': self._connected,
+                'healthy': self.is_healthy(),
+                'events': dict(self._events),
+                'avg_latency_ms': sum(latencies) / len(latencies) if latencies else None,
+                'max_latency_ms': max(latencies) if latencies else None,
+                'last_event_age': time.time() - self._last_event if self._last_event else None,
+                'resyncs': self._resyncs,
+                'reconnects': self._reconnects,
+                'keepalive_failures': self._keepalive_failures,
+            }
+
+# ========== LỊCH LÀM MỚI CACHE THEO TTL ==========
+class CacheRefreshScheduler:
+    """Làm mới từng tập dữ liệu (exchangeInfo, giá, volume) theo TTL riêng, có jitter, trong một thread nền"""
+    def __init__(self):
+        self._jobs: Dict[str, Dict] = {}
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def register(self, name, fn, ttl, jitter=0.1, retry_after=30):
+        """fn() trả False khi thất bại; lần chạy đầu sau một TTL (dữ liệu vừa được nạp lúc khởi động)"""
+        with self._lock:
+            self._jobs[name] = {
+                'fn': fn,
+                'ttl': ttl,
+                'jitter': jitter,
+                'retry_after': retry_after,
+                'next_due': time.time() + self._jittered(ttl, jitter),
+                'last_success': time.time(),
+                'last_duration': 0.0,
+                'total_duration': 0.0,
+                'max_duration': 0.0,
+                'runs': 0,
+                'failures': 0,
+            }
+        self._wakeup.set()
+
+    @staticmethod
+    def _jittered(ttl, jitter):
+        return ttl * (1 + random.uniform(-jitter, jitter))
+
+    def trigger(self, name=None):
+        """Chạy ngay một (hoặc tất cả) tập dữ liệu ở vòng kế tiếp"""
+        with self._lock:
+            for job_name, job in self._jobs.items():
+                if name is None or job_name == name:
+                    job['next_due'] = 0
+        self._wakeup.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name='cache_refresh')
+        self._thread.start()
 
     def stop(self):
         self._stop_event.set()
-        for symbol in list(self.connections.keys()):
-            self.remove_symbol(symbol)
-        self.executor.shutdown(wait=False)
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wakeup.clear()
+            with self._lock:
+                due = min(self._jobs.items(), key=lambda item: item[1]['next_due']) if self._jobs else None
+            delay = due[1]['next_due'] - time.time() if due else 60
+            if delay > 0:
+                self._wakeup.wait(delay)
+                continue
+            self._run_job(*due)
+
+    def _run_job(self, name, job):
+        started = time.time()
+        try:
+            ok = job['fn']() is not False
+        except Exception as e:
+            logger.error(f"❌ Lỗi làm mới {name}: {str(e)}")
+            ok = False
+        finished = time.time()
+        duration = finished - started
+        with self._lock:
+            job['runs'] += 1
+            job['last_duration'] = duration
+            job['total_duration'] += duration
+            job['max_duration'] = max(job['max_duration'], duration)
+            if ok:
+                job['last_success'] = finished
+                job['next_due'] = finished + self._jittered(job['ttl'], job['jitter'])
+            else:
+                job['failures'] += 1
+                job['next_due'] = finished + min(job['retry_after'], job['ttl'])
+
+    def get_stats(self) -> Dict:
+        now = time.time()
+        with self._lock:
+            return {
+                name: {
+                    'ttl': job['ttl'],
+                    'staleness': now - job['last_success'],
+                    'next_in': max(0.0, job['next_due'] - now),
+                    'last_duration_ms': job['last_duration'] * 1000,
+                    'avg_duration_ms': job['total_duration'] / job['runs'] * 1000 if job['runs'] else 0.0,
+                    'max_duration_ms': job['max_duration'] * 1000,
+                    'runs': job['runs'],
+                    'failures': job['failures'],
+                }
+                for name, job in self._jobs.items()
+            }
 
 # ========== LỚP BOT CỐT LÕI ==========
 class BaseBot:
@@ -1337,6 +3657,18 @@ class BaseBot:
             sell_price_threshold=self.balance_config['sell_price_threshold']
         )
 
+        # Nguồn giá: loại stream theo symbol (None = mặc định của WebSocketManager) và giá dùng cho TP/SL
+        self.price_stream = kwargs.get('price_stream')
+        self.tp_sl_price = kwargs.get('tp_sl_price') or os.getenv('BINANCE_TP_SL_PRICE', 'last')
+
+        # Kiểm tra thoát lệnh: 'tick' = ngay trên mỗi tick giá (vòng lặp 1s vẫn chạy dự phòng), 'loop' = chỉ vòng lặp
+        self.exit_mode = kwargs.get('exit_mode') or os.getenv('BINANCE_EXIT_MODE', 'tick')
+        self.exit_debounce = 2.0          # Giây chờ trước khi cho phép thử đóng lại cùng symbol
+        self.close_attempts = 3           # Số lệnh MARKET tối đa cho một lần đóng (lệnh trước khớp một phần)
+        self._exit_lock = threading.Lock()
+        self.exit_stats = {'tick': 0, 'loop': 0, 'debounced': 0}
+        self.exit_latencies = deque(maxlen=200)   # ms từ lúc nhận tick tới lúc ra quyết định đóng
+
         if symbol and not self.coin_finder.has_existing_position(symbol):
             self._add_symbol(symbol)
 
@@ -1439,6 +3771,9 @@ class BaseBot:
                 symbol_info['last_position_check'] = current_time
 
             if symbol_info['position_open']:
+                # Lệnh đóng đang chạy trên luồng tick → không kiểm tra/nhồi lệnh song song
+                if symbol_info.get('exit_pending'):
+                    return False
                 if self._check_smart_exit_condition(symbol):
                     return False
                 self._check_symbol_tp_sl(symbol)
@@ -1484,40 +3819,143 @@ class BaseBot:
             'last_pyramiding_time': 0,
             'pyramiding_base_roi': 0.0,
             'high_water_mark_roi': 0,
+            'hwm_price': 0,                    # Giá tốt nhất đã thấy (mốc của high-water mark)
             'roi_check_activated': False
         }
-        self.ws_manager.add_symbol(symbol, lambda p, s=symbol: self._handle_price_update(s, p))
+        self.ws_manager.add_symbol(symbol, lambda p, ts=None, s=symbol: self._handle_price_update(s, p, ts),
+                                   stream_type=self.price_stream, mark_price=self.tp_sl_price == 'mark')
         self.coin_manager.register_coin(symbol)
         self.log(f"➕ Đã thêm {symbol} vào theo dõi")
 
-    def _handle_price_update(self, symbol, price):
-        if symbol not in self.symbol_data:
+    def _handle_price_update(self, symbol, price, received_at=None):
+        data = self.symbol_data.get(symbol)
+        if data is None:
+            return
+        data['last_price'] = price
+        data['last_price_time'] = time.time()
+        # Chế độ tick: đánh giá thoát lệnh ngay trên giá vừa nhận (callback của một symbol không chạy song song)
+        if (self.exit_mode == 'tick' and data['position_open'] and not data.get('exit_pending')
+                and data['entry'] > 0 and data['qty'] != 0):
+            if self._check_smart_exit_condition(symbol, price, received_at):
+                return
+            self._check_symbol_tp_sl(symbol, price, received_at)
+
+    def _exit_ladder(self, data):
+        """Thang giá thoát lệnh tính sẵn cho vị thế: TP/SL (theo entry), kích hoạt chốt lời sớm và mức nhồi lệnh
+        kế tiếp (theo entry_base). Chỉ tính lại khi mở lệnh, nhồi lệnh hoặc cấu hình thay đổi.
+        Ngưỡng ROI r% ↔ giá = entry×(1 + r/(100×lev)) với BUY, entry×(1 − r/(100×lev)) với SELL."""
+        key = (data['entry'], data['entry_base'], data['side'], self.lev, self.tp, self.sl, self.roi_trigger,
+               data['pyramiding_count'], data['next_pyramiding_roi'])
+        cached = data.get('exit_ladder')
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        entry, base, side = data['entry'], data['entry_base'], data['side']
+        if entry <= 0 or self.lev <= 0 or side not in ('BUY', 'SELL'):
+            return None
+        sign = 1 if side == 'BUY' else -1
+        step = sign / (100 * self.lev)
+        can_pyramid = self.pyramiding_enabled and base > 0 and data['pyramiding_count'] < self.pyramiding_n
+        ladder = {
+            'buy': side == 'BUY',
+            'step': step,
+            'tp': entry * (1 + self.tp * step) if self.tp else None,
+            'sl': entry * (1 - self.sl * step) if self.sl else None,
+            'roi_trigger': base * (1 + self.roi_trigger * step) if self.roi_trigger and base > 0 else None,
+            'pyramid': base * (1 + data['next_pyramiding_roi'] * step) if can_pyramid else None,
+        }
+        data['exit_ladder'] = (key, ladder)
+        data['trail_price'] = self._trail_price(data, ladder)
+        return ladder
+
+    def _trail_price(self, data, ladder):
+        """Giá thoát thông minh: ROI (theo entry_base) rơi xuống dưới 90% high-water mark"""
+        base = data['entry_base']
+        if not self.roi_trigger or base <= 0:
+            return None
+        return base * (1 + 0.9 * data['high_water_mark_roi'] * ladder['step'])
+
+    def _update_high_water(self, data, ladder, price):
+        """Cập nhật high-water mark khi giá vượt mốc tốt nhất; chỉ khi đó mới tính lại ROI và giá thoát thông minh"""
+        hwm_price = data.get('hwm_price', 0)
+        if hwm_price and (price <= hwm_price if ladder['buy'] else price >= hwm_price):
             return
-        self.symbol_data[symbol]['last_price'] = price
-        self.symbol_data[symbol]['last_price_time'] = time.time()
+        data['hwm_price'] = price
+        entry = data['entry']
+        roi = (price - entry) / entry * 100 * self.lev * (1 if ladder['buy'] else -1)
+        if roi > data['high_water_mark_roi']:
+            data['high_water_mark_roi'] = roi
+            data['trail_price'] = self._trail_price(data, ladder)
+
+    def _roi(self, entry, price, side):
+        if entry <= 0:
+            return 0.0
+        roi = (price - entry) / entry * 100 * self.lev
+        return roi if side == 'BUY' else -roi
+
+    def _fire_exit(self, symbol, reason, received_at=None, message=None):
+        """Đóng vị thế một lần duy nhất cho mỗi lần chạm ngưỡng (chặn trùng giữa tick và vòng lặp)"""
+        data = self.symbol_data.get(symbol)
+        if data is None:
+            return False
+        now = time.time()
+        with self._exit_lock:
+            if data.get('exit_pending') or now - data.get('exit_attempt_time', 0) < self.exit_debounce:
+                self.exit_stats['debounced'] += 1
+                return False
+            data['exit_pending'] = True
+            data['exit_attempt_time'] = now
+            self.exit_stats['tick' if received_at else 'loop'] += 1
+            if received_at:
+                self.exit_latencies.append((now - received_at) * 1000)
+        if message:
+            self.log(message)
+        try:
+            return self._close_symbol_position(symbol, reason=reason)
+        finally:
+            data['exit_pending'] = False
+
+    def get_exit_stats(self) -> Dict:
+        with self._exit_lock:
+            latencies = sorted(self.exit_latencies)
+            return {
+                **self.exit_stats,
+                'mode': self.exit_mode,
+                'latency_ms_p50': latencies[len(latencies) // 2] if latencies else None,
+                'latency_ms_max': latencies[-1] if latencies else None,
+            }
 
     def get_current_price(self, symbol):
         if symbol in self.symbol_data and self.symbol_data[symbol]['last_price'] > 0:
             return self.symbol_data[symbol]['last_price']
         return get_current_price(symbol)
 
+    def _get_tp_sl_price(self, symbol):
+        """Giá so TP/SL: giá đánh dấu (markPrice@1s) nếu tp_sl_price='mark' và còn mới, ngược lại giá giao dịch"""
+        if self.tp_sl_price == 'mark':
+            mark = self.ws_manager.get_mark_price(symbol, max_age=5)
+            if mark > 0:
+                return mark
+        return self.get_current_price(symbol)
+
     def _get_fresh_price(self, symbol):
-        """Lấy giá mới nhất, ưu tiên từ WebSocket nếu cập nhật trong vòng 5 giây, nếu không thì gọi API."""
+        """Lấy giá mới nhất: WebSocket của symbol → luồng toàn thị trường (trong vòng 5 giây) → gọi API."""
         data = self.symbol_data.get(symbol)
         if data and time.time() - data.get('last_price_time', 0) < 5:
             return data['last_price']
-        # Gọi API
-        price = get_current_price(symbol)
+        price = _COINS_CACHE.get_price(symbol, max_age=5)
+        if price <= 0:
+            # Gọi API
+            price = get_current_price(symbol)
         if price > 0 and data:
             data['last_price'] = price
             data['last_price_time'] = time.time()
         return price
 
     # ---------- Kiểm tra vị thế (dùng cache và fallback API) ----------
-    def _force_check_position(self, symbol):
+    def _force_check_position(self, symbol, priority=PRIORITY_ACCOUNT):
         """Gọi API trực tiếp để kiểm tra vị thế của một symbol, trả về dict nếu có, None nếu không."""
         try:
-            positions = get_positions(symbol, self.api_key, self.api_secret)
+            positions = get_positions(symbol, self.api_key, self.api_secret, priority=priority)
             if positions and len(positions) > 0:
                 pos = positions[0]
                 amt = float(pos.get('positionAmt', 0))
@@ -1533,11 +3971,11 @@ class BaseBot:
             has_pos = _POSITION_CACHE.has_position(symbol)
             if has_pos:
                 if not self.symbol_data[symbol]['position_open']:
-                    positions = _POSITION_CACHE.get_positions(symbol)
+                    positions = _POSITION_CACHE.get_records(symbol)
                     if positions:
                         pos = positions[0]
-                        entry_price = float(pos.get('entryPrice', 0))
-                        position_amt = float(pos.get('positionAmt', 0))
+                        entry_price = pos.entry_price
+                        position_amt = pos.amt
                         
                         # Nếu entry_price = 0 nhưng có vị thế → ép refresh cache và bỏ qua lần này
                         if entry_price == 0 and abs(position_amt) > 0:
@@ -1603,11 +4041,13 @@ class BaseBot:
                 'last_pyramiding_time': 0,
                 'pyramiding_base_roi': 0.0,
                 'high_water_mark_roi': 0,
+                'hwm_price': 0,
+                'exit_ladder': None,
                 'roi_check_activated': False
             })
             self.symbol_data[symbol]['last_close_time'] = time.time()
 
-    # ---------- Mở / Đóng lệnh (ĐÃ SỬA: DÙNG % TỔNG SỐ DƯ + POLLING + KIỂM TRA NGƯỠNG GIÁ) ----------
+    # ---------- Mở / Đóng lệnh (DÙNG % TỔNG SỐ DƯ + XÁC NHẬN KHỚP LỆNH + KIỂM TRA NGƯỠNG GIÁ) ----------
     def _open_symbol_position(self, symbol, side):
         with self.symbol_locks[symbol]:
             try:
@@ -1665,9 +4105,8 @@ class BaseBot:
                         self.stop_symbol(symbol, failed=True)
                         return False
     
-                step_size = get_step_size(symbol)
-                min_qty = get_min_qty_from_cache(symbol)
-                min_notional = get_min_notional_from_cache(symbol)
+                filters = get_symbol_filters(symbol)
+                step_size, min_qty, min_notional = filters.step_size, filters.min_qty, filters.min_notional
     
                 qty = (required_usd * self.lev) / current_price
                 if step_size > 0:
@@ -1691,45 +4130,33 @@ class BaseBot:
                     return False
     
                 cancel_all_orders(symbol, self.api_key, self.api_secret)
-                time.sleep(1)
     
-                result = place_order(symbol, side, qty, self.api_key, self.api_secret)
+                # Chờ xác nhận khớp lệnh (phản hồi RESULT / ORDER_TRADE_UPDATE / truy vấn REST) thay cho sleep + polling
+                result, fill = execute_market_order(symbol, side, qty, self.api_key, self.api_secret)
                 if result and 'orderId' in result:
-                    executed_qty = float(result.get('executedQty', 0))
-                    avg_price = float(result.get('avgPrice', current_price))
-    
-                    if executed_qty < 0:
-                        self.log(f"❌ {symbol} - Lệnh không khớp")
-                        self.stop_symbol(symbol, failed=True)
-                        return False
-    
-                    # Polling: thử refresh cache tối đa 3 lần, mỗi lần cách 1 giây
-                    position_found = False
-                    for attempt in range(3):
-                        time.sleep(1)
+                    if fill is not None:
+                        executed_qty = fill['executedQty']
+                        avg_price = fill['avgPrice']
+                        if executed_qty <= 0 or avg_price <= 0:
+                            self.log(f"❌ {symbol} - Lệnh không khớp ({fill['status']})")
+                            self.stop_symbol(symbol, failed=True)
+                            return False
+                        self.symbol_data[symbol].update({
+                            'entry': avg_price,
+                            'entry_base': avg_price,
+                            'qty': executed_qty if side == "BUY" else -executed_qty,
+                            'side': side,
+                            'position_open': True,
+                            'status': "open",
+                            'last_trade_time': time.time()
+                        })
+                    else:
+                        # Không xác nhận được kết quả lệnh → đối chiếu trực tiếp vị thế một lần
+                        self.log(f"⚠️ {symbol} - Chưa xác nhận được khớp lệnh, kiểm tra lại vị thế")
                         _POSITION_CACHE.refresh(force=True)
                         self._check_symbol_position(symbol)
-                        if self.symbol_data[symbol]['position_open']:
-                            position_found = True
-                            break
-                        else:
-                            self.log(f"⏳ {symbol} - Đợi cache cập nhật vị thế... lần {attempt+1}")
-    
-                    if not position_found:
-                        # Cache vẫn chưa có, thử dùng thông tin từ order nếu hợp lệ
-                        if avg_price > 0 and executed_qty > 0:
-                            self.log(f"⚠️ {symbol} - Cache chưa có vị thế sau 3 lần thử, dùng thông tin từ order tạm thời")
-                            self.symbol_data[symbol].update({
-                                'entry': avg_price,
-                                'entry_base': avg_price,
-                                'qty': executed_qty if side == "BUY" else -executed_qty,
-                                'side': side,
-                                'position_open': True,
-                                'status': "open",
-                                'last_trade_time': time.time()
-                            })
-                        else:
-                            self.log(f"❌ {symbol} - Lệnh đã khớp nhưng không thể xác nhận vị thế và thông tin order không hợp lệ")
+                        if not self.symbol_data[symbol]['position_open']:
+                            self.log(f"❌ {symbol} - Không thể xác nhận vị thế sau khi đặt lệnh")
                             self.stop_symbol(symbol, failed=True)
                             return False
     
@@ -1745,6 +4172,8 @@ class BaseBot:
     
                     self.symbol_data[symbol].update({
                         'high_water_mark_roi': 0,
+                        'hwm_price': 0,
+                        'exit_ladder': None,
                         'roi_check_activated': False,
                         'last_trade_time': time.time(),
                         **pyramiding_info
@@ -1791,7 +4220,7 @@ class BaseBot:
                     return False
 
                 # Lấy khối lượng thực tế từ Binance để đảm bảo chính xác
-                real_pos = self._force_check_position(symbol)
+                real_pos = self._force_check_position(symbol, priority=PRIORITY_CLOSE)
                 if real_pos:
                     qty = abs(float(real_pos.get('positionAmt', 0)))
                     if qty == 0:
@@ -1809,14 +4238,35 @@ class BaseBot:
                 side = self.symbol_data[symbol]['side']
                 close_side = "SELL" if side == "BUY" else "BUY"
 
-                cancel_all_orders(symbol, self.api_key, self.api_secret)
-                time.sleep(1)
+                cancel_all_orders(symbol, self.api_key, self.api_secret, priority=PRIORITY_CLOSE)
 
-                result = place_order(symbol, close_side, qty, self.api_key, self.api_secret)
+                # Lệnh MARKET có thể chỉ khớp một phần (EXPIRED) → đặt tiếp phần còn lại
+                step_size = get_symbol_filters(symbol).step_size
+                remaining = qty
+                for attempt in range(self.close_attempts):
+                    result, fill = execute_market_order(symbol, close_side, remaining, self.api_key, self.api_secret,
+                                                        priority=PRIORITY_CLOSE)
+                    if not result or 'orderId' not in result or fill is None:
+                        break
+                    if fill['executedQty'] <= 0:
+                        self.log(f"❌ Lệnh đóng {symbol} không khớp ({fill['status']})")
+                        return False
+                    remaining = round(remaining - fill['executedQty'], 8)
+                    if remaining < max(step_size / 2, 1e-12):
+                        break
+                    self.log(f"⚠️ Lệnh đóng {symbol} chỉ khớp {fill['executedQty']}/{remaining + fill['executedQty']}, "
+                             f"còn {remaining} (lần {attempt + 1}/{self.close_attempts})")
+                    self.symbol_data[symbol]['qty'] = remaining if side == "BUY" else -remaining
+                else:
+                    # Vẫn còn phần chưa đóng → giữ vị thế mở với khối lượng còn lại, lần kiểm tra sau đóng tiếp
+                    self.log(f"❌ Chưa đóng hết vị thế {symbol}, còn {remaining} – sẽ thử lại")
+                    _POSITION_CACHE.refresh(force=True)
+                    return False
                 if result and 'orderId' in result:
                     self.log(f"🔴 Đã đóng vị thế {symbol} {reason}")
-                    time.sleep(1)
-                    _POSITION_CACHE.refresh(force=True)
+                    # Luồng user-data đã cập nhật PositionCache qua ACCOUNT_UPDATE; chỉ ép REST khi không có luồng
+                    if fill is None or not _POSITION_CACHE.is_streaming():
+                        _POSITION_CACHE.refresh(force=True)
                     self._reset_symbol_position(symbol)
 
                     if self.find_new_bot_after_close and not self.symbol:
@@ -1868,7 +4318,7 @@ class BaseBot:
             return False
 
     # ---------- Kiểm tra TP/SL (ĐÃ SỬA VỚI 3 LỚP BẢO VỆ + LOG) ----------
-    def _check_symbol_tp_sl(self, symbol):
+    def _check_symbol_tp_sl(self, symbol, price=None, received_at=None):
         if symbol not in self.symbol_data:
             return
         data = self.symbol_data[symbol]
@@ -1889,28 +4339,28 @@ class BaseBot:
             self.log(f"⚠️ {symbol} - lev <= 0, bỏ qua TP/SL")
             return
 
-        current_price = self.get_current_price(symbol)
+        if price is not None and self.tp_sl_price != 'mark':
+            current_price = price
+        else:
+            current_price = self._get_tp_sl_price(symbol)
         if current_price <= 0:
             self.log(f"⚠️ {symbol} - current_price <= 0, bỏ qua TP/SL")
             return
 
-        # Tính ROI
-        if data['side'] == 'BUY':
-            roi = (current_price - entry) / entry * 100 * self.lev
-        else:
-            roi = (entry - current_price) / entry * 100 * self.lev
-
-
-        if roi > data['high_water_mark_roi']:
-            data['high_water_mark_roi'] = roi
-
-        if self.tp and roi >= self.tp:
-            self.log(f"🎯 {symbol} - Đạt TP {self.tp}%, đóng lệnh")
-            self._close_symbol_position(symbol, reason=f"(TP {self.tp}%)")
+        # So trực tiếp với thang giá tính sẵn; high-water mark chỉ tính lại khi giá lập đỉnh mới
+        ladder = self._exit_ladder(data)
+        if ladder is None:
             return
-        if self.sl and roi <= -self.sl:
-            self.log(f"🛡️ {symbol} - Đạt SL {self.sl}%, đóng lệnh")
-            self._close_symbol_position(symbol, reason=f"(SL {self.sl}%)")
+        self._update_high_water(data, ladder, current_price)
+        is_buy = ladder['buy']
+        tp_price, sl_price = ladder['tp'], ladder['sl']
+        if tp_price and (current_price >= tp_price if is_buy else current_price <= tp_price):
+            self._fire_exit(symbol, f"(TP {self.tp}%)", received_at,
+                            message=f"🎯 {symbol} - Đạt TP {self.tp}% (giá {current_price} / ngưỡng {tp_price:.6g}), đóng lệnh")
+            return
+        if sl_price and (current_price <= sl_price if is_buy else current_price >= sl_price):
+            self._fire_exit(symbol, f"(SL {self.sl}%)", received_at,
+                            message=f"🛡️ {symbol} - Đạt SL {self.sl}% (giá {current_price} / ngưỡng {sl_price:.6g}), đóng lệnh")
             return
 
     # ---------- Nhồi lệnh (ĐÃ SỬA: DÙNG % TỔNG SỐ DƯ + KIỂM TRA entry + KIỂM TRA NGƯỠNG GIÁ) ----------
@@ -1920,7 +4370,7 @@ class BaseBot:
         if symbol not in self.symbol_data:
             return
         data = self.symbol_data[symbol]
-        if not data['position_open']:
+        if not data['position_open'] or data.get('exit_pending'):
             return
         if data['pyramiding_count'] >= self.pyramiding_n:
             return
@@ -1933,21 +4383,24 @@ class BaseBot:
             self.log(f"⚠️ {symbol} - entry_base <= 0, bỏ qua pyramiding")
             return
     
+        ladder = self._exit_ladder(data)
+        if ladder is None or ladder['pyramid'] is None:
+            return
         current_price = self.get_current_price(symbol)
         if current_price <= 0:
             return
     
-        if data['side'] == 'BUY':
-            roi = (current_price - entry) / entry * 100 * self.lev
-        else:
-            roi = (entry - current_price) / entry * 100 * self.lev
-    
-        next_roi = data['next_pyramiding_roi']
-        if roi >= next_roi:
-            self._pyramid_order(symbol, data['side'])
-            data['pyramiding_count'] += 1
-            data['next_pyramiding_roi'] = next_roi + self.pyramiding_x
-            data['last_pyramiding_time'] = time.time()
+        pyramid_price = ladder['pyramid']
+        if current_price >= pyramid_price if ladder['buy'] else current_price <= pyramid_price:
+            roi = self._roi(entry, current_price, data['side'])
+            # Cùng lock với lệnh đóng: vị thế có thể vừa bị đóng trên luồng tick trong lúc chờ
+            with self.symbol_locks[symbol]:
+                if not data['position_open'] or data.get('exit_pending'):
+                    return
+                self._pyramid_order(symbol, data['side'])
+                data['pyramiding_count'] += 1
+                data['next_pyramiding_roi'] += self.pyramiding_x
+                data['last_pyramiding_time'] = time.time()
             self.log(f"🔄 Nhồi lệnh {symbol} lần {data['pyramiding_count']} tại ROI {roi:.2f}%")
 
     def _pyramid_order(self, symbol, side):
@@ -1978,9 +4431,8 @@ class BaseBot:
                     self.log(f"⚠️ Không nhồi lệnh {symbol}: giá {current_price:.4f} <= ngưỡng bán {sell_threshold}")
                     return
     
-            step_size = get_step_size(symbol)
-            min_qty = get_min_qty_from_cache(symbol)
-            min_notional = get_min_notional_from_cache(symbol)
+            filters = get_symbol_filters(symbol)
+            step_size, min_qty, min_notional = filters.step_size, filters.min_qty, filters.min_notional
     
             qty = (usd_amount * self.lev) / current_price
             if step_size > 0:
@@ -1997,13 +4449,23 @@ class BaseBot:
             if qty <= 0:
                 return
     
-            result = place_order(symbol, side, qty, self.api_key, self.api_secret)
+            result, fill = execute_market_order(symbol, side, qty, self.api_key, self.api_secret)
             if result and 'orderId' in result:
-                executed_qty = float(result.get('executedQty', 0))
-                avg_price = float(result.get('avgPrice', current_price))
+                if fill is None:
+                    # Chưa rõ khối lượng khớp → đồng bộ lại entry/qty từ vị thế thực tế
+                    self.log(f"⚠️ Chưa xác nhận được lệnh nhồi {symbol}, đồng bộ lại vị thế")
+                    real_pos = self._force_check_position(symbol)
+                    if real_pos and float(real_pos.get('entryPrice', 0)) > 0:
+                        self.symbol_data[symbol].update({
+                            'qty': float(real_pos.get('positionAmt', 0)),
+                            'entry': float(real_pos.get('entryPrice', 0)),
+                        })
+                    return
+                executed_qty = fill['executedQty']
+                avg_price = fill['avgPrice'] or current_price
     
-                if executed_qty < 0:
-                    self.log(f"⚠️ Lệnh nhồi {symbol} không khớp")
+                if executed_qty <= 0:
+                    self.log(f"⚠️ Lệnh nhồi {symbol} không khớp ({fill['status']})")
                     return
     
                 old_qty = self.symbol_data[symbol]['qty']
@@ -2021,7 +4483,7 @@ class BaseBot:
             self.log(f"❌ Lỗi nhồi lệnh {symbol}: {str(e)}")
 
     # ---------- Thoát thông minh ----------
-    def _check_smart_exit_condition(self, symbol):
+    def _check_smart_exit_condition(self, symbol, price=None, received_at=None):
         if not self.roi_trigger:
             return False
         if symbol not in self.symbol_data:
@@ -2036,22 +4498,25 @@ class BaseBot:
         if entry <= 0 or qty == 0:
             return False
     
-        current_price = self.get_current_price(symbol)
+        ladder = self._exit_ladder(data)
+        if ladder is None or ladder['roi_trigger'] is None:
+            return False
+        current_price = price if price is not None else self.get_current_price(symbol)
         if current_price <= 0:
             return False
     
-        if data['side'] == 'BUY':
-            roi = (current_price - entry) / entry * 100 * self.lev
-        else:
-            roi = (entry - current_price) / entry * 100 * self.lev
-    
-        if roi >= self.roi_trigger and not data['roi_check_activated']:
+        is_buy = ladder['buy']
+        if not data['roi_check_activated'] and (
+                current_price >= ladder['roi_trigger'] if is_buy else current_price <= ladder['roi_trigger']):
             data['roi_check_activated'] = True
-            self.log(f"🎯 ROI đạt {roi:.2f}% - Kích hoạt chốt lời sớm")
+            self.log(f"🎯 ROI đạt {self._roi(entry, current_price, data['side']):.2f}% - Kích hoạt chốt lời sớm")
     
-        if data['roi_check_activated'] and roi < data['high_water_mark_roi'] * 0.9:
-            self._close_symbol_position(symbol, reason=f"(Smart exit - ROI từ {data['high_water_mark_roi']:.2f}% giảm còn {roi:.2f}%)")
-            return True
+        trail_price = data.get('trail_price')
+        if data['roi_check_activated'] and trail_price is not None and (
+                current_price < trail_price if is_buy else current_price > trail_price):
+            roi = self._roi(entry, current_price, data['side'])
+            return self._fire_exit(symbol, f"(Smart exit - ROI từ {data['high_water_mark_roi']:.2f}% giảm còn {roi:.2f}%)",
+                                   received_at)
         return False
 
     # ---------- Kiểm tra toàn cục ----------
@@ -2110,8 +4575,17 @@ class GlobalMarketBot(BaseBot):
 
 # ========== LỚP QUẢN LÝ BOT ==========
 class BotManager:
-    def __init__(self, api_key=None, api_secret=None, telegram_bot_token=None, telegram_chat_id=None):
-        self.ws_manager = WebSocketManager()
+    def __init__(self, api_key=None, api_secret=None, telegram_bot_token=None, telegram_chat_id=None,
+                 http_pool_size=None, market_streams=None, user_stream=True, ws_connections=None,
+                 price_stream=None):
+        # Giá theo symbol của mọi bot đi chung vài kết nối combined-stream (BINANCE_WS_CONNECTIONS, mặc định 4)
+        if ws_connections is None:
+            ws_connections = int(os.getenv('BINANCE_WS_CONNECTIONS', '4'))
+        # Loại stream giá mặc định: trade | aggTrade | bookTicker | markPrice (BINANCE_PRICE_STREAM)
+        if price_stream is None:
+            price_stream = os.getenv('BINANCE_PRICE_STREAM', 'aggTrade')
+        self.ws_manager = WebSocketManager(max_connections=ws_connections, default_stream_type=price_stream,
+                                           stall_after=float(os.getenv('BINANCE_WS_STALL_AFTER', '30')))
         self.bots = {}
         self.running = True
         self.start_time = time.time()
@@ -2127,15 +4601,36 @@ class BotManager:
         self.symbol_locks = defaultdict(threading.RLock)
         self.global_side_coordinator = GlobalSideCoordinator()
 
+        if http_pool_size:
+            _HTTP_TRANSPORT.set_pool_size(http_pool_size)
+            _REQUEST_SCHEDULER.set_max_in_flight(http_pool_size)
+
+        # Luồng giá/volume toàn thị trường – tắt bằng market_streams=() hoặc BINANCE_MARKET_STREAMS=""
+        if market_streams is None:
+            market_streams = [s.strip() for s in os.getenv('BINANCE_MARKET_STREAMS', 'markPrice,miniTicker').split(',') if s.strip()]
+        self.market_stream = MarketDataStream(_COINS_CACHE, streams=market_streams)
+        self.refresh_scheduler = CacheRefreshScheduler()
+        self.user_stream = None
+
         if api_key and api_secret:
             _POSITION_CACHE.initialize(api_key, api_secret)
+            _HTTP_TRANSPORT.warm_up([_BINANCE_REST_BASE])
+            _TIME_SYNC.sync()
+            if user_stream:
+                # Vị thế được đẩy qua listenKey; polling 5s chỉ còn là đối soát định kỳ
+                self.user_stream = UserDataStream(api_key, _POSITION_CACHE, _ACCOUNT_CACHE)
+                self.user_stream.add_listener('ORDER_TRADE_UPDATE', _ORDER_TRACKER.on_order_update)
+                _POSITION_CACHE.attach_stream(self.user_stream)
+                self.user_stream.start()
             self._verify_api_connection()
             self.log("🟢 HỆ THỐNG BOT CÂN BẰNG LỆNH (USDT/USDC) ĐÃ KHỞI ĐỘNG")
             self._initialize_cache()
-            self._cache_thread = threading.Thread(target=self._cache_updater, daemon=True, name='cache_updater')
-            self._cache_thread.start()
+            self.market_stream.start()
+            self._start_refresh_scheduler()
             self._position_cache_thread = threading.Thread(target=self._position_cache_updater, daemon=True, name='pos_cache')
             self._position_cache_thread.start()
+            self._time_sync_thread = threading.Thread(target=self._time_sync_updater, daemon=True, name='time_sync')
+            self._time_sync_thread.start()
             self.telegram_thread = threading.Thread(target=self._telegram_listener, daemon=True, name='telegram')
             self.telegram_thread.start()
             if self.telegram_chat_id:
@@ -2144,25 +4639,48 @@ class BotManager:
             self.log("⚡ BotManager đã khởi động ở chế độ không cấu hình")
 
     def _initialize_cache(self):
+        # Khởi động lại: dùng ngay snapshot trên đĩa, làm mới ở nền (xem _start_refresh_scheduler)
+        if _COIN_CACHE_SNAPSHOT_PATH and _COINS_CACHE.load(_COIN_CACHE_SNAPSHOT_PATH):
+            return
         logger.info("🔄 Hệ thống đang khởi tạo cache...")
         if refresh_coins_cache():
             update_coins_volume()
             update_coins_price()
-            coins_count = len(_COINS_CACHE.get_data())
+            coins_count = _COINS_CACHE.count()
             logger.info(f"✅ Hệ thống đã khởi tạo cache {coins_count} coin")
+            if _COIN_CACHE_SNAPSHOT_PATH:
+                self._persist_coin_cache()
         else:
             logger.error("❌ Hệ thống không thể khởi tạo cache")
 
-    def _cache_updater(self):
-        while self.running:
-            try:
-                time.sleep(300)  # 5 phút
-                logger.info("🔄 Tự động làm mới cache...")
-                refresh_coins_cache()
-                update_coins_volume()
-                update_coins_price()
-            except Exception as e:
-                logger.error(f"❌ Lỗi làm mới cache tự động: {str(e)}")
+    def _start_refresh_scheduler(self):
+        """Mỗi tập dữ liệu một TTL: exchangeInfo (nặng, ít đổi), volume 24h (trọng số 40), giá"""
+        ttl = _COINS_CACHE.get_stats()
+        self.refresh_scheduler.register('exchangeInfo', refresh_coins_cache, ttl['exchange_info_ttl'])
+        self.refresh_scheduler.register('volumes', self._refresh_volumes, ttl['volume_cache_ttl'])
+        self.refresh_scheduler.register('prices', self._refresh_prices, ttl['price_cache_ttl'])
+        if _COIN_CACHE_SNAPSHOT_PATH:
+            self.refresh_scheduler.register('snapshot', self._persist_coin_cache, 60)
+        if ttl['stale']:
+            self.refresh_scheduler.trigger()
+        self.refresh_scheduler.start()
+
+    def _persist_coin_cache(self):
+        try:
+            _COINS_CACHE.save(_COIN_CACHE_SNAPSHOT_PATH)
+        except OSError as e:
+            logger.warning(f"⚠️ Không ghi được snapshot cache coin: {str(e)}")
+        return True
+
+    def _refresh_prices(self):
+        if self.market_stream.is_fresh():
+            return True   # Luồng WebSocket đang cập nhật giá liên tục
+        return update_coins_price()
+
+    def _refresh_volumes(self):
+        if self.market_stream.is_fresh() and 'miniTicker' in self.market_stream.streams:
+            return True
+        return update_coins_volume()
 
     def _position_cache_updater(self):
         while self.running:
@@ -2172,6 +4690,15 @@ class BotManager:
             except Exception as e:
                 logger.error(f"❌ Lỗi làm mới cache vị thế: {str(e)}")
 
+    def _time_sync_updater(self):
+        while self.running:
+            try:
+                time.sleep(30)
+                if _TIME_SYNC.needs_sync():
+                    _TIME_SYNC.sync()
+            except Exception as e:
+                logger.error(f"❌ Lỗi đồng bộ giờ server: {str(e)}")
+
     def _verify_api_connection(self):
         try:
             balance = get_balance(self.api_key, self.api_secret)
@@ -2185,6 +4712,23 @@ class BotManager:
             self.log(f"❌ Lỗi kiểm tra kết nối: {str(e)}")
             return False
 
+    def get_stream_report(self):
+        """Báo cáo luồng giá theo symbol (độ trễ, im lặng) cho Telegram"""
+        symbol_stats = self.ws_manager.get_symbol_stats()
+        if not symbol_stats:
+            return "📭 Không có luồng giá nào đang chạy."
+        report = "📶 **LUỒNG GIÁ THEO COIN**\n\n"
+        for symbol, st in sorted(symbol_stats.items(), key=lambda item: -item[1]['lag_ms']['p99']):
+            lag = st['lag_ms']
+            report += (f"{symbol} ({st['stream_type']}) | {st['messages']} tin | tin cuối {st['last_message_age']:.1f}s | "
+                       f"trễ p50/p99 {lag['p50']:.0f}/{lag['p99']:.0f}ms | chờ p99 {st['queue_lag_ms']['p99']:.0f}ms")
+            if st['stalls']:
+                report += f" | im lặng {st['stalls']} lần"
+            if st['reconnects'] or st['downtime_s']:
+                report += f" | kết nối lại {st['reconnects']} lần, mất {st['downtime_s']:.0f}s"
+            report += "\n"
+        return report
+
     def get_position_summary(self):
         try:
             long_count, short_count, long_pnl, short_pnl = _POSITION_CACHE.get_counts_and_pnl()
@@ -2235,6 +4779,72 @@ class BotManager:
             update_time = time.ctime(last_price_update) if last_price_update > 0 else "Chưa cập nhật"
 
             summary += f"🗂️ **CACHE HỆ THỐNG**: {coins_in_cache} coin | Cập nhật: {update_time}\n"
+            refresh_stats = self.refresh_scheduler.get_stats()
+            if refresh_stats:
+                summary += "♻️ **LÀM MỚI CACHE**: " + " | ".join(
+                    f"{name} {st['staleness']:.0f}s trước ({st['last_duration_ms']:.0f}ms, lỗi {st['failures']})"
+                    for name, st in refresh_stats.items()) + "\n"
+            if self.user_stream:
+                user_stats = self.user_stream.get_stats()
+                position_stats = _POSITION_CACHE.get_stats()
+                latency = user_stats['avg_latency_ms']
+                summary += (f"👤 **LUỒNG TÀI KHOẢN**: {'🟢' if user_stats['healthy'] else '🔴'} "
+                            f"{sum(user_stats['events'].values())} sự kiện | "
+                            f"trễ TB {f'{latency:.0f}ms' if latency is not None else 'N/A'} | "
+                            f"đồng bộ lại {user_stats['resyncs']} | lệch khi đối soát {position_stats['reconcile_diffs']}\n")
+            exit_stats = [bot.get_exit_stats() for bot in self.bots.values()]
+            if any(st['tick'] or st['loop'] for st in exit_stats):
+                latencies = [st['latency_ms_p50'] for st in exit_stats if st['latency_ms_p50'] is not None]
+                worst = max((st['latency_ms_max'] for st in exit_stats if st['latency_ms_max'] is not None), default=None)
+                summary += (f"⚡ **THOÁT LỆNH**: theo tick {sum(st['tick'] for st in exit_stats)} | "
+                            f"vòng lặp {sum(st['loop'] for st in exit_stats)} | chặn trùng {sum(st['debounced'] for st in exit_stats)}")
+                if latencies:
+                    summary += f" | tick→quyết định p50 {sorted(latencies)[len(latencies) // 2]:.1f}ms, max {worst:.1f}ms"
+                summary += "\n"
+            order_stats = _ORDER_TRACKER.get_stats()
+            if order_stats['resolved_by'] or order_stats['timeouts']:
+                resolved = order_stats['resolved_by']
+                summary += (f"🧾 **XÁC NHẬN LỆNH**: phản hồi {resolved.get('response', 0)} | "
+                            f"luồng {resolved.get('stream', 0)} | REST {resolved.get('rest', 0)} | "
+                            f"quá hạn {order_stats['timeouts']} | chờ TB {order_stats['avg_wait_ms']:.0f}ms\n")
+            stream_stats = self.market_stream.get_stats()
+            if stream_stats['streams']:
+                age = stream_stats['last_message_age']
+                summary += (f"📡 **LUỒNG THỊ TRƯỜNG**: {'🟢' if stream_stats['fresh'] else '🔴'} "
+                            f"{stream_stats['messages']} tin | tin cuối {f'{age:.1f}s' if age is not None else 'N/A'} trước | "
+                            f"kết nối lại {stream_stats['reconnects']} | fallback REST {stream_stats['fallbacks']}\n")
+            ws_stats = self.ws_manager.get_stats()
+            if ws_stats['connections']:
+                summary += (f"📶 **WEBSOCKET GIÁ**: {ws_stats['connected']}/{ws_stats['connections']} kết nối | "
+                            f"{ws_stats['streams']} stream ({'/'.join(map(str, ws_stats['streams_per_connection']))}) | "
+                            f"{ws_stats['messages_per_sec']:.1f} tin/s | tick {ws_stats['ticks_received']} "
+                            f"(gộp {ws_stats['ticks_conflated']}, giao {ws_stats['ticks_delivered']}) | "
+                            f"kết nối lại {ws_stats['reconnects']} (mất {ws_stats['downtime_s']:.0f}s)\n")
+                lag, queue_lag = ws_stats['lag_ms'], ws_stats['queue_lag_ms']
+                summary += (f"   ⏱️ Trễ từ sàn p50/p99: {lag['p50']:.0f}/{lag['p99']:.0f}ms (max {lag['max']:.0f}) | "
+                            f"chờ executor p99: {queue_lag['p99']:.0f}ms | im lặng → đăng ký lại: {ws_stats['stalls']}\n")
+                for stream_type, st in ws_stats['by_stream_type'].items():
+                    summary += (f"   • {stream_type}: {st['symbols']} coin | {st['messages_per_sec']:.1f} tin/s | "
+                                f"parse {st['parse_us_per_message']:.0f}µs/tin ({st['parse_ms_per_sec']:.1f}ms CPU/s)\n")
+            http_stats = _HTTP_TRANSPORT.get_stats()
+            summary += (f"🔌 **KẾT NỐI HTTP**: hit={http_stats['hits']} | miss={http_stats['misses']} | "
+                        f"tỷ lệ tái sử dụng {http_stats['hit_rate'] * 100:.1f}%\n")
+            rate_stats = _RATE_LIMITER.get_stats()
+            summary += (f"⏱️ **GIỚI HẠN API**: còn {rate_stats['remaining']['weight']:.0f}/{_BINANCE_WEIGHT_LIMIT_1M} trọng số | "
+                        f"bị giãn {rate_stats['throttled']}/{rate_stats['requests']} request\n")
+            lane_stats = _REQUEST_SCHEDULER.get_stats()['lanes']
+            time_stats = _TIME_SYNC.get_stats()
+            rtt_text = f"{time_stats['rtt_ms']:.0f}ms" if time_stats['rtt_ms'] is not None else "N/A"
+            summary += (f"🕒 **GIỜ SERVER**: lệch {time_stats['offset_ms']:.0f}ms | trôi {time_stats['drift_ms']:.0f}ms | "
+                        f"RTT {rtt_text} | recvWindow {time_stats['recv_window']}ms\n")
+            breaker_stats = _CIRCUIT_BREAKERS.get_stats()
+            open_breakers = [name for name, st in breaker_stats.items() if st['state'] != CircuitBreaker.CLOSED]
+            summary += f"🧯 **NGẮT MẠCH**: {', '.join(open_breakers) if open_breakers else 'Tất cả bình thường'}\n"
+            dedup_stats = _SINGLE_FLIGHT.get_stats()
+            summary += (f"🔁 **GỘP REQUEST**: {dedup_stats['deduplicated']} lần gọi trùng được gộp | "
+                        f"tiết kiệm {dedup_stats['saved_weight']} trọng số\n")
+            summary += "🚦 **CHỜ THEO LÀN**: " + " | ".join(
+                f"{name}={lane['avg_wait_ms']:.0f}ms (max {lane['max_wait_ms']:.0f})" for name, lane in lane_stats.items()) + "\n"
             summary += f"⚖️ **BOT CÂN BẰNG**: {balance_bots}/{len(self.bots)} bot\n"
             summary += f"📊 **SẮP XẾP COIN**: Theo khối lượng giảm dần (BẬT)\n\n"
 
@@ -2351,6 +4961,9 @@ class BotManager:
         enable_balance_orders = kwargs.get('enable_balance_orders', True)
         buy_price_threshold = kwargs.get('buy_price_threshold', 1.0)
         sell_price_threshold = kwargs.get('sell_price_threshold', 10.0)
+        price_stream = kwargs.get('price_stream')
+        tp_sl_price = kwargs.get('tp_sl_price')
+        exit_mode = kwargs.get('exit_mode')
 
         created_count = 0
 
@@ -2373,6 +4986,7 @@ class BotManager:
                     enable_balance_orders=enable_balance_orders,
                     buy_price_threshold=buy_price_threshold,
                     sell_price_threshold=sell_price_threshold,
+                    price_stream=price_stream, tp_sl_price=tp_sl_price, exit_mode=exit_mode,
                     strategy_name=strategy_type
                 )
                 bot._bot_manager = self
@@ -2551,6 +5165,10 @@ class BotManager:
             send_telegram(summary, chat_id=chat_id,
                          bot_token=self.telegram_bot_token, default_chat_id=self.telegram_chat_id)
 
+        elif text == "📶 Luồng giá":
+            send_telegram(self.get_stream_report(), chat_id=chat_id,
+                         bot_token=self.telegram_bot_token, default_chat_id=self.telegram_chat_id)
+
         elif text == "➕ Thêm Bot":
             self.user_states[chat_id] = {'step': 'waiting_bot_mode'}
             send_telegram("🤖 Chọn chế độ bot:", chat_id=chat_id, reply_markup=create_bot_mode_keyboard(),
@@ -2581,20 +5199,15 @@ class BotManager:
 
         elif text == "📈 Vị thế":
             long_count, short_count, long_pnl, short_pnl = _POSITION_CACHE.get_counts_and_pnl()
-            positions = _POSITION_CACHE.get_positions()
+            positions = _POSITION_CACHE.get_records()
             if not positions:
                 send_telegram("📭 Không có vị thế nào đang mở.", chat_id=chat_id,
                              bot_token=self.telegram_bot_token, default_chat_id=self.telegram_chat_id)
             else:
                 msg = "📈 **VỊ THẾ ĐANG MỞ**\n\n"
                 for pos in positions:
-                    amt = float(pos.get('positionAmt', 0))
-                    if amt != 0:
-                        symbol = pos['symbol']
-                        entry = float(pos.get('entryPrice', 0))
-                        pnl = float(pos.get('unRealizedProfit', 0))
-                        side = "LONG" if amt > 0 else "SHORT"
-                        msg += f"{symbol} | {side} | Entry: {entry:.4f} | PnL: {pnl:.2f}\n"
+                    side = "LONG" if pos.amt > 0 else "SHORT"
+                    msg += f"{pos.symbol} | {side} | Entry: {pos.entry_price:.4f} | PnL: {pos.unrealized_pnl:.2f}\n"
                 send_telegram(msg, chat_id=chat_id,
                              bot_token=self.telegram_bot_token, default_chat_id=self.telegram_chat_id)
 
@@ -2910,7 +5523,7 @@ class BotManager:
                     f"• Đòn bẩy tối thiểu: {_BALANCE_CONFIG.get('min_leverage', 10)}x (kiểm tra thực tế)\n"
                     f"• Sắp xếp coin: {sort_status}\n\n"
                     f"🔄 <b>CACHE HỆ THỐNG</b>\n"
-                    f"• Số coin: {len(_COINS_CACHE.get_data())}\n"
+                    f"• Số coin: {_COINS_CACHE.count()}\n"
                     f"• Cập nhật giá: {time.ctime(_COINS_CACHE.get_stats()['last_price_update'])}\n"
                     f"• Cập nhật volume: {time.ctime(_COINS_CACHE.get_stats()['last_volume_update'])}"
                 )